@@ -2,9 +2,19 @@ import os
 import sys
 import json
 import platform
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+from crew_progress import (
+    ToolRunContext, attach_run_context, is_tool_cancelled, lookup_tool_page, tool_near_duplicate_of,
+)
+
+# Ответ инструмента, если анализ отменён: агент получает его вместо данных, а Crew
+# останавливается на следующем шаге (step_callback)
+CANCELLED_TOOL_RESULT = "Анализ отменён пользователем. Прекрати работу и не вызывай инструменты."
+
 # ВАЖНО: Отключаем телеметрию CrewAI ДО импорта модуля
 # Это должно быть сделано до загрузки dotenv, чтобы переменные были установлены как можно раньше
 os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "1"
@@ -110,12 +120,54 @@ write_debug_log({
 })
 # #endregion
 
+def _collapse_near_duplicate(tool, url, text):
+    """Текст страницы или короткая пометка, если в задаче инструмента агентам уже отдана почти такая же страница."""
+    duplicate_of = tool_near_duplicate_of(tool, url, text)
+    if duplicate_of is None:
+        return text
+    return (f"Страница {url} почти полностью совпадает с уже полученной {duplicate_of} "
+            f"(версия для печати, копия или языковая заглушка) — используй данные той страницы.")
+
+
+def _goto_scheduled(page, url):
+    """Переход Playwright к url в очереди fetch_scheduler (лимиты домена, паузы после 429/503)."""
+    import fetch_scheduler
+    with fetch_scheduler.slot(url):
+        response = page.goto(url, wait_until="domcontentloaded", timeout=20000)
+    if response is not None:
+        fetch_scheduler.report(url, response.status, response.headers)
+    return response
+
+
+def _format_site_links(html, url):
+    """Внутренние ссылки страницы в формате [текст](url) — ответ инструментов извлечения ссылок."""
+    from urllib.parse import urlparse
+    from html_extract import extract_links
+
+    base_netloc = urlparse(url).netloc.lower()
+    seen = set()
+    lines = []
+    for abs_url, text in extract_links(html, url):
+        if urlparse(abs_url).netloc.lower() != base_netloc:
+            continue  # только ссылки того же домена
+        text = text[:80] or abs_url
+        key = (abs_url, text)
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(f"- [{text}]({abs_url})")
+    if not lines:
+        return f"На странице {url} не найдено внутренних ссылок."
+    return "Ссылки со страницы:\n" + "\n".join(lines)
+
+
 # Кастомный инструмент для извлечения РЕАЛЬНЫХ ссылок с HTML-страницы
 if CREWAI_IMPORTED:
     try:
-        import requests
-        from urllib.parse import urljoin, urlparse
-        from bs4 import BeautifulSoup
+        import http_cache
+        from html_extract import HTML_PARSER_AVAILABLE
+        if not HTML_PARSER_AVAILABLE:
+            raise ImportError("нет парсера HTML: установите lxml или beautifulsoup4")
 
         class ExtractLinksInput(BaseModel):
             """Входные данные для извлечения ссылок со страницы."""
@@ -131,38 +183,23 @@ if CREWAI_IMPORTED:
             args_schema: type[BaseModel] = ExtractLinksInput
 
             def _run(self, url: str) -> str:
+                if is_tool_cancelled(self):
+                    return CANCELLED_TOOL_RESULT
                 try:
-                    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-                    r = requests.get(url, headers=headers, timeout=15)
-                    r.raise_for_status()
-                    r.encoding = r.apparent_encoding or "utf-8"
-                    soup = BeautifulSoup(r.text, "html.parser")
-                    base = urlparse(url)
-                    base_netloc = base.netloc
-                    seen = set()
-                    lines = []
-                    for a in soup.find_all("a", href=True):
-                        href = (a["href"] or "").strip()
-                        if not href or href.startswith(("#", "javascript:", "mailto:")):
-                            continue
-                        abs_url = urljoin(url, href)
-                        try:
-                            parsed = urlparse(abs_url)
-                            if parsed.netloc and parsed.netloc.lower() != base_netloc.lower():
-                                continue  # только ссылки того же домена
-                        except Exception:
-                            continue
-                        text = (a.get_text() or href).strip()[:80]
-                        if not text:
-                            text = abs_url
-                        key = (abs_url, text)
-                        if key in seen:
-                            continue
-                        seen.add(key)
-                        lines.append(f"- [{text}]({abs_url})")
-                    if not lines:
-                        return f"На странице {url} не найдено внутренних ссылок."
-                    return "Ссылки со страницы:\n" + "\n".join(lines)
+                    # Страница уже загружена в этой задаче (например, главная при проверке доступности)
+                    page = lookup_tool_page(self, url)
+                    if page is not None and page.is_html:
+                        html = page.text
+                    else:
+                        # Потоком и с пределом размера: файл по ссылке (PDF, видео) не скачивается целиком
+                        r = http_cache.get(url, timeout=15, page=True)
+                        r.raise_for_status()
+                        if getattr(r, "skipped", False):
+                            content_type = r.headers.get("Content-Type") or "неизвестный тип"
+                            return f"{url} — не HTML-страница ({content_type}), ссылок нет."
+                        r.encoding = r.apparent_encoding or "utf-8"
+                        html = r.text
+                    return _format_site_links(html, url)
                 except Exception as e:
                     return f"Ошибка при извлечении ссылок с {url}: {e}"
 
@@ -172,13 +209,41 @@ if CREWAI_IMPORTED:
         ExtractSiteLinksTool = None
         print(f"⚠️  ExtractSiteLinksTool недоступен: {e}")
 
+    # ScrapeWebsiteTool с хранилищем страниц задачи: главная страница, загруженная при проверке
+    # доступности, отдаётся без повторного запроса; остальные URL — как в исходном инструменте.
+    # Почти повторяющийся текст уже полученной страницы заменяется короткой пометкой,
+    # а загрузка из сети идёт в общей очереди запросов к домену (fetch_scheduler)
+    SeededScrapeWebsiteTool = None
+    if SCRAPE_TOOL_AVAILABLE:
+        try:
+            import fetch_scheduler
+            from html_extract import extract_text
+
+            class SeededScrapeWebsiteTool(ScrapeWebsiteTool):
+                def _run(self, **kwargs):
+                    if is_tool_cancelled(self):
+                        return CANCELLED_TOOL_RESULT
+                    website_url = kwargs.get("website_url", getattr(self, "website_url", None))
+                    page = lookup_tool_page(self, website_url)
+                    if page is None or not page.is_html:
+                        # Исходный инструмент ходит в сеть сам — запрос всё равно ждёт очереди домена
+                        try:
+                            with fetch_scheduler.slot(website_url or ""):
+                                text = super()._run(**kwargs)
+                        except fetch_scheduler.FetchSlotTimeout as e:
+                            return f"{website_url}: {e}. Используй уже полученные данные или попробуй позже."
+                    else:
+                        text = extract_text(page.text)
+                    return _collapse_near_duplicate(self, website_url, text)
+        except Exception as e:
+            SeededScrapeWebsiteTool = None
+            print(f"⚠️  Хранилище страниц для ScrapeWebsiteTool недоступно: {e}")
+
     # Playwright-инструменты — fallback для сайтов с защитой от ботов (Tatneft и подобные)
     # Аргументы для Chromium: обязательны на VPS/Linux/Docker (headless без display)
     _CHROMIUM_ARGS = ["--no-sandbox", "--disable-dev-shm-usage"]
     try:
         from playwright.sync_api import sync_playwright  # type: ignore[import-untyped]
-        from urllib.parse import urljoin, urlparse
-        from bs4 import BeautifulSoup
 
         class ScrapeWithPlaywrightInput(BaseModel):
             url: str = Field(..., description="URL страницы")
@@ -192,26 +257,36 @@ if CREWAI_IMPORTED:
             args_schema: type[BaseModel] = ScrapeWithPlaywrightInput
 
             def _run(self, url: str) -> str:
+                if is_tool_cancelled(self):
+                    return CANCELLED_TOOL_RESULT
                 try:
                     with sync_playwright() as p:
                         browser = p.chromium.launch(headless=True, args=_CHROMIUM_ARGS)
-                        ctx = browser.new_context(
-                            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-                            viewport={"width": 1920, "height": 1080},
-                        )
-                        page = ctx.new_page()
-                        page.goto(url, wait_until="domcontentloaded", timeout=20000)
-                        page.wait_for_timeout(2000)
-                        for sel in ['button:has-text("Принять")', 'button:has-text("Согласен")', '[data-testid="accept-cookies"]', '.cookie-accept', '#accept-cookies']:
-                            try:
-                                if page.locator(sel).count() > 0:
-                                    page.locator(sel).first.click(timeout=3000)
-                                    page.wait_for_timeout(1000)
-                                    break
-                            except Exception:
-                                pass
-                        text = page.inner_text("body", timeout=5000) or ""
-                        browser.close()
+                        try:
+                            ctx = browser.new_context(
+                                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
+                                viewport={"width": 1920, "height": 1080},
+                            )
+                            page = ctx.new_page()
+                            _goto_scheduled(page, url)
+                            if is_tool_cancelled(self):
+                                return CANCELLED_TOOL_RESULT
+                            page.wait_for_timeout(2000)
+                            for sel in ['button:has-text("Принять")', 'button:has-text("Согласен")', '[data-testid="accept-cookies"]', '.cookie-accept', '#accept-cookies']:
+                                try:
+                                    if page.locator(sel).count() > 0:
+                                        page.locator(sel).first.click(timeout=3000)
+                                        page.wait_for_timeout(1000)
+                                        break
+                                except Exception:
+                                    pass
+                            if is_tool_cancelled(self):
+                                return CANCELLED_TOOL_RESULT
+                            text = page.inner_text("body", timeout=5000) or ""
+                        finally:
+                            # Браузер закрывается и при ошибке, и при отмене анализа
+                            browser.close()
+                        text = _collapse_near_duplicate(self, url, text)
                         return (text[:15000] + "\n...[обрезано]") if len(text) > 15000 else text
                 except Exception as e:
                     return f"Ошибка Playwright для {url}: {e}"
@@ -228,42 +303,30 @@ if CREWAI_IMPORTED:
             args_schema: type[BaseModel] = ExtractLinksPlaywrightInput
 
             def _run(self, url: str) -> str:
+                if is_tool_cancelled(self):
+                    return CANCELLED_TOOL_RESULT
                 try:
                     with sync_playwright() as p:
                         browser = p.chromium.launch(headless=True, args=_CHROMIUM_ARGS)
-                        ctx = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36")
-                        page = ctx.new_page()
-                        page.goto(url, wait_until="domcontentloaded", timeout=20000)
-                        page.wait_for_timeout(2000)
-                        for sel in ['button:has-text("Принять")', 'button:has-text("Согласен")', '.cookie-accept']:
-                            try:
-                                if page.locator(sel).count() > 0:
-                                    page.locator(sel).first.click(timeout=2000)
-                                    page.wait_for_timeout(800)
-                                    break
-                            except Exception:
-                                pass
-                        html = page.content()
-                        browser.close()
-                    soup = BeautifulSoup(html, "html.parser")
-                    base_netloc = urlparse(url).netloc.lower()
-                    seen, lines = set(), []
-                    for a in soup.find_all("a", href=True):
-                        href = (a["href"] or "").strip()
-                        if not href or href.startswith(("#", "javascript:", "mailto:")):
-                            continue
-                        abs_url = urljoin(url, href)
                         try:
-                            if urlparse(abs_url).netloc.lower() != base_netloc:
-                                continue
-                        except Exception:
-                            continue
-                        text = (a.get_text() or href).strip()[:80] or abs_url
-                        key = (abs_url, text)
-                        if key not in seen:
-                            seen.add(key)
-                            lines.append(f"- [{text}]({abs_url})")
-                    return "Ссылки со страницы:\n" + "\n".join(lines) if lines else f"На странице {url} не найдено внутренних ссылок."
+                            ctx = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36")
+                            page = ctx.new_page()
+                            _goto_scheduled(page, url)
+                            if is_tool_cancelled(self):
+                                return CANCELLED_TOOL_RESULT
+                            page.wait_for_timeout(2000)
+                            for sel in ['button:has-text("Принять")', 'button:has-text("Согласен")', '.cookie-accept']:
+                                try:
+                                    if page.locator(sel).count() > 0:
+                                        page.locator(sel).first.click(timeout=2000)
+                                        page.wait_for_timeout(800)
+                                        break
+                                except Exception:
+                                    pass
+                            html = page.content()
+                        finally:
+                            browser.close()
+                    return _format_site_links(html, url)
                 except Exception as e:
                     return f"Ошибка ExtractLinksWithPlaywright для {url}: {e}"
 
@@ -279,6 +342,7 @@ else:
     PLAYWRIGHT_AVAILABLE = False
     ScrapeWithPlaywrightTool = None
     ExtractLinksWithPlaywrightTool = None
+    SeededScrapeWebsiteTool = None
 
 # Настройка переменных окружения для OpenAI
 api_key = os.getenv("OPENAI_API_KEY")
@@ -325,14 +389,9 @@ if api_base:
 
 # Инициализируем переменные по умолчанию
 # ВАЖНО: При повторном импорте модуля (Flask reloader) все переменные сбрасываются
-# Поэтому crew будет пересоздан при каждом импорте, что нормально
-web_scraper_agent = None
-data_analyzer_agent = None
-bi_engineer_agent = None
-task_1_scrape = None
-task_2_analyze = None
-task_3_report = None
+# Поэтому пул crew будет пересоздан при каждом импорте, что нормально
 crew = None
+crew_pool = None
 
 # Пропускаем создание только в основном процессе Flask reloader
 is_werkzeug_main = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
@@ -341,47 +400,42 @@ use_reloader = os.getenv('FLASK_DEBUG', 'True').lower() == 'true' and (
 )
 _skip_creation = use_reloader and not is_werkzeug_main
 
-if not CREWAI_IMPORTED:
-    print("ОШИБКА: CrewAI не установлен. Установите: pip install crewai>=0.11.2")
-elif _skip_creation:
-    print("ℹ Flask reloader: пропускаем создание в основном процессе")
-else:
-    # ============================================================================
-    # АГЕНТ 1: Web Scraper (Считыватель информации с корпоративного сайта)
-    # ============================================================================
-    
-    try:
-        # #region agent log
+
+def _create_scraper_tools():
+    """Создаёт новый набор инструментов скрапинга (экземпляры не разделяются между Crew)."""
+    # Playwright — первым для сайтов с защитой (Tatneft, и др.): браузер обходит антибот.
+    scraper_tools = []
+    if PLAYWRIGHT_AVAILABLE and ScrapeWithPlaywrightTool:
         try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:108","message":"Создание Web Scraper Agent","data":{"CREWAI_IMPORTED":CREWAI_IMPORTED,"Agent_class":str(Agent) if Agent else None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        # Создаем инструмент для скрапинга (только для указанного сайта)
-        # Playwright — первым для сайтов с защитой (Tatneft, и др.): браузер обходит антибот.
-        scraper_tools = []
-        if PLAYWRIGHT_AVAILABLE and ScrapeWithPlaywrightTool:
-            try:
-                scraper_tools.append(ScrapeWithPlaywrightTool())
-            except Exception as e:
-                print(f"⚠️  Не удалось создать ScrapeWithPlaywrightTool: {e}")
-        if PLAYWRIGHT_AVAILABLE and ExtractLinksWithPlaywrightTool:
-            try:
-                scraper_tools.append(ExtractLinksWithPlaywrightTool())
-            except Exception as e:
-                print(f"⚠️  Не удалось создать ExtractLinksWithPlaywrightTool: {e}")
-        if SCRAPE_TOOL_AVAILABLE:
-            try:
-                scraper_tools.append(ScrapeWebsiteTool())
-            except Exception as e:
-                print(f"⚠️  Не удалось создать ScrapeWebsiteTool: {e}")
-        if EXTRACT_LINKS_AVAILABLE and ExtractSiteLinksTool:
-            try:
-                scraper_tools.append(ExtractSiteLinksTool())
-            except Exception as e:
-                print(f"⚠️  Не удалось создать ExtractSiteLinksTool: {e}")
-        
-        web_scraper_agent = Agent(
+            scraper_tools.append(ScrapeWithPlaywrightTool())
+        except Exception as e:
+            print(f"⚠️  Не удалось создать ScrapeWithPlaywrightTool: {e}")
+    if PLAYWRIGHT_AVAILABLE and ExtractLinksWithPlaywrightTool:
+        try:
+            scraper_tools.append(ExtractLinksWithPlaywrightTool())
+        except Exception as e:
+            print(f"⚠️  Не удалось создать ExtractLinksWithPlaywrightTool: {e}")
+    if SCRAPE_TOOL_AVAILABLE:
+        try:
+            scraper_tools.append((SeededScrapeWebsiteTool or ScrapeWebsiteTool)())
+        except Exception as e:
+            print(f"⚠️  Не удалось создать ScrapeWebsiteTool: {e}")
+    if EXTRACT_LINKS_AVAILABLE and ExtractSiteLinksTool:
+        try:
+            scraper_tools.append(ExtractSiteLinksTool())
+        except Exception as e:
+            print(f"⚠️  Не удалось создать ExtractSiteLinksTool: {e}")
+    return scraper_tools
+
+
+# ============================================================================
+# АГЕНТ 1: Web Scraper (Считыватель информации с корпоративного сайта)
+# ============================================================================
+
+def create_web_scraper_agent():
+    """Создаёт агента сбора информации с собственным набором инструментов."""
+    scraper_tools = _create_scraper_tools()
+    return Agent(
     role="Corporate Web Information Specialist",
     goal="Извлечение МАКСИМУМА информации с указанного сайта: все тексты, цифры, ссылки. Ничего не опускать.",
     backstory="""Вы специалист по сбору информации с веб-сайтов. Работаете ТОЛЬКО с указанным сайтом {company_url}. 
@@ -406,37 +460,15 @@ else:
     max_execution_time=600,  # 10 минут на полный сбор  # 5 минут
     memory=False,  # иначе возможна подмешка контекста между разными анализами в одном процессе
     )
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:136","message":"Web Scraper Agent создан","data":{"success":True,"agent_type":str(type(web_scraper_agent)),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print("✓ Web Scraper Agent создан успешно")
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:140","message":"Ошибка создания Web Scraper Agent","data":{"error":str(e),"error_type":type(e).__name__,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print(f"ОШИБКА при создании Web Scraper Agent: {e}")
-        import traceback
-        traceback.print_exc()
-        web_scraper_agent = None
-    
-    # ============================================================================
-    # АГЕНТ 2: Data Analyzer (Анализатор информации)
-    # ============================================================================
-    
-    try:
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:145","message":"Создание Data Analyzer Agent","data":{"web_scraper_created":web_scraper_agent is not None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        data_analyzer_agent = Agent(
+
+
+# ============================================================================
+# АГЕНТ 2: Data Analyzer (Анализатор информации)
+# ============================================================================
+
+def create_data_analyzer_agent():
+    """Создаёт агента анализа собранной информации."""
+    return Agent(
     role="Corporate Data Analyst",
     goal="Анализ и структурирование информации о компании для выявления ключевых паттернов и взаимосвязей",
     backstory="""Вы опытный аналитик с 10+ летним опытом в анализе корпоративной информации.
@@ -464,37 +496,15 @@ else:
     max_execution_time=300,
     memory=False,
     )
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:164","message":"Data Analyzer Agent создан","data":{"success":True,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print("✓ Data Analyzer Agent создан успешно")
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:168","message":"Ошибка создания Data Analyzer Agent","data":{"error":str(e),"error_type":type(e).__name__,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print(f"ОШИБКА при создании Data Analyzer Agent: {e}")
-        import traceback
-        traceback.print_exc()
-        data_analyzer_agent = None
-    
-    # ============================================================================
-    # АГЕНТ 3: Business Intelligence Engineer (Инженер BI)
-    # ============================================================================
-    
-    try:
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:173","message":"Создание BI Engineer Agent","data":{"agents_created":web_scraper_agent is not None and data_analyzer_agent is not None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        bi_engineer_agent = Agent(
+
+
+# ============================================================================
+# АГЕНТ 3: Business Intelligence Engineer (Инженер BI)
+# ============================================================================
+
+def create_bi_engineer_agent():
+    """Создаёт агента формирования итогового отчёта."""
+    return Agent(
     role="Business Intelligence Engineer",
     goal="Формирование сводной информации о компании в структурированном формате с аналитическими выводами",
     backstory="""Вы ведущий инженер бизнес-интеллиджеза с опытом в создании 
@@ -521,49 +531,16 @@ else:
     max_execution_time=600,  # 10 минут на формирование финального отчета
     memory=False,
     )
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:189","message":"BI Engineer Agent создан","data":{"success":True,"all_agents_created":all([web_scraper_agent, data_analyzer_agent, bi_engineer_agent]),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print("✓ BI Engineer Agent создан успешно")
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(debug_log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:193","message":"Ошибка создания BI Engineer Agent","data":{"error":str(e),"error_type":type(e).__name__,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-        except: pass
-        # #endregion
-        print(f"ОШИБКА при создании BI Engineer Agent: {e}")
-        import traceback
-        traceback.print_exc()
-        bi_engineer_agent = None
-    
-    # Проверяем, что все агенты созданы
-    # #region agent log
-    try:
-        with open(debug_log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"B","location":"Agents_crew.py:200","message":"Проверка создания агентов","data":{"web_scraper":web_scraper_agent is not None,"data_analyzer":data_analyzer_agent is not None,"bi_engineer":bi_engineer_agent is not None,"all_created":all([web_scraper_agent, data_analyzer_agent, bi_engineer_agent]),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-    except: pass
-    # #endregion
-    if not all([web_scraper_agent, data_analyzer_agent, bi_engineer_agent]):
-        print("ОШИБКА: Не все агенты созданы. Проверьте логи выше.")
-        crew = None
-    else:
-        # ============================================================================
-        # ОПРЕДЕЛЕНИЕ ЗАДАЧ (TASKS)
-        # ============================================================================
-        
-        try:
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:225","message":"Создание Task 1 (scrape)","data":{"Task_class":str(Task) if Task else None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            # ЗАДАЧА 1: Сбор информации с сайта
-            task_1_scrape = Task(
+
+
+# ============================================================================
+# ОПРЕДЕЛЕНИЕ ЗАДАЧ (TASKS)
+# ============================================================================
+
+def create_tasks(web_scraper_agent, data_analyzer_agent, bi_engineer_agent):
+    """Создаёт задачи 1–3 для переданных агентов. Возвращает [scrape, analyze, report]."""
+    # ЗАДАЧА 1: Сбор информации с сайта
+    task_1_scrape = Task(
     description="""КРИТИЧЕСКИ ВАЖНО: Вы можете использовать ТОЛЬКО информацию с указанного сайта {company_url}. 
     ЗАПРЕЩЕНО использовать любые другие источники. Работайте исключительно с содержимым указанного сайта.
     
@@ -621,23 +598,10 @@ else:
     
     agent=web_scraper_agent,
     output_file="tasks/task_1_scraped_data.md",
-            )
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:236","message":"Task 1 создана","data":{"success":True,"task_type":str(type(task_1_scrape)),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            print("✓ Task 1 (scrape) создана успешно")
-            
-            # ЗАДАЧА 2: Анализ информации
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:242","message":"Создание Task 2 (analyze)","data":{"task1_created":task_1_scrape is not None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            task_2_analyze = Task(
+    )
+
+    # ЗАДАЧА 2: Анализ информации
+    task_2_analyze = Task(
     description="""КРИТИЧЕСКИ ВАЖНО: Вы можете анализировать ТОЛЬКО информацию, полученную с указанного сайта {company_url}. 
     ЗАПРЕЩЕНО использовать любые другие источники: поиск в интернете, базы данных, внешние сайты, 
     новостные источники или любые другие ресурсы. Работайте исключительно с данными из Задачи 1.
@@ -680,23 +644,10 @@ else:
     
     agent=data_analyzer_agent,
     output_file="tasks/task_2_analysis.md",
-            )
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:272","message":"Task 2 создана","data":{"success":True,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            print("✓ Task 2 (analyze) создана успешно")
-            
-            # ЗАДАЧА 3: Формирование итоговой сводки
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:278","message":"Создание Task 3 (report)","data":{"tasks_created":task_1_scrape is not None and task_2_analyze is not None,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            task_3_report = Task(
+    )
+
+    # ЗАДАЧА 3: Формирование итоговой сводки
+    task_3_report = Task(
     description="""КРИТИЧЕСКИ ВАЖНО: Вы можете использовать ТОЛЬКО информацию, полученную с указанного сайта {company_url}. 
     ЗАПРЕЩЕНО использовать любые другие источники: поиск в интернете, базы данных, внешние сайты, 
     новостные источники или любые другие ресурсы. Работайте исключительно с данными из Задач 1 и 2.
@@ -790,81 +741,203 @@ else:
     
     agent=bi_engineer_agent,
     output_file="tasks/task_3_final_report.md",
-            )
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:370","message":"Task 3 создана","data":{"success":True,"all_tasks_created":all([task_1_scrape, task_2_analyze, task_3_report]),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            print("✓ Task 3 (report) создана успешно")
-            
-            # Проверяем, что все задачи созданы
-            # #region agent log
-            try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:375","message":"Проверка создания задач","data":{"task1":task_1_scrape is not None,"task2":task_2_analyze is not None,"task3":task_3_report is not None,"all_created":all([task_1_scrape, task_2_analyze, task_3_report]),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            if not all([task_1_scrape, task_2_analyze, task_3_report]):
-                print("ОШИБКА: Не все задачи созданы. Проверьте логи выше.")
-                crew = None
-            else:
-                # #region agent log
-                try:
-                    with open(debug_log_path, 'a', encoding='utf-8') as f:
-                        f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"D","location":"Agents_crew.py:384","message":"Создание объекта Crew","data":{"Crew_class":str(Crew) if Crew else None,"agents_count":sum([1 for a in [web_scraper_agent, data_analyzer_agent, bi_engineer_agent] if a is not None]),"tasks_count":sum([1 for t in [task_1_scrape, task_2_analyze, task_3_report] if t is not None]),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-                except: pass
-                # #endregion
-                
-                try:
-                    crew = Crew(
-                        agents=[web_scraper_agent, data_analyzer_agent, bi_engineer_agent],
-                        tasks=[task_1_scrape, task_2_analyze, task_3_report],
-                        verbose=True,
-                        process="sequential",  # Выполнение задач последовательно
-                        output_file="crew_output.md",
-                    )
-                    # #region agent log
-                    try:
-                        with open(debug_log_path, 'a', encoding='utf-8') as f:
-                            f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"D","location":"Agents_crew.py:401","message":"Crew объект создан","data":{"success":True,"crew_type":str(type(crew)),"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-                    except: pass
-                    # #endregion
-                    print("✓ Crew объект создан успешно")
-                except Exception as e:
-                    # #region agent log
-                    try:
-                        with open(debug_log_path, 'a', encoding='utf-8') as f:
-                            f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"D","location":"Agents_crew.py:405","message":"Ошибка создания Crew объекта","data":{"error":str(e),"error_type":type(e).__name__,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-                    except: pass
-                    # #endregion
-                    print(f"ОШИБКА при создании Crew объекта: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    crew = None
-        except Exception as e:
-            # #region agent log
+    )
+    return [task_1_scrape, task_2_analyze, task_3_report]
+
+
+# ============================================================================
+# ФАБРИКА И ПУЛ CREW
+# ============================================================================
+
+# Имена файлов-артефактов задач 1–3 и итогового вывода Crew (внутри каталога конкретного анализа)
+TASK_OUTPUT_FILES = ("task_1_scraped_data.md", "task_2_analysis.md", "task_3_final_report.md")
+CREW_OUTPUT_FILE = "crew_output.md"
+
+
+def _output_path_for_crewai(path):
+    """Путь для output_file: CrewAI отбрасывает ведущий / и пишет относительно cwd, поэтому по возможности — относительный."""
+    rel = os.path.relpath(path)
+    if rel.startswith('..'):
+        return str(path)
+    return rel.replace(os.sep, '/')
+
+
+def configure_crew_output(c, output_dir):
+    """
+    Направляет артефакты задач экземпляра Crew в отдельный каталог анализа.
+
+    Вызывается перед каждым kickoff(): экземпляры из пула переиспользуются,
+    а параллельные анализы не должны перезаписывать файлы друг друга.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for task, filename in zip(c.tasks, TASK_OUTPUT_FILES):
+        path = _output_path_for_crewai(output_dir / filename)
+        task.output_file = path
+        # Новые версии CrewAI восстанавливают output_file из исходного шаблона при интерполяции inputs
+        if hasattr(task, '_original_output_file'):
+            task._original_output_file = path
+    if getattr(c, 'output_file', None) is not None:
+        try:
+            c.output_file = _output_path_for_crewai(output_dir / CREW_OUTPUT_FILE)
+        except Exception:
+            pass
+    return output_dir
+
+
+def configure_crew_progress(c, reporter=None, page_store=None):
+    """
+    Подключает к экземпляру Crew обработчик прогресса и хранилище страниц задачи
+    (или отключает их при reporter=None).
+
+    Колбэки ставятся прямо на агентов и задачи: kickoff() копирует step_callback/task_callback
+    Crew только в пустые поля, и у переиспользуемого из пула экземпляра остались бы
+    колбэки предыдущего анализа. Инструменты агентов получают ToolRunContext с проверкой
+    отмены и page_store: CrewAI вызывает их не в потоке kickoff(), а в потоке таймаута агента.
+    """
+    context = ToolRunContext(reporter.cancelled, page_store) if reporter else None
+    for index, agent in enumerate(c.agents):
+        agent.step_callback = reporter.step_callback_for(index) if reporter else None
+        attach_run_context(getattr(agent, 'tools', None), context)
+    for task in c.tasks:
+        task.callback = reporter.on_task_done if reporter else None
+    return c
+
+
+def build_crew():
+    """
+    Создаёт изолированный экземпляр Crew: собственные агенты, инструменты и задачи.
+
+    Одновременный kickoff() на общих объектах Agent/Task небезопасен, поэтому
+    каждый параллельный анализ должен работать со своим экземпляром.
+
+    Raises:
+        RuntimeError: если CrewAI не установлен
+    """
+    if not CREWAI_IMPORTED:
+        raise RuntimeError("CrewAI не установлен. Установите: pip install crewai>=0.11.2")
+    agents = [create_web_scraper_agent(), create_data_analyzer_agent(), create_bi_engineer_agent()]
+    tasks = create_tasks(*agents)
+    return Crew(
+        agents=agents,
+        tasks=tasks,
+        verbose=True,
+        process="sequential",  # Выполнение задач последовательно
+        output_file="crew_output.md",
+    )
+
+
+class CrewPool:
+    """
+    Пул заранее созданных экземпляров Crew.
+
+    acquire() выдаёт свободный экземпляр (или создаёт новый, если пул пуст),
+    release() возвращает его для повторного использования. Один экземпляр
+    в каждый момент времени используется только одним анализом.
+    """
+
+    def __init__(self, factory, size=2, reset=None):
+        self._factory = factory
+        self._reset = reset
+        self._size = max(1, int(size))
+        self._idle = []
+        self._lock = threading.Lock()
+        self._created = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def prefill(self):
+        """Создаёт экземпляры до размера пула. Вызывать из главного потока (телеметрия CrewAI и signal)."""
+        with self._lock:
+            missing = self._size - len(self._idle)
+        for _ in range(missing):
+            c = self._factory()
+            with self._lock:
+                self._created += 1
+                self._idle.append(c)
+        return self
+
+    def acquire(self):
+        """Выдаёт свободный экземпляр Crew; при пустом пуле создаёт новый."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        c = self._factory()
+        with self._lock:
+            self._created += 1
+        return c
+
+    def release(self, c):
+        """
+        Возвращает экземпляр в пул (лишние сверх размера пула отбрасываются).
+        reset(c) снимает с экземпляра состояние анализа: колбэки прогресса и контекст инструментов.
+        """
+        if c is None:
+            return
+        if self._reset is not None:
             try:
-                with open(debug_log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"C","location":"Agents_crew.py:410","message":"Ошибка при создании задач","data":{"error":str(e),"error_type":type(e).__name__,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-            except: pass
-            # #endregion
-            print(f"ОШИБКА при создании задач: {e}")
-            import traceback
-            traceback.print_exc()
-            task_1_scrape = None
-            task_2_analyze = None
-            task_3_report = None
-            crew = None
-
-# Проверяем финальное состояние crew перед экспортом
-# #region agent log
-try:
-    with open(debug_log_path, 'a', encoding='utf-8') as f:
-        f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"E","location":"Agents_crew.py:559","message":"Финальная проверка crew перед экспортом","data":{"crew_is_none":crew is None,"crew_type":str(type(crew)) if crew else None,"CREWAI_IMPORTED":CREWAI_IMPORTED,"timestamp":__import__('datetime').datetime.now().isoformat()}})+'\n')
-except: pass
-# #endregion
+                self._reset(c)
+            except Exception as e:
+                # Экземпляр с состоянием чужого анализа в пул не возвращается
+                print(f"⚠️  Не удалось сбросить экземпляр Crew: {e}")
+                return
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(c)
+
+    @contextmanager
+    def lease(self):
+        """Контекстный менеджер: with crew_pool.lease() as c: c.kickoff(...)"""
+        c = self.acquire()
+        try:
+            yield c
+        finally:
+            self.release(c)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self._size, 'idle': len(self._idle), 'created': self._created}
+
+
+def _crew_pool_size():
+    """Размер пула: CREW_POOL_SIZE, иначе по числу рабочих потоков ANALYSIS_WORKERS."""
+    for name in ('CREW_POOL_SIZE', 'ANALYSIS_WORKERS'):
+        try:
+            value = int(os.getenv(name, ''))
+            if value > 0:
+                return value
+        except (TypeError, ValueError):
+            continue
+    return 2
+
+
+if not CREWAI_IMPORTED:
+    print("ОШИБКА: CrewAI не установлен. Установите: pip install crewai>=0.11.2")
+elif _skip_creation:
+    print("ℹ Flask reloader: пропускаем создание в основном процессе")
+else:
+    # Предсоздаём экземпляры в главном потоке — при импорте из main.py
+    try:
+        crew_pool = CrewPool(build_crew, size=_crew_pool_size(), reset=configure_crew_progress).prefill()
+        # Отдельный экземпляр для check_crewai.py и запуска модуля напрямую; приложение использует crew_pool
+        crew = build_crew()
+        print(f"✓ Пул Crew создан успешно ({crew_pool.size} экз.)")
+    except Exception as e:
+        write_debug_log({
+            "sessionId": "debug-session",
+            "runId": "init",
+            "hypothesisId": "D",
+            "location": "Agents_crew.py:build_crew",
+            "message": "Ошибка создания Crew",
+            "data": {"error": str(e), "error_type": type(e).__name__, "timestamp": datetime.now().isoformat()}
+        })
+        print(f"ОШИБКА при создании Crew объекта: {e}")
+        import traceback
+        traceback.print_exc()
+        crew = None
+        crew_pool = None
 
 # #region agent log
 write_debug_log({
@@ -873,7 +946,7 @@ write_debug_log({
     "hypothesisId": "A",
     "location": "Agents_crew.py:264",
     "message": "Объект Crew создан",
-    "data": {"timestamp": datetime.now().isoformat(), "crew_is_none": crew is None}
+    "data": {"timestamp": datetime.now().isoformat(), "crew_is_none": crew is None, "crew_pool_is_none": crew_pool is None}
 })
 # #endregion
 
@@ -889,4 +962,4 @@ if __name__ == "__main__":
     }
     
     result = crew.kickoff(inputs=inputs)
-    print(result)
\ No newline at end of file
+    print(result)
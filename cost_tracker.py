@@ -6,6 +6,7 @@
 import os
 import requests
 from typing import Optional, Dict
+import http_client
 from logger import logger
 
 # URL ProxyAPI
@@ -42,13 +43,14 @@ def get_balance() -> Optional[float]:
         
         for endpoint in endpoints:
             try:
-                response = requests.get(
+                response = http_client.get(
                     endpoint,
                     headers={
                         "Authorization": f"Bearer {api_key}",
                         "Content-Type": "application/json"
                     },
-                    timeout=10
+                    timeout=10,
+                    browser=False
                 )
                 
                 logger.debug(f"Запрос баланса к {endpoint}: статус {response.status_code}")
@@ -101,13 +103,14 @@ def get_request_cost() -> Optional[Dict]:
         return None
     
     try:
-        response = requests.get(
+        response = http_client.get(
             f"{PROXYAPI_BASE_URL}/cost",
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
             },
-            timeout=10
+            timeout=10,
+            browser=False
         )
         
         if response.status_code == 200:
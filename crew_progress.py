@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Прогресс анализа по реальным событиям CrewAI (шаги агентов, вызовы инструментов, завершение задач)
+"""
+import threading
+import time
+from typing import Callable, Iterable, Optional, Sequence, Tuple
+
+from logger import logger
+
+
+# Этапы Crew: (название для пользователя, прогресс в начале, прогресс в конце, ожидаемое число шагов LLM)
+DEFAULT_STAGES: Tuple[Tuple[str, int, int, int], ...] = (
+    ('Сбор информации с сайта', 15, 55, 12),
+    ('Анализ данных компании', 55, 70, 3),
+    ('Формирование аналитического отчета', 70, 88, 3),
+)
+
+
+class AnalysisCancelled(BaseException):
+    """
+    Анализ отменён пользователем.
+
+    Наследуется от BaseException: CrewAI перехватывает Exception в агентах и повторяет
+    задачу (max_retry_limit), а отмена должна сразу прервать kickoff().
+    """
+
+
+class ToolRunContext:
+    """
+    Состояние анализа, нужное инструментам агентов: проверка отмены и хранилище страниц
+    задачи (page_store.TaskPageStore).
+
+    Агенты с max_execution_time CrewAI выполняет в отдельном потоке (ThreadPoolExecutor),
+    поэтому контекст не может жить в thread-local потока kickoff(): он присваивается
+    экземплярам инструментов арендованного Crew (attach_run_context) и снимается при возврате в пул.
+    """
+
+    def __init__(self, cancel_check: Optional[Callable] = None, page_store=None):
+        self._cancel_check = cancel_check
+        self.page_store = page_store
+
+    def cancelled(self) -> bool:
+        try:
+            return bool(self._cancel_check and self._cancel_check())
+        except Exception:
+            return False
+
+    def lookup_page(self, url: str):
+        """Страница, уже загруженная в этой задаче (PageSnapshot), или None."""
+        if self.page_store is None:
+            return None
+        return self.page_store.get(url)
+
+    def near_duplicate_of(self, url: str, text: str) -> Optional[str]:
+        """URL страницы, уже отданной агентам в этой задаче, с почти таким же текстом, или None."""
+        if self.page_store is None:
+            return None
+        return self.page_store.duplicates.check(url, text)
+
+
+# Атрибут экземпляра инструмента с ToolRunContext (инструменты CrewAI — модели pydantic,
+# поэтому значение ставится через object.__setattr__, мимо валидации полей)
+_RUN_CONTEXT_ATTR = '_analysis_run_context'
+
+
+def attach_run_context(tools: Iterable, context: Optional[ToolRunContext]):
+    """Присваивает инструментам контекст анализа (None — снимает)."""
+    for tool in tools or ():
+        object.__setattr__(tool, _RUN_CONTEXT_ATTR, context)
+
+
+def tool_run_context(tool) -> Optional[ToolRunContext]:
+    """Контекст анализа, присвоенный инструменту, или None вне анализа."""
+    return getattr(tool, _RUN_CONTEXT_ATTR, None)
+
+
+def lookup_tool_page(tool, url: str):
+    """Страница задачи, для которой работает инструмент (PageSnapshot), или None."""
+    context = tool_run_context(tool)
+    return context.lookup_page(url) if context is not None else None
+
+
+def tool_near_duplicate_of(tool, url: str, text: str) -> Optional[str]:
+    """
+    URL почти такой же страницы, уже отданной агентам в задаче инструмента, или None.
+    Вне анализа (контекст не присвоен) сравнение не выполняется.
+    """
+    context = tool_run_context(tool)
+    return context.near_duplicate_of(url, text) if context is not None else None
+
+
+def is_tool_cancelled(tool) -> bool:
+    """True, если анализ, для которого работает инструмент, отменён."""
+    context = tool_run_context(tool)
+    return context is not None and context.cancelled()
+
+
+def _format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return ''
+    if seconds < 60:
+        return ' (осталось меньше минуты)'
+    return f' (осталось ~{int(round(seconds / 60))} мин)'
+
+
+class CrewProgressReporter:
+    """
+    Переводит события CrewAI в прогресс задачи.
+
+    Каждый агент Crew выполняет ровно одну задачу, поэтому первый шаг агента
+    означает начало его этапа, а task_callback — завершение. Внутри этапа
+    прогресс растёт с числом шагов LLM и асимптотически приближается к концу
+    этапа, не перепрыгивая его. Оставшееся время оценивается по фактической
+    скорости прохождения уже выполненной части.
+
+    report(progress, message, eta_seconds) вызывается синхронно в потоке kickoff().
+    is_cancelled() проверяется на каждом событии: при отмене репортёр
+    останавливается и поднимает AnalysisCancelled, прерывая Crew между шагами.
+    """
+
+    def __init__(self, report: Callable, stages: Sequence[Tuple[str, int, int, int]] = DEFAULT_STAGES,
+                 task_id: Optional[str] = None, is_cancelled: Optional[Callable] = None):
+        self._report = report
+        self._is_cancelled = is_cancelled
+        self._stopped = False
+        self._stages = tuple(stages)
+        self._task_id = task_id
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._stage = -1
+        self._stage_steps = 0
+        self._completed = 0
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.last_tool: Optional[str] = None
+
+    @property
+    def start_progress(self) -> int:
+        return self._stages[0][1]
+
+    @property
+    def end_progress(self) -> int:
+        return self._stages[-1][2]
+
+    def stop(self):
+        """Прекращает отправку прогресса (анализ отменён или завершился ошибкой)."""
+        self._stopped = True
+
+    def cancelled(self) -> bool:
+        if self._is_cancelled is None:
+            return False
+        try:
+            return bool(self._is_cancelled())
+        except Exception as e:
+            logger.warning(f"[{self._task_id}] Не удалось проверить отмену анализа: {e}")
+            return False
+
+    def check_cancelled(self):
+        """Поднимает AnalysisCancelled, если анализ отменён."""
+        if self.cancelled():
+            self.stop()
+            raise AnalysisCancelled(self._task_id)
+
+    def step_callback_for(self, stage_index: int) -> Callable:
+        """step_callback для агента этапа stage_index."""
+        def _callback(step_output):
+            self.on_step(stage_index, step_output)
+        return _callback
+
+    def on_step(self, stage_index: int, step_output=None):
+        """Шаг агента: ответ LLM, возможно с вызовом инструмента."""
+        self.check_cancelled()
+        with self._lock:
+            if stage_index != self._stage:
+                self._enter_stage(stage_index)
+            self._stage_steps += 1
+            self.llm_calls += 1
+            tool = getattr(step_output, 'tool', None)
+            if tool:
+                self.tool_calls += 1
+                self.last_tool = str(tool)
+            progress, message, eta = self._snapshot()
+        self._emit(progress, message, eta)
+
+    def on_task_done(self, task_output=None):
+        """Задача Crew завершена: этап закрывается, следующий считается начатым."""
+        self.check_cancelled()
+        with self._lock:
+            self._completed = max(self._completed, self._stage + 1, 1)
+            if self._completed < len(self._stages):
+                self._enter_stage(self._completed)
+            else:
+                self._stage = len(self._stages)
+                self._stage_steps = 0
+            progress, message, eta = self._snapshot()
+        self._emit(progress, message, eta)
+
+    def _enter_stage(self, stage_index: int):
+        self._stage = stage_index
+        self._stage_steps = 0
+        self.last_tool = None
+        if self._task_id and 0 <= stage_index < len(self._stages):
+            logger.info(f"[{self._task_id}] Этап Crew {stage_index + 1}/{len(self._stages)}: {self._stages[stage_index][0]}")
+
+    def _current_progress(self) -> float:
+        if self._stage >= len(self._stages):
+            return float(self.end_progress)
+        if self._stage < 0:
+            return float(self.start_progress)
+        _, start, end, expected_steps = self._stages[self._stage]
+        fraction = self._stage_steps / (self._stage_steps + max(1, expected_steps))
+        return start + (end - start) * min(fraction, 0.95)
+
+    def _snapshot(self):
+        progress = self._current_progress()
+        eta = self.eta_seconds(progress)
+        if self._stage >= len(self._stages):
+            message = 'Завершение анализа...'
+        else:
+            name = self._stages[max(self._stage, 0)][0]
+            if self._stage_steps == 0:
+                message = f"{name}...{_format_eta(eta)}"
+            else:
+                details = f"шаг {self._stage_steps}"
+                if self.last_tool:
+                    details += f", инструмент: {self.last_tool}"
+                message = f"{name}: {details}{_format_eta(eta)}"
+        return int(progress), message, eta
+
+    def eta_seconds(self, progress: Optional[float] = None) -> Optional[float]:
+        """Оценка оставшегося времени до конца работы Crew по средней скорости с начала."""
+        if progress is None:
+            progress = self._current_progress()
+        span = self.end_progress - self.start_progress
+        done = (progress - self.start_progress) / span if span > 0 else 1.0
+        if done < 0.05:
+            return None
+        if done >= 1.0:
+            return 0.0
+        elapsed = time.monotonic() - self._started_at
+        return elapsed * (1.0 - done) / done
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'stage': self._stage + 1,
+                'llm_calls': self.llm_calls,
+                'tool_calls': self.tool_calls,
+                'elapsed_seconds': round(time.monotonic() - self._started_at, 1),
+            }
+
+    def _emit(self, progress: int, message: str, eta: Optional[float]):
+        if self._stopped:
+            return
+        try:
+            self._report(progress, message, eta)
+        except Exception as e:
+            logger.warning(f"[{self._task_id}] Не удалось обновить прогресс: {e}")
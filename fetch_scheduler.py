@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Планировщик запросов к сайтам, общий для всех анализов процесса
+
+Несколько анализов, обход ссылок, инструменты агентов и Playwright обращаются к сайтам
+одновременно; без согласования два анализа одного домена легко упираются в защиту от ботов.
+Каждый запрос к сайту берёт слот (slot): не больше FETCH_GLOBAL_CONCURRENCY запросов
+на процесс и FETCH_DOMAIN_CONCURRENCY на домен, между началами запросов к домену —
+не меньше FETCH_DOMAIN_INTERVAL_MS. Ответ 429/503 (report) приостанавливает домен
+на Retry-After или, без заголовка, на растущую паузу; ждущие запросы домена стоят в очереди.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+
+from logger import logger
+from url_utils import url_host
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Одновременных запросов к сайтам на процесс и к одному домену (все анализы вместе)
+FETCH_GLOBAL_CONCURRENCY = _env_int('FETCH_GLOBAL_CONCURRENCY', 32, minimum=1)
+FETCH_DOMAIN_CONCURRENCY = _env_int('FETCH_DOMAIN_CONCURRENCY', 4, minimum=1)
+# Минимальный интервал между началами запросов к одному домену (мс, 0 — без ограничения частоты)
+FETCH_DOMAIN_INTERVAL_MS = _env_int('FETCH_DOMAIN_INTERVAL_MS', 100)
+# Потолок паузы домена после 429/503 (с) и сколько запрос ждёт слот, прежде чем сдаться (с)
+FETCH_MAX_BACKOFF = _env_int('FETCH_MAX_BACKOFF', 120, minimum=1)
+FETCH_MAX_WAIT = _env_int('FETCH_MAX_WAIT', 60, minimum=1)
+
+# Коды ответа, после которых домен приостанавливается
+BACKOFF_STATUSES = frozenset({429, 503})
+# Пауза без Retry-After: BACKOFF_BASE * 2^(n-1) секунд для n-го подряд ответа 429/503
+BACKOFF_BASE = 2
+# Сколько состояний доменов хранить, прежде чем убирать простаивающие
+_MAX_IDLE_DOMAINS = 1024
+
+
+class FetchSlotTimeout(requests.Timeout):
+    """Слот для запроса не освободился за отведённое время (домен приостановлен или перегружен)."""
+
+
+def retry_after_seconds(value) -> Optional[float]:
+    """Секунды из заголовка Retry-After (число секунд или HTTP-дата) или None."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class _DomainState:
+    __slots__ = ('active', 'next_start', 'paused_until', 'failures')
+
+    def __init__(self):
+        self.active = 0
+        self.next_start = 0.0
+        self.paused_until = 0.0
+        self.failures = 0
+
+
+class FetchScheduler:
+    """Слоты запросов с лимитами на процесс и на домен и паузами доменов после 429/503."""
+
+    def __init__(self, global_limit=None, domain_limit=None, interval=None, max_backoff=None, max_wait=None):
+        self.global_limit = global_limit or FETCH_GLOBAL_CONCURRENCY
+        self.domain_limit = domain_limit or FETCH_DOMAIN_CONCURRENCY
+        self.interval = FETCH_DOMAIN_INTERVAL_MS / 1000 if interval is None else interval
+        self.max_backoff = max_backoff or FETCH_MAX_BACKOFF
+        self.max_wait = max_wait or FETCH_MAX_WAIT
+        self._cond = threading.Condition()
+        self._active = 0
+        self._domains: Dict[str, _DomainState] = {}
+        self._stats = {'requests': 0, 'waited': 0, 'wait_seconds': 0.0, 'backoffs': 0, 'timeouts': 0}
+
+    def _state(self, domain: str) -> _DomainState:
+        state = self._domains.get(domain)
+        if state is None:
+            if len(self._domains) >= _MAX_IDLE_DOMAINS:
+                self._prune(time.monotonic())
+            state = self._domains[domain] = _DomainState()
+        return state
+
+    def _prune(self, now: float):
+        for domain in [d for d, s in self._domains.items()
+                       if not s.active and s.next_start <= now and s.paused_until <= now]:
+            del self._domains[domain]
+
+    def _acquire(self, domain: str, max_wait: float):
+        started = time.monotonic()
+        deadline = started + max_wait
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                state = self._state(domain)
+                ready_at = max(state.next_start, state.paused_until)
+                if now >= ready_at and self._active < self.global_limit and state.active < self.domain_limit:
+                    self._active += 1
+                    state.active += 1
+                    state.next_start = now + self.interval
+                    self._stats['requests'] += 1
+                    if waited:
+                        self._stats['waited'] += 1
+                        self._stats['wait_seconds'] += now - started
+                    return
+                if now >= deadline:
+                    self._stats['timeouts'] += 1
+                    raise FetchSlotTimeout(f"Запрос к {domain} не дождался очереди за {max_wait:.0f} с")
+                waited = True
+                timeout = deadline - now
+                if ready_at > now:
+                    timeout = min(timeout, ready_at - now)
+                self._cond.wait(timeout)
+
+    def _release(self, domain: str):
+        with self._cond:
+            self._active -= 1
+            state = self._domains.get(domain)
+            if state is not None:
+                state.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, url: str, max_wait: Optional[float] = None):
+        """
+        Слот на запрос к сайту url: ждёт очереди домена и общего лимита.
+
+        Raises:
+            FetchSlotTimeout: слот не освободился за max_wait секунд (по умолчанию FETCH_MAX_WAIT)
+        """
+        domain = url_host(url) or url
+        self._acquire(domain, self.max_wait if max_wait is None else max_wait)
+        try:
+            yield
+        finally:
+            self._release(domain)
+
+    def report(self, url: str, status: int, headers=None):
+        """
+        Итог запроса: 429/503 приостанавливают домен на Retry-After (или на растущую паузу
+        без заголовка), успешный ответ сбрасывает счётчик неудач.
+        """
+        domain = url_host(url) or url
+        with self._cond:
+            state = self._state(domain)
+            if status not in BACKOFF_STATUSES:
+                state.failures = 0
+                return
+            state.failures += 1
+            delay = retry_after_seconds((headers or {}).get('retry-after'))
+            if delay is None:
+                delay = BACKOFF_BASE * 2 ** (state.failures - 1)
+            delay = min(delay, self.max_backoff)
+            state.paused_until = max(state.paused_until, time.monotonic() + delay)
+            self._stats['backoffs'] += 1
+        logger.warning(f"Сайт {domain} ответил {status}: запросы к домену приостановлены на {delay:.0f} с")
+
+    def stats(self) -> dict:
+        """Счётчики с начала работы процесса: запросы, ожидавшие слот, паузы доменов, отказы по таймауту."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['wait_seconds'] = round(stats['wait_seconds'], 1)
+            stats['active'] = self._active
+            return stats
+
+
+_scheduler = FetchScheduler()
+
+
+def slot(url: str, max_wait: Optional[float] = None):
+    """Слот общего планировщика процесса (см. FetchScheduler.slot)."""
+    return _scheduler.slot(url, max_wait)
+
+
+def report(url: str, status: int, headers=None):
+    """Итог запроса для общего планировщика процесса (см. FetchScheduler.report)."""
+    _scheduler.report(url, status, headers)
+
+
+def stats() -> dict:
+    return _scheduler.stats()
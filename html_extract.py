@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Быстрое извлечение ссылок и видимого текста из HTML за один проход
+
+Основной парсер — lxml (libxml2, C): дерево строится без объектов BeautifulSoup,
+а ссылки, текст ссылок и видимый текст страницы собираются одним обходом iterwalk.
+Без lxml используется BeautifulSoup (html.parser) с тем же результатом.
+"""
+import re
+import threading
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+try:
+    import bs4  # noqa: F401
+    BS4_AVAILABLE = True
+except ImportError:
+    BS4_AVAILABLE = False
+# Есть ли чем разбирать HTML (lxml или запасной BeautifulSoup)
+HTML_PARSER_AVAILABLE = LXML_AVAILABLE or BS4_AVAILABLE
+
+# Содержимое этих тегов не показывается пользователю
+_SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'template', 'svg', 'head', 'iframe', 'object'})
+# После этих тегов текст переносится на новую строку
+_BLOCK_TAGS = frozenset({
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset', 'figcaption',
+    'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav',
+    'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+})
+# Ссылки внутри этих тегов (и role="navigation") — меню сайта
+_MENU_TAGS = frozenset({'nav', 'header', 'footer'})
+# href, которые не ведут на страницу
+_SKIP_HREF_PREFIXES = ('#', 'javascript:', 'mailto:', 'tel:', 'data:')
+
+_RE_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+_RE_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+_local = threading.local()
+
+
+class ExtractedPage(NamedTuple):
+    """
+    Результат разбора: ссылки (абсолютный URL, текст ссылки) в порядке документа, видимый текст,
+    URL ссылок из меню (nav, header, footer, role="navigation") и заголовок страницы (<title>).
+    """
+    links: List[Tuple[str, str]]
+    text: str
+    menu_links: FrozenSet[str] = frozenset()
+    title: str = ''
+
+
+def _is_menu(tag: str, role: Optional[str]) -> bool:
+    return tag in _MENU_TAGS or (role or '').strip().lower() == 'navigation'
+
+
+def _parser():
+    """HTMLParser lxml для текущего потока (объекты парсера lxml нельзя делить между потоками)."""
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        parser = lxml_html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True,
+                                      no_network=True, recover=True)
+        _local.parser = parser
+    return parser
+
+
+def _absolute_link(base_url: Optional[str], href: Optional[str]) -> Optional[str]:
+    """Абсолютный http(s) URL ссылки или None для якорей, javascript:, mailto: и т.п."""
+    href = (href or '').strip()
+    if not href or href.lower().startswith(_SKIP_HREF_PREFIXES):
+        return None
+    abs_url = urljoin(base_url, href) if base_url else href
+    try:
+        scheme = urlparse(abs_url).scheme
+    except ValueError:
+        return None
+    if scheme not in ('http', 'https'):
+        return None
+    return abs_url
+
+
+def _clean_text(text: str) -> str:
+    text = _RE_SPACES.sub(' ', text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    return _RE_BLANK_LINES.sub('\n', text).strip()
+
+
+def _extract_lxml(html: str, base_url: Optional[str], with_text: bool) -> ExtractedPage:
+    try:
+        root = etree.fromstring(html.encode('utf-8', errors='replace'), _parser())
+    except (etree.ParserError, etree.XMLSyntaxError, ValueError):
+        return ExtractedPage([], '')
+    if root is None:
+        return ExtractedPage([], '')
+
+    links = []
+    menu_links = set()
+    parts = []
+    title = ''
+    skip_depth = 0
+    menu_depth = 0
+    anchors = []  # стек открытых <a href>: (URL, индекс начала текста в parts)
+    for event, elem in etree.iterwalk(root, events=('start', 'end')):
+        tag = elem.tag if isinstance(elem.tag, str) else ''
+        tag = tag.lower()
+        if tag == 'title' and event == 'end' and not title:
+            title = ' '.join((elem.text or '').split())
+        if event == 'start':
+            if tag in _SKIP_TAGS:
+                skip_depth += 1
+                continue
+            if skip_depth:
+                continue
+            if _is_menu(tag, elem.get('role')):
+                menu_depth += 1
+            if tag == 'a':
+                anchors.append((_absolute_link(base_url, elem.get('href')), len(parts)))
+            if elem.text:
+                parts.append(elem.text)
+            continue
+
+        if tag in _SKIP_TAGS:
+            skip_depth -= 1
+        elif skip_depth:
+            continue
+        else:
+            if tag == 'a' and anchors:
+                url, start = anchors.pop()
+                if url:
+                    links.append((url, ' '.join(''.join(parts[start:]).split())))
+                    if menu_depth:
+                        menu_links.add(url)
+            if _is_menu(tag, elem.get('role')):
+                menu_depth -= 1
+            if tag in _BLOCK_TAGS:
+                parts.append('\n')
+        if elem.tail and not skip_depth:
+            parts.append(elem.tail)
+    return ExtractedPage(links, _clean_text(''.join(parts)) if with_text else '', frozenset(menu_links), title)
+
+
+def _extract_bs4(html: str, base_url: Optional[str], with_text: bool) -> ExtractedPage:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    title = ' '.join(soup.title.get_text().split()) if soup.title else ''
+    for node in soup.find_all(list(_SKIP_TAGS)):
+        node.decompose()
+    links = []
+    menu_links = set()
+    for a in soup.find_all('a', href=True):
+        url = _absolute_link(base_url, a.get('href'))
+        if url:
+            links.append((url, ' '.join(a.get_text(' ').split())))
+            if a.find_parent(lambda t: _is_menu(t.name, t.get('role'))) is not None:
+                menu_links.add(url)
+    if not with_text:
+        return ExtractedPage(links, '', frozenset(menu_links), title)
+    for node in soup.find_all(list(_BLOCK_TAGS)):
+        node.append('\n')
+    return ExtractedPage(links, _clean_text(soup.get_text()), frozenset(menu_links), title)
+
+
+def extract_page(html: str, base_url: Optional[str] = None, with_text: bool = True) -> ExtractedPage:
+    """
+    Ссылки и видимый текст HTML-страницы за один разбор.
+
+    Args:
+        base_url: URL страницы — относительные href приводятся к абсолютным
+        with_text: False — собрать только ссылки (текст страницы не склеивается)
+    """
+    if not html:
+        return ExtractedPage([], '')
+    if LXML_AVAILABLE:
+        return _extract_lxml(html, base_url, with_text)
+    return _extract_bs4(html, base_url, with_text)
+
+
+def extract_links(html: str, base_url: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Ссылки страницы: список (абсолютный http(s) URL, текст ссылки) в порядке документа."""
+    return extract_page(html, base_url, with_text=False).links
+
+
+def extract_text(html: str) -> str:
+    """Видимый текст страницы (без script/style и т.п.), абзацы — с новой строки."""
+    return extract_page(html).text
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Дисковый кэш GET-ответов сайтов с условной перепроверкой (ETag / Last-Modified)
+
+Тела ответов хранятся по SHA-256 содержимого (одинаковые страницы — один файл),
+индекс URL — в SQLite рядом с ними. Свежая запись отдаётся без сети; устаревшая
+перепроверяется запросом If-None-Match / If-Modified-Since, и ответ 304 продлевает
+её без повторной загрузки тела. Общий размер ограничен: при превышении удаляются
+давно не использованные записи (LRU).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urldefrag, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import http_client
+from logger import logger
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_domain_ttls(raw):
+    """HTTP_CACHE_DOMAIN_TTLS: "example.com=86400,news.example.com=600" → {домен: секунды}."""
+    ttls = {}
+    for part in (raw or '').split(','):
+        domain, _, value = part.partition('=')
+        domain = domain.strip().lower()
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        try:
+            ttls[domain] = max(0, int(value.strip()))
+        except ValueError:
+            continue
+    return ttls
+
+
+HTTP_CACHE_DIR = Path(os.getenv('HTTP_CACHE_DIR') or (Path(__file__).parent / 'tasks' / 'http_cache'))
+# Предел размера кэша (МБ); 0 — кэш отключён, запросы идут напрямую
+HTTP_CACHE_MAX_MB = _env_int('HTTP_CACHE_MAX_MB', 256)
+# Сколько секунд ответ считается свежим без перепроверки; для отдельных доменов — HTTP_CACHE_DOMAIN_TTLS
+HTTP_CACHE_TTL_SECONDS = _env_int('HTTP_CACHE_TTL_SECONDS', 3600)
+HTTP_CACHE_DOMAIN_TTLS = _parse_domain_ttls(os.getenv('HTTP_CACHE_DOMAIN_TTLS', ''))
+# Ответы больше этого размера не кэшируются (байты)
+HTTP_CACHE_MAX_ENTRY_BYTES = 5 * 1024 * 1024
+
+# Заголовки ответа, которые сохраняются вместе с телом (тело уже распаковано — Content-Encoding не нужен)
+_STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    final_url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+CREATE INDEX IF NOT EXISTS idx_entries_body ON entries(body_hash);
+"""
+
+
+def ttl_for_url(url: str) -> int:
+    """TTL свежести для URL: настройка домена (или родительского домена), иначе общая."""
+    host = (urlparse(url).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    while host:
+        if host in HTTP_CACHE_DOMAIN_TTLS:
+            return HTTP_CACHE_DOMAIN_TTLS[host]
+        _, _, host = host.partition('.')
+    return HTTP_CACHE_TTL_SECONDS
+
+
+class HttpCache:
+    """Кэш GET-ответов: индекс в SQLite, тела — файлы по хэшу содержимого."""
+
+    def __init__(self, cache_dir, max_bytes: int):
+        self._dir = Path(cache_dir)
+        self._bodies = self._dir / 'bodies'
+        self._max_bytes = max_bytes
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        self._bodies.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self._dir / 'index.sqlite3'), timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _body_path(self, body_hash: str) -> Path:
+        return self._bodies / body_hash[:2] / body_hash
+
+    def _write_body(self, content: bytes) -> str:
+        body_hash = hashlib.sha256(content).hexdigest()
+        path = self._body_path(body_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+        return body_hash
+
+    @staticmethod
+    def _build_response(url: str, final_url: str, status: int, headers: dict, content: bytes,
+                        from_cache: bool) -> requests.Response:
+        """requests.Response из записи кэша: вызывающему коду доступны text, encoding, apparent_encoding."""
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.url = final_url or url
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.from_cache = from_cache
+        return response
+
+    def _load(self, url: str):
+        row = self._conn().execute('SELECT * FROM entries WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None, None
+        try:
+            content = self._body_path(row['body_hash']).read_bytes()
+        except OSError:
+            self._conn().execute('DELETE FROM entries WHERE url = ?', (url,))
+            return None, None
+        return row, content
+
+    def _store(self, url: str, response: requests.Response):
+        if response.status_code != 200:
+            return
+        # Пропущенное (не HTML) или обрезанное тело — не полная страница
+        if getattr(response, 'skipped', False) or getattr(response, 'truncated', False):
+            return
+        if 'no-store' in (response.headers.get('Cache-Control') or '').lower():
+            return
+        content = response.content
+        if len(content) > HTTP_CACHE_MAX_ENTRY_BYTES:
+            return
+        body_hash = self._write_body(content)
+        headers = {h: response.headers[h] for h in _STORED_HEADERS if h in response.headers}
+        now_ts = time.time()
+        self._conn().execute(
+            """
+            INSERT INTO entries (url, final_url, status, headers, body_hash, size, fetched_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET final_url = excluded.final_url, status = excluded.status,
+                headers = excluded.headers, body_hash = excluded.body_hash, size = excluded.size,
+                fetched_at = excluded.fetched_at, last_access = excluded.last_access
+            """,
+            (url, response.url or url, response.status_code, json.dumps(headers), body_hash, len(content),
+             now_ts, now_ts),
+        )
+        self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """Удаляет давно не использованные записи, пока размер уникальных тел больше предела."""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Вытеснение уже идёт в другом потоке
+        try:
+            conn = self._conn()
+            total = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM (SELECT body_hash, MAX(size) AS size FROM entries GROUP BY body_hash)'
+            ).fetchone()[0]
+            if total <= self._max_bytes:
+                return
+            target = int(self._max_bytes * 0.9)
+            rows = conn.execute('SELECT url, body_hash, size FROM entries ORDER BY last_access').fetchall()
+            removed = 0
+            for row in rows:
+                if total <= target:
+                    break
+                conn.execute('DELETE FROM entries WHERE url = ?', (row['url'],))
+                removed += 1
+                still_used = conn.execute(
+                    'SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1', (row['body_hash'],)
+                ).fetchone()
+                if still_used is None:
+                    total -= row['size']
+                    try:
+                        self._body_path(row['body_hash']).unlink()
+                    except OSError:
+                        pass
+            logger.info(f"HTTP-кэш: вытеснено {removed} записей, размер {total // 1024} КБ")
+        finally:
+            self._evict_lock.release()
+
+    def get(self, url: str, timeout=None, headers: Optional[dict] = None, page: bool = False) -> requests.Response:
+        """
+        GET с кэшем. У ответа есть атрибут from_cache (True — тело взято с диска,
+        в том числе после ответа 304). Ошибки сети пробрасываются как у requests.
+        page=True — загрузка из сети через http_client.get_page (только HTML, с пределом размера).
+        """
+        url = urldefrag(url)[0]
+        fetch = http_client.get_page if page else http_client.get
+        row, content = self._load(url)
+        now_ts = time.time()
+        if row is not None:
+            cached_headers = json.loads(row['headers'])
+            if now_ts - row['fetched_at'] < ttl_for_url(url):
+                self._conn().execute('UPDATE entries SET last_access = ? WHERE url = ?', (now_ts, url))
+                self.hits += 1
+                return self._build_response(url, row['final_url'], row['status'], cached_headers, content, True)
+
+            conditional = dict(headers or {})
+            if cached_headers.get('ETag'):
+                conditional['If-None-Match'] = cached_headers['ETag']
+            if cached_headers.get('Last-Modified'):
+                conditional['If-Modified-Since'] = cached_headers['Last-Modified']
+            if len(conditional) > len(headers or {}):
+                response = fetch(url, timeout=timeout, headers=conditional)
+                if response.status_code == 304:
+                    for name in _STORED_HEADERS:
+                        if name in response.headers:
+                            cached_headers[name] = response.headers[name]
+                    self._conn().execute(
+                        'UPDATE entries SET fetched_at = ?, last_access = ?, headers = ? WHERE url = ?',
+                        (now_ts, now_ts, json.dumps(cached_headers), url),
+                    )
+                    self.revalidated += 1
+                    return self._build_response(url, row['final_url'], row['status'], cached_headers, content, True)
+                self.misses += 1
+                self._store(url, response)
+                response.from_cache = False
+                return response
+
+        self.misses += 1
+        response = fetch(url, timeout=timeout, headers=headers)
+        self._store(url, response)
+        response.from_cache = False
+        return response
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses}
+
+
+_cache: Optional[HttpCache] = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[HttpCache]:
+    """Кэш процесса или None, если он отключён (HTTP_CACHE_MAX_MB=0) или недоступен."""
+    global _cache, _cache_failed
+    if HTTP_CACHE_MAX_MB <= 0 or _cache_failed:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None and not _cache_failed:
+                try:
+                    _cache = HttpCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB * 1024 * 1024)
+                except Exception as e:
+                    _cache_failed = True
+                    logger.warning(f"HTTP-кэш недоступен ({HTTP_CACHE_DIR}): {e}. Запросы идут без кэша")
+    return _cache
+
+
+def get(url: str, timeout=None, headers: Optional[dict] = None, page: bool = False) -> requests.Response:
+    """
+    GET страницы сайта через дисковый кэш (без кэша — напрямую через общий HTTP-клиент).
+    page=True — только HTML с пределом размера (см. http_client.get_page).
+    """
+    cache = get_cache()
+    if cache is None:
+        fetch = http_client.get_page if page else http_client.get
+        response = fetch(url, timeout=timeout, headers=headers)
+        response.from_cache = False
+        return response
+    return cache.get(url, timeout=timeout, headers=headers, page=page)
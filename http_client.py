@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Общий HTTP-клиент приложения: пул keep-alive соединений, заголовки браузера и таймауты
+
+Одна сессия requests на процесс: TCP/TLS-соединение с хостом и результат DNS
+переиспользуются всеми запросами анализа (проверка доступности, обход ссылок,
+инструменты агентов, ProxyAPI), а не открываются заново на каждый запрос.
+Страницы сайтов загружаются через get_page: потоком, с проверкой Content-Type до
+чтения тела и пределом размера. Запросы к сайтам (browser=True) идут через общий
+планировщик fetch_scheduler: лимиты на домен и паузы после 429/503.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import fetch_scheduler
+
+# Заголовки обычного браузера для запросов к сайтам компаний
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Таймаут по умолчанию: (подключение, чтение), секунды
+DEFAULT_TIMEOUT = (5, 15)
+
+
+def _env_int(name, default, minimum=1):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Сколько хостов держать в пуле и сколько соединений одновременно открывать к одному хосту
+HTTP_POOL_HOSTS = _env_int('HTTP_POOL_HOSTS', 32)
+HTTP_POOL_PER_HOST = _env_int('HTTP_POOL_PER_HOST', 8)
+# Предел тела HTML-страницы (МБ): больше — читается только начало
+HTTP_PAGE_MAX_MB = _env_int('HTTP_PAGE_MAX_MB', 5)
+PAGE_MAX_BYTES = HTTP_PAGE_MAX_MB * 1024 * 1024
+
+# Расширения файлов, которые не бывают HTML-страницами: для них сначала HEAD
+BINARY_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.zip', '.rar', '.7z', '.gz',
+                     '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.mp3', '.mp4', '.avi', '.mov', '.webm',
+                     '.exe', '.dmg', '.iso')
+
+_CHUNK_SIZE = 64 * 1024
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Общая сессия процесса (создаётся при первом обращении)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # pool_block: при исчерпании соединений к хосту запрос ждёт свободное,
+                # а не открывает лишнее — это и есть лимит соединений на хост
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_PER_HOST,
+                                      pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _send(method: str, url: str, headers: Optional[dict], timeout, browser: bool, **kwargs) -> requests.Response:
+    merged = dict(BROWSER_HEADERS) if browser else {}
+    if headers:
+        merged.update(headers)
+    kwargs.setdefault('allow_redirects', True)
+    response = get_session().request(method, url, headers=merged, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+    if browser:
+        fetch_scheduler.report(url, response.status_code, response.headers)
+    return response
+
+
+def request(method: str, url: str, headers: Optional[dict] = None, timeout=None, browser: bool = True,
+            **kwargs) -> requests.Response:
+    """
+    Запрос через общую сессию.
+
+    Args:
+        headers: Дополнительные заголовки (перекрывают заголовки браузера)
+        timeout: Секунды или (подключение, чтение); по умолчанию DEFAULT_TIMEOUT
+        browser: Запрос к сайту — заголовки браузера и очередь fetch_scheduler
+            (для API, например ProxyAPI, — False)
+
+    Raises:
+        fetch_scheduler.FetchSlotTimeout: очередь к домену не подошла за FETCH_MAX_WAIT секунд
+    """
+    if not browser:
+        return _send(method, url, headers, timeout, browser, **kwargs)
+    with fetch_scheduler.slot(url):
+        return _send(method, url, headers, timeout, browser, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """GET через общую сессию (см. request)."""
+    return request('GET', url, **kwargs)
+
+
+@contextmanager
+def stream(url: str, headers: Optional[dict] = None, timeout=None):
+    """
+    GET к сайту с потоковым чтением тела (with http_client.stream(url) as response).
+
+    Слот fetch_scheduler занят, пока тело читается внутри блока; ответ закрывается на выходе.
+
+    Raises:
+        fetch_scheduler.FetchSlotTimeout: очередь к домену не подошла за FETCH_MAX_WAIT секунд
+    """
+    with fetch_scheduler.slot(url):
+        response = _send('GET', url, headers, timeout, True, stream=True)
+        try:
+            yield response
+        finally:
+            response.close()
+
+
+def is_html_content_type(content_type: Optional[str]) -> bool:
+    """HTML или текст (пустой Content-Type тоже допускается — многие сайты его не шлют)."""
+    ct = (content_type or '').lower()
+    return not ct or 'html' in ct or ct.startswith('text/') or 'application/xhtml' in ct
+
+
+def _without_body(response: requests.Response, skipped: bool) -> requests.Response:
+    response._content = b''
+    response._content_consumed = True
+    response.skipped = skipped
+    response.truncated = False
+    return response
+
+
+def get_page(url: str, headers: Optional[dict] = None, timeout=None, max_bytes: Optional[int] = None
+             ) -> requests.Response:
+    """
+    GET HTML-страницы с предсказуемым объёмом загрузки.
+
+    Тело читается потоком и только после проверки заголовков: не-HTML (PDF, видео и т.п.)
+    и ответы с ошибкой не загружаются, длинный HTML обрывается на max_bytes (ссылки меню
+    обычно в начале страницы). Для URL с расширением файла (BINARY_EXTENSIONS) сначала идёт HEAD.
+
+    У ответа есть атрибуты skipped (тело не загружалось) и truncated (тело обрезано).
+    Слот fetch_scheduler занят до конца чтения тела.
+    """
+    with fetch_scheduler.slot(url):
+        return _get_page(url, headers, timeout, max_bytes or PAGE_MAX_BYTES)
+
+
+def _get_page(url: str, headers: Optional[dict], timeout, max_bytes: int) -> requests.Response:
+    if (urlparse(url).path or '').lower().endswith(BINARY_EXTENSIONS):
+        head = _send('HEAD', url, headers, timeout, True)
+        # 405/501 — сервер не поддерживает HEAD: решаем по заголовкам GET
+        if head.status_code not in (405, 501):
+            if head.status_code >= 400 or not is_html_content_type(head.headers.get('Content-Type')):
+                return _without_body(head, skipped=True)
+
+    response = _send('GET', url, headers, timeout, True, stream=True)
+    try:
+        if response.status_code >= 400 or not is_html_content_type(response.headers.get('Content-Type')):
+            return _without_body(response, skipped=True)
+        chunks = []
+        total = 0
+        truncated = False
+        for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+            chunks.append(chunk)
+            total += len(chunk)
+            if total > max_bytes:
+                truncated = True
+                break
+        response._content = b''.join(chunks)[:max_bytes]
+        response._content_consumed = True
+        response.skipped = False
+        response.truncated = truncated
+        return response
+    finally:
+        response.close()
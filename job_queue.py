@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ограниченная очередь задач анализа с фиксированным пулом рабочих потоков
+"""
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from logger import logger
+
+
+class QueueFullError(Exception):
+    """Очередь заполнена — новую задачу принять нельзя."""
+
+
+class AnalysisJobQueue:
+    """
+    Очередь задач анализа: не более max_size ожидающих задач и ровно workers
+    рабочих потоков. Позиция задачи в очереди доступна через position().
+
+    Потоки запускаются лениво при первой постановке задачи, чтобы основной
+    процесс Flask reloader не держал лишних потоков.
+
+    on_pending_change (опционально) получает список ожидающих task_id в порядке
+    очереди при каждом его изменении — например, чтобы сохранить позиции в общее хранилище.
+    """
+
+    def __init__(self, handler: Callable, workers: int = 2, max_size: int = 20, name: str = 'analysis',
+                 on_pending_change: Optional[Callable] = None):
+        self._handler = handler
+        self._on_pending_change = on_pending_change
+        self._workers = max(1, int(workers))
+        self._max_size = max(1, int(max_size))
+        self._name = name
+        self._pending = deque()  # task_id в порядке постановки
+        self._jobs: Dict[str, tuple] = {}  # task_id -> (args, kwargs)
+        self._running = set()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def _ensure_started(self):
+        """Запускает рабочие потоки (вызывается под self._cond)."""
+        if self._threads:
+            return
+        for i in range(self._workers):
+            t = threading.Thread(target=self._worker_loop, name=f'{self._name}-worker-{i + 1}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Очередь '{self._name}': запущено {self._workers} рабочих потоков (лимит очереди {self._max_size})")
+
+    def submit(self, task_id: str, *args, **kwargs) -> int:
+        """
+        Ставит задачу в очередь.
+
+        Returns:
+            int: Позиция в очереди (1 — следующая на выполнение)
+
+        Raises:
+            QueueFullError: если в очереди уже max_size ожидающих задач
+        """
+        with self._cond:
+            if len(self._pending) >= self._max_size:
+                raise QueueFullError(f"Очередь анализа заполнена ({self._max_size} задач)")
+            self._ensure_started()
+            self._jobs[task_id] = (args, kwargs)
+            self._pending.append(task_id)
+            position = len(self._pending)
+            pending = list(self._pending)
+            self._cond.notify()
+        self._notify_pending_change(pending)
+        return position
+
+    def _notify_pending_change(self, pending):
+        if self._on_pending_change is None:
+            return
+        try:
+            self._on_pending_change(pending)
+        except Exception as e:
+            logger.warning(f"Очередь '{self._name}': не удалось передать позиции задач: {e}")
+
+    def remove(self, task_id: str) -> bool:
+        """Убирает ожидающую задачу из очереди. False — задача уже выполняется или неизвестна."""
+        with self._cond:
+            if task_id not in self._jobs:
+                return False
+            self._pending.remove(task_id)
+            self._jobs.pop(task_id, None)
+            pending = list(self._pending)
+        self._notify_pending_change(pending)
+        return True
+
+    def position(self, task_id: str) -> Optional[int]:
+        """Позиция задачи в очереди (с 1) или None, если задача уже выполняется или неизвестна."""
+        with self._cond:
+            try:
+                return self._pending.index(task_id) + 1
+            except ValueError:
+                return None
+
+    def pending(self) -> list:
+        """task_id ожидающих задач в порядке очереди."""
+        with self._cond:
+            return list(self._pending)
+
+    def stats(self) -> dict:
+        """Краткая сводка: сколько задач ждёт и сколько выполняется."""
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'running': len(self._running),
+                'workers': self._workers,
+                'max_queue': self._max_size,
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                task_id = self._pending.popleft()
+                args, kwargs = self._jobs.pop(task_id, ((), {}))
+                self._running.add(task_id)
+                pending = list(self._pending)
+            self._notify_pending_change(pending)
+            try:
+                self._handler(task_id, *args, **kwargs)
+            except Exception as e:
+                logger.error(f"[{task_id}] Необработанная ошибка в обработчике очереди: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
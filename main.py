@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, Response
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
 import threading
@@ -19,6 +19,8 @@ import unicodedata
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import time
 import tempfile
+import shutil
+import zipfile
 warnings.filterwarnings('ignore')
 
 _executor_md_docx = ThreadPoolExecutor(max_workers=2, thread_name_prefix='md2docx')
@@ -309,12 +311,12 @@ os.environ["CREWAI_TRACING_ENABLED"] = "false"
 # телеметрия CrewAI пытается зарегистрировать signal.signal() и падает с
 # ValueError: signal only works in main thread
 try:
-    from Agents_crew import crew  # noqa: F401
+    from Agents_crew import crew_pool  # noqa: F401
 except Exception:
     pass
 
 # Вспомогательная функция для записи в debug.log (опционально)
-def update_progress_safely(task_id, new_progress, message=None):
+def update_progress_safely(task_id, new_progress, message=None, eta_seconds=None):
     """
     Безопасно обновляет прогресс задачи, гарантируя, что он только увеличивается
     
@@ -322,16 +324,10 @@ def update_progress_safely(task_id, new_progress, message=None):
         task_id: ID задачи
         new_progress: Новое значение прогресса (0-100)
         message: Опциональное сообщение для обновления
+        eta_seconds: Опциональная оценка оставшегося времени работы Crew (секунды)
     """
-    if task_id not in analysis_status:
-        return
-    
-    current_prog = analysis_status[task_id].get('progress', 0)
-    final_progress = max(current_prog, min(new_progress, 100))
-    analysis_status[task_id]['progress'] = final_progress
-    
-    if message:
-        analysis_status[task_id]['message'] = message
+    # Монотонность обеспечивает само хранилище (MAX(progress, new) в SQL)
+    task_store.update_progress(task_id, new_progress, message, eta_seconds=eta_seconds)
 
 def write_debug_log(data):
     """Безопасно записывает данные в debug.log, если файл доступен"""
@@ -477,155 +473,35 @@ def _add_run_with_emoji_font(paragraph, text, bold=False, italic=False, strike=F
     run.font.strike = strike
 
 
-def _normalize_url(url):
-    """Добавляет https:// для URL без схемы (www.example.com → https://www.example.com)."""
-    if not url or not url.strip():
-        return url
-    u = url.strip()
-    if not u.startswith(('http://', 'https://', 'mailto:', '#')):
-        if u.startswith('www.'):
-            return 'https://' + u
-        if u.startswith(('/')):
-            return u  # относительный путь — не нормализуем
-    return u
-
-
-def _extract_urls_from_markdown(text):
-    """Извлекает все URL из markdown: [text](url) и голые https?://... и www...."""
-    urls = set()
+def _extract_url_keys_from_markdown(text):
+    """Ключи _url_key всех URL из markdown: [text](url) и голые https?://... и www...."""
+    keys = set()
     if not text:
-        return urls
+        return keys
     def _add(u):
         u = _normalize_url(u)
         if u and not u.startswith('#') and not u.startswith('mailto:'):
-            urls.add(u)
-            if u.endswith('/'):
-                urls.add(u.rstrip('/'))
-            else:
-                urls.add(u + '/')
+            try:
+                keys.add(_url_key(u))
+            except ValueError:
+                pass  # битый URL (например, https://[bad) пропускаем, остальные ключи сохраняются
     for m in _RE_LINK.finditer(text):
         _add(m.group(2).strip())
     for m in _RE_BARE_URL.finditer(text):
         _add(m.group(1))
-    return urls
-
-
-def _hostname_base(host):
-    if not host:
-        return ''
-    h = host.lower()
-    if h.startswith('www.'):
-        return h[4:]
-    return h
-
-
-def _canonical_url_key(url):
-    """Ключ URL для whitelist: хост без www, путь без лишнего слэша, query."""
-    u = _normalize_url((url or '').strip())
-    p = urlparse(u)
-    host = _hostname_base(p.hostname or '')
-    path = (p.path or '/').rstrip('/') or '/'
-    q = p.query or ''
-    return (host, path, q)
-
-
-def _expand_url_variants_for_verified_set(u):
-    """Варианты строки URL для множества verified_urls (www, слэш, http/https)."""
-    u = _normalize_url((u or '').strip())
-    out = {u} if u else set()
-    if not u.startswith(('http://', 'https://')):
-        return out
-    p = urlparse(u)
-    path = p.path or '/'
-    if u.endswith('/') and path not in ('', '/'):
-        out.add(u.rstrip('/'))
-    elif path not in ('', '/') and not u.endswith('/'):
-        out.add(u + '/')
-    net = p.netloc.lower()
-    if net.startswith('www.'):
-        alt = urlunparse((p.scheme, net[4:], p.path, '', p.query, ''))
-    else:
-        alt = urlunparse((p.scheme, 'www.' + net, p.path, '', p.query, ''))
-    out.add(_normalize_url(alt))
-    for s in tuple(out):
-        if s.startswith('https://'):
-            out.add('http://' + s[8:])
-        elif s.startswith('http://'):
-            out.add('https://' + s[7:])
-    return {x for x in out if x}
-
-
-def _discover_internal_site_urls(company_url, max_pages=24, timeout=12):
-    """
-    BFS по ссылкам того же домена: реальные пути из HTML (как в меню сайта).
-    Возвращает (множество ключей _canonical_url_key, множество строк для verified_urls).
-    """
-    try:
-        from bs4 import BeautifulSoup
-    except ImportError:
-        return set(), set()
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-        'Connection': 'keep-alive',
-    }
-    seed = _normalize_url(company_url)
-    base_host = _hostname_base((urlparse(seed).hostname or ''))
-    if not base_host:
-        return set(), set()
+    return keys
 
-    allowed_keys = set()
-    verified_strings = set()
-
-    def register_url(u):
-        u = _normalize_url(u)
-        allowed_keys.add(_canonical_url_key(u))
-        verified_strings.update(_expand_url_variants_for_verified_set(u))
 
-    queue = [seed]
-    queued_keys = {_canonical_url_key(seed)}
-    pages_fetched = 0
-
-    while queue and pages_fetched < max_pages:
-        url = queue.pop(0)
-        try:
-            r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
-        except requests.RequestException:
-            continue
-        pages_fetched += 1
-        if r.status_code >= 400:
-            continue
-        final = r.url
-        register_url(final)
-
-        ct = (r.headers.get('Content-Type') or '').lower()
-        if 'html' not in ct and not ct.startswith('text/') and 'application/xhtml' not in ct:
-            continue
-        try:
-            soup = BeautifulSoup(r.text, 'html.parser')
-        except Exception:
-            continue
-        for a in soup.find_all('a', href=True):
-            href = (a.get('href') or '').strip()
-            if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:', 'data:')):
-                continue
-            abs_u = urljoin(final, href)
-            p = urlparse(abs_u)
-            if p.scheme not in ('http', 'https'):
-                continue
-            if _hostname_base(p.hostname or '') != base_host:
-                continue
-            clean = urlunparse((p.scheme, p.netloc, p.path, '', p.query, ''))
-            clean = _normalize_url(clean)
-            register_url(clean)
-            lk = _canonical_url_key(clean)
-            if lk not in queued_keys and len(queued_keys) < max_pages * 6:
-                queued_keys.add(lk)
-                queue.append(clean)
-
-    return allowed_keys, verified_strings
+def _discover_internal_site_urls(company_url, seed_page=None, crawl_options=None, stop_event=None):
+    """
+    Обход ссылок того же домена: реальные пути из HTML (как в меню сайта).
+    seed_page — уже загруженная главная страница (ответ проверки доступности);
+    crawl_options — бюджет обхода из запроса (parse_crawl_options), иначе значения по умолчанию;
+    stop_event — флаг, по которому обход прекращается досрочно.
+    Возвращает множество ключей _url_key найденных путей.
+    """
+    return discover_site_urls(company_url, timeout=12, seed_page=seed_page, stop_event=stop_event,
+                              **(crawl_options or {}))
 
 
 def _sanitize_markdown_links(text, allowed_keys):
@@ -635,37 +511,56 @@ def _sanitize_markdown_links(text, allowed_keys):
 
     def repl(m):
         label, url = m.group(1), m.group(2).strip()
-        if _canonical_url_key(url) in allowed_keys:
-            return m.group(0)
+        try:
+            if _url_key(url) in allowed_keys:
+                return m.group(0)
+        except ValueError:
+            pass  # битый URL — оставляем только текст ссылки
         return label
 
     return re.sub(r'\[([^\]]*)\]\(([^)]+)\)', repl, text)
 
 
-def _url_is_verified(url, verified_urls, company_url=None):
-    """Можно ли сделать ссылку кликабельной: только проверенные или того же домена."""
+def _verified_keys_from_result(result_data):
+    """
+    Ключи _url_key проверенных ссылок сохранённого результата или None.
+    Результаты старого формата хранят строки URL (verified_urls) — они приводятся к ключам.
+    """
+    keys = result_data.get('verified_url_keys')
+    if keys:
+        return set(keys)
+    legacy_urls = result_data.get('verified_urls')
+    if legacy_urls:
+        return {_url_key(u) for u in legacy_urls}
+    return None
+
+
+def _url_is_verified(url, verified_keys, company_url=None):
+    """
+    Можно ли сделать ссылку кликабельной: только проверенные (ключ _url_key в verified_keys)
+    или, если проверенных нет, того же домена.
+    """
     if not url or not url.strip():
         return False
     url_norm = _normalize_url(url.strip())
     if url_norm.startswith('/') and company_url:
         try:
-            cmp = urlparse(company_url)
+            cmp = _parse_url(company_url)
             base = f"{cmp.scheme or 'https'}://{cmp.netloc}"
-            url_norm = base.rstrip('/') + ('/' if not url_norm.startswith('/') else '') + url_norm
-        except Exception:
+            url_norm = base.rstrip('/') + url_norm
+        except ValueError:
             pass
-    if verified_urls is not None:
-        return url_norm in verified_urls
-    if company_url:
+    if verified_keys is not None:
         try:
-            cmp = urlparse(company_url)
-            lnk = urlparse(url_norm)
-            if lnk.netloc and cmp.netloc:
-                cmp_domain = cmp.netloc.lower().replace('www.', '')
-                lnk_domain = lnk.netloc.lower().replace('www.', '')
-                return lnk_domain == cmp_domain or lnk_domain.endswith('.' + cmp_domain)
-        except Exception:
-            pass
+            return _url_key(url_norm) in verified_keys
+        except ValueError:
+            # Битый URL из ответа LLM (например, https://[bad) не проверен — экспорт не падает
+            return False
+    if company_url:
+        cmp_domain = _url_host(company_url)
+        lnk_domain = _url_host(url_norm)
+        if lnk_domain and cmp_domain:
+            return lnk_domain == cmp_domain or lnk_domain.endswith('.' + cmp_domain)
     return False
 
 
@@ -741,7 +636,7 @@ def _split_and_add_with_bare_urls(paragraph, text, footnote_ctx=None):
         _add_run_with_emoji_font(paragraph, text)
         return
     ctx = footnote_ctx or {}
-    verified = ctx.get('verified_urls')
+    verified = ctx.get('verified_keys')
     company_url = ctx.get('company_url')
     last = 0
     for m in _RE_BARE_URL.finditer(text):
@@ -821,7 +716,7 @@ def _add_inline_formatted(paragraph, text, footnote_ctx=None):
             if m:
                 link_text = _strip_emoji(m.group(1))
                 url = m.group(2)
-                verified = (footnote_ctx or {}).get('verified_urls')
+                verified = (footnote_ctx or {}).get('verified_keys')
                 company_url = (footnote_ctx or {}).get('company_url')
                 if _url_is_verified(url, verified, company_url):
                     if link_text:
@@ -834,7 +729,7 @@ def _add_inline_formatted(paragraph, text, footnote_ctx=None):
                 _add_run_with_emoji_font(paragraph, part)
         elif part.startswith(('http://', 'https://', 'www.')):
             url = _normalize_url(part.rstrip('.,;:!?'))
-            verified = (footnote_ctx or {}).get('verified_urls')
+            verified = (footnote_ctx or {}).get('verified_keys')
             company_url = (footnote_ctx or {}).get('company_url')
             if _url_is_verified(url, verified, company_url):
                 _add_hyperlink(paragraph, part, url)
@@ -964,8 +859,8 @@ def _set_table_header_repeat(table):
         pass
 
 
-def _md_to_docx_content(doc, md_text, spacing=None, options=None, verified_urls=None, company_url=None):
-    """Заполняет документ python-docx контентом из Markdown. verified_urls — только эти URL делаются кликабельными. company_url — для проверки по домену если verified_urls нет."""
+def _md_to_docx_content(doc, md_text, spacing=None, options=None, verified_keys=None, company_url=None):
+    """Заполняет документ python-docx контентом из Markdown. verified_keys — ключи _url_key: только эти URL делаются кликабельными. company_url — для проверки по домену если verified_keys нет."""
     t0 = time.perf_counter()
     def_pt = lambda d, key, subkey: (d or {}).get(key, {}).get(subkey, 0)
     if spacing is None:
@@ -1014,7 +909,7 @@ def _md_to_docx_content(doc, md_text, spacing=None, options=None, verified_urls=
         else:
             lines_no_fndefs.append(line)
     lines = lines_no_fndefs
-    footnote_ctx = {'defs': footnote_defs, 'entries': [], 'id_to_num': {}, 'verified_urls': verified_urls, 'company_url': company_url}
+    footnote_ctx = {'defs': footnote_defs, 'entries': [], 'id_to_num': {}, 'verified_keys': verified_keys, 'company_url': company_url}
     n_lines = len(lines)
     i = 0
     in_fence = False
@@ -1468,7 +1363,7 @@ def _md_to_docx_content(doc, md_text, spacing=None, options=None, verified_urls=
             run_num.font.size = Pt(11)
             _add_inline_formatted(p_fn, fn_text, None)
     elapsed = time.perf_counter() - t0
-    msg = f"md-to-docx: разбор завершён, {n_lines} строк за {elapsed:.2f} с"
+    msg = f"md-to-docx: разбор завершён, {n_lines} строк за {elapsed:.2f} с; кэш URL: {url_cache_stats()}"
     if _log:
         _log.info(msg)
     print(msg, flush=True)
@@ -1489,6 +1384,21 @@ except ImportError as e:
     logger.warning(f"Модуль отслеживания расходов не доступен: {e}")
     COST_TRACKING_AVAILABLE = False
 
+from job_queue import AnalysisJobQueue, QueueFullError
+from task_store import ACTIVE_STATUSES, TaskStore
+import fetch_scheduler
+import http_client
+from page_store import PageSnapshot, TaskPageStore
+import site_graph
+from site_crawler import discover_site_urls, known_site_urls, parse_crawl_options
+from url_utils import (
+    normalize_url as _normalize_url,
+    parse_url as _parse_url,
+    url_cache_stats,
+    url_host as _url_host,
+    url_key as _url_key,
+)
+
 # #region agent log
 try:
     import json
@@ -1502,7 +1412,7 @@ except: pass
 is_werkzeug_main = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
 
 # CrewAI — отложенная загрузка (при первом анализе), чтобы приложение запускалось даже при ошибках
-crew = None
+crew_pool = None
 CREW_AVAILABLE = None
 _crew_load_error = None
 
@@ -1510,16 +1420,20 @@ print("ℹ CrewAI загружается при первом анализе (о
 
 
 def _load_crew():
-    """Загружает CrewAI при первом использовании. Возвращает (crew, error_msg)."""
-    global crew, CREW_AVAILABLE, _crew_load_error
-    if CREW_AVAILABLE is True and crew is not None:
-        return crew, None
+    """Загружает CrewAI при первом использовании. Возвращает (crew_pool, error_msg).
+
+    Каждый анализ берёт из пула собственный экземпляр Crew (crew_pool.lease()),
+    поэтому параллельные анализы не разделяют агентов и задачи.
+    """
+    global crew_pool, CREW_AVAILABLE, _crew_load_error
+    if CREW_AVAILABLE is True and crew_pool is not None:
+        return crew_pool, None
     if _crew_load_error and CREW_AVAILABLE is False:
         return None, _crew_load_error
     try:
-        from Agents_crew import crew as c
-        crew = c
-        if crew is None:
+        from Agents_crew import crew_pool as pool
+        crew_pool = pool
+        if crew_pool is None:
             CREW_AVAILABLE = False
             _crew_load_error = (
                 "CrewAI не инициализирован. Выполните:\n"
@@ -1529,8 +1443,8 @@ def _load_crew():
             return None, _crew_load_error
         CREW_AVAILABLE = True
         _crew_load_error = None
-        logger.info("CrewAI успешно загружен")
-        return crew, None
+        logger.info(f"CrewAI успешно загружен (пул Crew: {crew_pool.size} экз.)")
+        return crew_pool, None
     except ImportError as e:
         CREW_AVAILABLE = False
         _crew_load_error = (
@@ -1572,10 +1486,6 @@ def set_stored_password(new_password):
     raise RuntimeError('Смена пароля через API отключена. Измените APP_ACCESS_PASSWORD и перезапустите приложение.')
 
 
-# Хранилище результатов анализа (в продакшене использовать Redis или БД)
-analysis_results = {}
-analysis_status = {}
-analysis_costs = {}  # Хранилище расходов по задачам
 ANALYSIS_RESULTS_DIR = Path(__file__).parent / 'tasks'
 try:
     ANALYSIS_RESULT_TTL_DAYS = max(1, int(os.getenv('ANALYSIS_RESULT_TTL_DAYS', '7')))
@@ -1583,47 +1493,123 @@ except (TypeError, ValueError):
     ANALYSIS_RESULT_TTL_DAYS = 7
 
 
+def _env_int(name, default, minimum=1):
+    """Целое из переменной окружения; при ошибке — default, не меньше minimum."""
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Очередь анализов: фиксированное число рабочих потоков и ограничение длины очереди
+ANALYSIS_WORKERS = _env_int('ANALYSIS_WORKERS', 2)
+ANALYSIS_QUEUE_MAX = _env_int('ANALYSIS_QUEUE_MAX', 20)
+
+# Пакетный анализ: сколько задач пакета одновременно в очереди/работе и максимум URL в одном пакете
+ANALYSIS_BATCH_CONCURRENCY = _env_int('ANALYSIS_BATCH_CONCURRENCY', ANALYSIS_WORKERS)
+ANALYSIS_BATCH_MAX_URLS = _env_int('ANALYSIS_BATCH_MAX_URLS', 100)
+BATCH_POLL_INTERVAL_SECONDS = 3
+# Пакет без отметок планировщика дольше этого времени (секунды) считается брошенным
+# (процесс перезапущен или упал) и подхватывается заново
+BATCH_STALE_AFTER_SECONDS = 60
+
+# Обход ссылок сайта (whitelist для отчёта) идёт параллельно с Crew — по потоку на рабочий поток анализа.
+# SITE_CRAWL_JOIN_TIMEOUT — сколько ещё ждать обход после завершения Crew (секунды)
+_executor_site_crawl = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='site-crawl')
+SITE_CRAWL_JOIN_TIMEOUT = _env_int('SITE_CRAWL_JOIN_TIMEOUT', 60)
+
+# Флаги отмены задач, выполняющихся в этом процессе (task_id -> threading.Event)
+_cancel_events = {}
+_cancel_events_lock = threading.Lock()
+
+# Поток статуса (SSE): как часто сервер проверяет хранилище, пульс и максимальная длительность соединения
+SSE_POLL_INTERVAL_SECONDS = 1
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = _env_int('SSE_MAX_STREAM_SECONDS', 600)
+SSE_RETRY_MS = 3000
+
+# Кэш готовых результатов по каноническому URL компании (0 — кэш отключён)
+ANALYSIS_CACHE_TTL_HOURS = _env_int('ANALYSIS_CACHE_TTL_HOURS', 24, minimum=0)
+
+# Хранилище задач и результатов: SQLite (WAL), общее для всех рабочих процессов приложения
+TASK_DB_PATH = Path(os.getenv('TASK_DB_PATH') or (ANALYSIS_RESULTS_DIR / 'tasks.sqlite3'))
+task_store = TaskStore(TASK_DB_PATH, cache_size=_env_int('TASK_STORE_CACHE_SIZE', 256))
+# Активная задача без обновлений дольше этого срока считается прерванной (процесс перезапущен)
+ANALYSIS_STALE_AFTER_MINUTES = _env_int('ANALYSIS_STALE_AFTER_MINUTES', 45)
+
+
 def _result_file_path(task_id):
     """Путь к файлу с результатом анализа для конкретной задачи."""
     safe_task_id = "".join(ch for ch in str(task_id) if ch.isdigit())
     return ANALYSIS_RESULTS_DIR / f'analysis_{safe_task_id}.json'
 
 
+def _task_artifacts_dir(task_id):
+    """Каталог артефактов Crew (задачи 1–3, crew_output.md) для конкретного анализа."""
+    safe_task_id = "".join(ch for ch in str(task_id) if ch.isdigit())
+    return ANALYSIS_RESULTS_DIR / safe_task_id
+
+
 def save_analysis_result(task_id, result_data):
-    """Сохраняет результат анализа на диск для устойчивого экспорта."""
+    """Сохраняет результат анализа в хранилище задач (для экспорта и кэша по URL)."""
     try:
-        ANALYSIS_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-        _result_file_path(task_id).write_text(
-            json.dumps(result_data, ensure_ascii=False),
-            encoding='utf-8'
-        )
+        url_key = _result_cache_key(result_data['url']) if result_data.get('url') else None
+        task_store.save_result(task_id, result_data, url_key=url_key)
         cleanup_old_analysis_result_files()
     except Exception as e:
-        logger.warning(f"[{task_id}] Не удалось сохранить результат на диск: {e}")
+        logger.warning(f"[{task_id}] Не удалось сохранить результат: {e}")
 
 
 def load_analysis_result(task_id):
-    """Загружает результат анализа с диска (если он есть)."""
+    """Загружает результат анализа из хранилища; старые tasks/analysis_*.json переносятся в него при чтении."""
     try:
+        data = task_store.get_result(task_id)
+        if data is not None:
+            return data
         fp = _result_file_path(task_id)
         if not fp.exists():
             return None
         data = json.loads(fp.read_text(encoding='utf-8'))
         if not isinstance(data, dict):
             return None
+        url_key = _result_cache_key(data['url']) if data.get('url') else None
+        task_store.save_result(task_id, data, url_key=url_key, completed_at=fp.stat().st_mtime)
         return data
     except Exception as e:
-        logger.warning(f"[{task_id}] Не удалось загрузить результат с диска: {e}")
+        logger.warning(f"[{task_id}] Не удалось загрузить результат: {e}")
         return None
 
 
+def _result_cache_key(company_url):
+    """Ключ кэша результатов: _url_key — хост без www, путь и query (схема не учитывается)."""
+    return _url_key(company_url)
+
+
+def find_cached_result(company_url):
+    """
+    Ищет свежий (моложе ANALYSIS_CACHE_TTL_HOURS) результат анализа того же URL.
+
+    Returns:
+        tuple: (task_id, result_data) или (None, None)
+    """
+    if ANALYSIS_CACHE_TTL_HOURS <= 0:
+        return None, None
+    return task_store.find_fresh_result(_result_cache_key(company_url), ANALYSIS_CACHE_TTL_HOURS * 60 * 60)
+
+
 def cleanup_old_analysis_result_files():
-    """Удаляет старые файлы результатов analysis_*.json из tasks/."""
+    """Удаляет старые результаты из хранилища, устаревшие analysis_*.json и каталоги артефактов задач из tasks/."""
     try:
-        if not ANALYSIS_RESULTS_DIR.exists():
-            return
         now_ts = time.time()
         ttl_seconds = ANALYSIS_RESULT_TTL_DAYS * 24 * 60 * 60
+        task_store.cleanup(ttl_seconds)
+        # Задачи, которые ждут в очереди этого процесса, живы: обновляем их перед поиском зависших
+        task_store.set_queue_positions(analysis_queue.pending())
+        task_store.fail_stale_tasks(ANALYSIS_STALE_AFTER_MINUTES * 60, 'Ошибка: анализ прерван (перезапуск приложения)')
+        resume_stale_batches()
+        site_graph.cleanup()
+        if not ANALYSIS_RESULTS_DIR.exists():
+            return
         for file_path in ANALYSIS_RESULTS_DIR.glob('analysis_*.json'):
             try:
                 age_seconds = now_ts - file_path.stat().st_mtime
@@ -1631,6 +1617,14 @@ def cleanup_old_analysis_result_files():
                     file_path.unlink(missing_ok=True)
             except Exception as e:
                 logger.warning(f"Не удалось удалить старый файл результата {file_path.name}: {e}")
+        for dir_path in ANALYSIS_RESULTS_DIR.iterdir():
+            if not dir_path.is_dir() or not dir_path.name.isdigit():
+                continue
+            try:
+                if now_ts - dir_path.stat().st_mtime > ttl_seconds:
+                    shutil.rmtree(dir_path, ignore_errors=True)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить старый каталог артефактов {dir_path.name}: {e}")
     except Exception as e:
         logger.warning(f"Ошибка очистки старых файлов результатов: {e}")
 
@@ -1674,16 +1668,12 @@ def auth_change_password():
     return jsonify({'ok': True})
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze():
-    if not request.json:
-        return jsonify({'error': 'Требуется JSON в теле запроса'}), 400
-    
-    data = request.json
-    company_url = data.get('url', '').strip()
+def _normalize_company_url(raw_url):
+    """Приводит URL компании к виду https://...; возвращает (url, ошибка)."""
+    company_url = (raw_url or '').strip()
     
     if not company_url:
-        return jsonify({'error': 'URL не может быть пустым'}), 400
+        return None, 'URL не может быть пустым'
     
     # Валидация и нормализация URL
     if not company_url.startswith(('http://', 'https://')):
@@ -1693,44 +1683,83 @@ def analyze():
     try:
         parsed = urlparse(company_url)
         if not parsed.netloc:
-            return jsonify({'error': 'Некорректный URL'}), 400
+            return None, 'Некорректный URL'
     except Exception:
-        return jsonify({'error': 'Некорректный URL'}), 400
+        return None, 'Некорректный URL'
+    return company_url, None
+
+
+def _start_analysis(company_url, force=False, crawl_options=None):
+    """
+    Запускает анализ сайта: результат из кэша, присоединение к идущему анализу или новая задача в очереди.
+    crawl_options — бюджет обхода ссылок сайта (parse_crawl_options).
+    
+    Returns:
+        tuple: (тело ответа, HTTP-код, дополнительные заголовки)
+    """
+    # Свежий результат того же сайта отдаём сразу (force=true — принудительный повторный анализ)
+    if not force:
+        cached_task_id, cached_result = find_cached_result(company_url)
+        if cached_task_id:
+            if task_store.get_status(cached_task_id) is None:
+                task_store.set_status(cached_task_id, {
+                    'status': 'completed',
+                    'progress': 100,
+                    'message': 'Анализ завершен (результат из кэша)',
+                    'cost': cached_result.get('cost'),
+                    'initial_balance': None
+                }, url=cached_result.get('url'))
+            logger.info(f"Результат для {company_url} взят из кэша (Task ID: {cached_task_id})")
+            return {
+                'task_id': cached_task_id,
+                'status': 'completed',
+                'cached': True,
+                'cached_at': cached_result.get('timestamp'),
+                'message': 'Результат из кэша'
+            }, 200, {}
     
     # Проверка доступности CrewAI до создания задачи
     _c, _err = _load_crew()
     if _c is None:
         hint = ' Выполните: pip install --upgrade "crewai[tools]>=0.80" "pydantic>=2.10"'
-        return jsonify({
+        return {
             'error': 'CrewAI не доступен.' + hint
-        }), 503
+        }, 503, {}
     
     # Генерируем уникальный ID для задачи
     task_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
     
-    logger.info(f"Запуск анализа для URL: {company_url} (Task ID: {task_id})")
-    
-    # Получаем начальный баланс для отслеживания расходов
-    initial_balance = None
-    if COST_TRACKING_AVAILABLE:
-        try:
-            initial_balance = get_balance()
-            if initial_balance is not None:
-                logger.info(f"Начальный баланс: {initial_balance} руб.")
-            else:
-                logger.warning("Не удалось получить начальный баланс. Отслеживание стоимости будет недоступно.")
-        except Exception as e:
-            logger.error(f"Ошибка при получении начального баланса: {e}")
-            initial_balance = None
-    
-    # Устанавливаем статус "в процессе"
-    analysis_status[task_id] = {
-        'status': 'processing',
+    # Тот же сайт уже анализируется (в любом рабочем процессе) — присоединяемся к идущему анализу
+    # вместо второго запуска Crew. Проверка и создание задачи атомарны на уровне SQLite.
+    # Статус "в очереди": баланс для расчёта стоимости берётся при старте выполнения
+    url_key = _result_cache_key(company_url)
+    active_task_id, created = task_store.create_task_if_idle(task_id, company_url, url_key, {
+        'status': 'queued',
         'progress': 0,
-        'message': 'Анализ запущен...',
+        'message': 'Задача поставлена в очередь...',
         'cost': None,
-        'initial_balance': initial_balance
-    }
+        'initial_balance': None
+    }, stale_after=ANALYSIS_STALE_AFTER_MINUTES * 60)
+    
+    if not created:
+        status = task_store.get_status(active_task_id) or {}
+        logger.info(f"Анализ {company_url} уже выполняется (Task ID: {active_task_id}) — запрос присоединён")
+        return {
+            'task_id': active_task_id,
+            'status': status.get('status', 'processing'),
+            'queue_position': status.get('queue_position'),
+            'coalesced': True,
+            'message': 'Анализ этого сайта уже выполняется — показываем его прогресс'
+        }, 200, {}
+    
+    logger.info(f"Запуск анализа для URL: {company_url} (Task ID: {task_id})")
+    
+    try:
+        position = analysis_queue.submit(task_id, company_url, crawl_options=crawl_options)
+    except QueueFullError as e:
+        task_store.delete_task(task_id)
+        logger.warning(f"[{task_id}] {e}")
+        return {'error': 'Очередь анализа заполнена. Попробуйте позже.'}, 503, {'Retry-After': '60'}
     
     # #region agent log
     write_debug_log({
@@ -1741,70 +1770,127 @@ def analyze():
         "message": "Задача создана",
         "data": {
             "task_id": task_id,
-            "status": analysis_status[task_id],
+            "status": task_store.get_status(task_id),
+            "queue_position": position,
             "timestamp": datetime.now().isoformat()
         }
     })
     # #endregion
     
-    logger.info(f"Задача {task_id} создана в analysis_status. Всего задач: {len(analysis_status)}")
-    
-    # Запускаем анализ в отдельном потоке
-    thread = threading.Thread(
-        target=run_analysis,
-        args=(task_id, company_url, initial_balance)
-    )
-    thread.daemon = True
-    thread.start()
+    logger.info(f"Задача {task_id} поставлена в очередь (позиция {position}). Всего задач: {task_store.count_tasks()}")
     
-    return jsonify({
+    return {
         'task_id': task_id,
-        'status': 'processing',
-        'message': 'Анализ запущен'
-    })
+        'status': 'queued',
+        'queue_position': position,
+        'message': 'Анализ поставлен в очередь'
+    }, 200, {}
+
 
-def run_analysis(task_id, company_url, initial_balance=None):
-    """Выполняет анализ сайта компании"""
+def _parse_bool_flag(value):
+    return str(value if value is not None else '').strip().lower() in ('1', 'true', 'yes')
+
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze():
+    if not request.json:
+        return jsonify({'error': 'Требуется JSON в теле запроса'}), 400
+    
+    data = request.json
+    company_url, error = _normalize_company_url(data.get('url', ''))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    crawl_options, error = parse_crawl_options(data.get('crawl'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    force = _parse_bool_flag(data.get('force', request.args.get('force', '')))
+    payload, status_code, headers = _start_analysis(company_url, force=force, crawl_options=crawl_options)
+    response = jsonify(payload)
+    for name, value in headers.items():
+        response.headers[name] = value
+    return response, status_code
+
+def _register_cancel_event(task_id):
+    """Локальный флаг отмены выполняющейся задачи: DELETE в этом же процессе срабатывает без обращения к БД."""
+    event = threading.Event()
+    with _cancel_events_lock:
+        _cancel_events[task_id] = event
+    return event
+
+
+def _unregister_cancel_event(task_id):
+    with _cancel_events_lock:
+        _cancel_events.pop(task_id, None)
+
+
+def _cancelled_status(cost=None, initial_balance=None):
+    """Итоговый статус отменённого анализа."""
+    return {
+        'status': 'cancelled',
+        'progress': 0,
+        'message': 'Анализ отменён',
+        'cost': cost,
+        'initial_balance': initial_balance
+    }
+
+
+def run_analysis(task_id, company_url, initial_balance=None, crawl_options=None):
+    """Выполняет анализ сайта компании (crawl_options — бюджет обхода ссылок из запроса)"""
+    from crew_progress import AnalysisCancelled, CrewProgressReporter
+    cancel_event = _register_cancel_event(task_id)
+    
+    def is_cancelled():
+        # Отмену могли запросить и в другом рабочем процессе — тогда флаг есть только в хранилище
+        return cancel_event.is_set() or task_store.is_cancel_requested(task_id)
+    
+    progress_reporter = None
+    crawl_future = None
+    # Страницы, уже загруженные в этой задаче: главная из проверки доступности не скачивается повторно
+    task_pages = TaskPageStore()
     try:
         logger.info(f"[{task_id}] Начало анализа для {company_url}")
         
-        # Проверяем, что задача существует
-        if task_id not in analysis_status:
-            logger.error(f"[{task_id}] Задача не найдена в analysis_status при запуске run_analysis")
-            # Создаем задачу, если её нет
-            analysis_status[task_id] = {
-                'status': 'processing',
-                'progress': 0,
-                'message': 'Инициализация анализа...',
-                'cost': None,
-                'initial_balance': initial_balance
-            }
-            logger.warning(f"[{task_id}] Задача создана в run_analysis (не должна была отсутствовать)")
+        # Задача вышла из очереди — статус "в процессе". Переход атомарный: отмена (DELETE),
+        # пришедшая в любой момент до него, не перезаписывается, и отменённая задача не запускается
+        if not task_store.start_processing(task_id, 'Анализ запущен...'):
+            current_status = task_store.get_status(task_id)
+            if current_status is None:
+                logger.warning(f"[{task_id}] Задача не найдена в хранилище при запуске run_analysis")
+            else:
+                logger.info(f"[{task_id}] Задача не в очереди (статус {current_status.get('status')}) — не запускается")
+            return
         
-        _crew, err = _load_crew()
-        if _crew is None:
+        # Баланс берём при старте выполнения, а не при постановке в очередь:
+        # иначе в стоимость попадут расходы задач, выполнявшихся во время ожидания
+        if initial_balance is None and COST_TRACKING_AVAILABLE:
+            try:
+                initial_balance = get_balance()
+                if initial_balance is not None:
+                    logger.info(f"[{task_id}] Начальный баланс: {initial_balance} руб.")
+                else:
+                    logger.warning(f"[{task_id}] Не удалось получить начальный баланс. Отслеживание стоимости будет недоступно.")
+            except Exception as e:
+                logger.error(f"[{task_id}] Ошибка при получении начального баланса: {e}")
+                initial_balance = None
+        if initial_balance is not None:
+            task_store.set_initial_balance(task_id, initial_balance)
+        
+        _pool, err = _load_crew()
+        if _pool is None:
             msg = (err or "CrewAI не доступен.").split('\n')[0]
             logger.error(f"[{task_id}] {msg}")
             raise Exception(msg)
         
         # Проверяем доступность сайта с правильными заголовками
         try:
-            if task_id in analysis_status:
-                update_progress_safely(task_id, 5, 'Проверка доступности сайта...')
-            else:
-                logger.error(f"[{task_id}] Задача исчезла из analysis_status перед проверкой сайта")
-            
-            # Заголовки для имитации обычного браузера
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
+            if not task_store.update_progress(task_id, 5, 'Проверка доступности сайта...'):
+                logger.error(f"[{task_id}] Задача исчезла из хранилища перед проверкой сайта")
             
-            response = requests.get(company_url, timeout=10, allow_redirects=True, headers=headers)
+            # Общий клиент с заголовками браузера: соединение с сайтом затем переиспользует обход ссылок.
+            # get_page читает тело потоком с пределом размера — ответ станет затравкой обхода и скрапинга
+            response = http_client.get_page(company_url, timeout=10)
             
             # Обрабатываем разные коды ответа
             if response.status_code == 403:
@@ -1820,7 +1906,11 @@ def run_analysis(task_id, company_url, initial_balance=None):
                 logger.warning(f"[{task_id}] Сайт вернул код {response.status_code}. Продолжаем анализ.")
             
             logger.info(f"[{task_id}] Проверка доступности завершена, код ответа: {response.status_code}")
+            task_pages.put(PageSnapshot.from_response(company_url, response))
             
+        except fetch_scheduler.FetchSlotTimeout as e:
+            # Сайт не виноват: домен приостановлен после 429/503 или занят другими анализами
+            logger.warning(f"[{task_id}] Проверка доступности не дождалась очереди запросов: {e}. Продолжаем анализ.")
         except requests.exceptions.Timeout:
             raise Exception("Сайт не отвечает (таймаут). Проверьте правильность URL и доступность сайта.")
         except requests.exceptions.ConnectionError as e:
@@ -1837,6 +1927,12 @@ def run_analysis(task_id, company_url, initial_balance=None):
                 # Для других ошибок предупреждаем, но не блокируем
                 logger.warning(f"[{task_id}] Ошибка при проверке доступности: {error_msg}. Продолжаем анализ.")
         
+        # Обход ссылок зависит только от URL — запускаем его сейчас, параллельно с Crew,
+        # а результат забираем при фильтрации ссылок отчёта
+        crawl_future = _executor_site_crawl.submit(_discover_internal_site_urls, company_url,
+                                                   seed_page=task_pages.get(company_url),
+                                                   crawl_options=crawl_options, stop_event=cancel_event)
+        
         # Извлекаем название компании из URL
         parsed_url = urlparse(company_url)
         domain = parsed_url.netloc
@@ -1850,79 +1946,25 @@ def run_analysis(task_id, company_url, initial_balance=None):
         update_progress_safely(task_id, 10, 'Подготовка к анализу...')
         logger.info(f"[{task_id}] Этап 1: Подготовка к анализу")
         
+        # Отдельный каталог артефактов: параллельные анализы не перезаписывают файлы друг друга
+        artifacts_dir = _task_artifacts_dir(task_id)
+        artifacts_dir.mkdir(parents=True, exist_ok=True)
+        task1_path = artifacts_dir / 'task_1_scraped_data.md'
+        
         # Подготавливаем входные данные
         inputs = {
             "company_url": company_url,
             "company_name": company_name,
         }
         
-        # Запускаем поток для плавного обновления прогресса во время выполнения CrewAI
-        import time
-        progress_thread_running = threading.Event()
-        progress_thread_running.set()
-        start_time = time.time()
-        start_progress = 15
-        target_progress = 88  # Увеличено до 88% для более плавного финала
-        estimated_duration = 120  # Ожидаемая длительность анализа в секундах (2 минуты)
-        
-        def update_progress_during_analysis():
-            """Плавно обновляет прогресс во время выполнения CrewAI анализа"""
-            messages = [
-                'Инициализация анализа...',
-                'Сбор информации с сайта...',
-                'Обработка данных...',
-                'Анализ структуры компании...',
-                'Анализ продуктов и услуг...',
-                'Анализ финансовых показателей...',
-                'Анализ стратегических направлений...',
-                'Формирование аналитического отчета...',
-                'Структурирование данных...',
-                'Финальная обработка...',
-            ]
-            message_index = 0
-            
-            last_progress = start_progress  # Отслеживаем последнее значение прогресса
-            
-            while progress_thread_running.is_set():
-                if task_id not in analysis_status or analysis_status[task_id]['status'] != 'processing':
-                    break
-                
-                elapsed_time = time.time() - start_time
-                
-                # Более равномерное линейное увеличение прогресса
-                if elapsed_time < estimated_duration:
-                    # Линейное увеличение для равномерности
-                    progress_ratio = min(elapsed_time / estimated_duration, 1.0)
-                    # Используем слегка ускоренную функцию для более естественного движения
-                    # Комбинация линейной и квадратичной для плавности без замедления в начале
-                    smooth_ratio = progress_ratio * (0.3 + 0.7 * progress_ratio)  # 30% линейная + 70% квадратичная
-                    calculated_progress = int(start_progress + (target_progress - start_progress) * smooth_ratio)
-                else:
-                    # Если прошло больше времени, медленно приближаемся к target_progress
-                    extra_time = elapsed_time - estimated_duration
-                    # Медленное увеличение после истечения ожидаемого времени
-                    additional_progress = min(int(extra_time / 10), target_progress - start_progress)
-                    calculated_progress = min(start_progress + additional_progress, target_progress)
-                
-                # ВАЖНО: Прогресс может только увеличиваться, никогда не уменьшаться
-                # Используем max, чтобы гарантировать монотонное увеличение
-                current_progress = max(last_progress, calculated_progress)
-                last_progress = current_progress  # Сохраняем для следующей итерации
-                
-                # Обновляем сообщение каждые ~12 секунд (10 сообщений за ~120 секунд)
-                if elapsed_time > 0:
-                    new_message_index = min(int(elapsed_time / (estimated_duration / len(messages))), len(messages) - 1)
-                    if new_message_index != message_index:
-                        message_index = new_message_index
-                
-                if task_id in analysis_status and analysis_status[task_id]['status'] == 'processing':
-                    update_progress_safely(task_id, current_progress, messages[message_index])
-                
-                time.sleep(1)  # Обновляем каждую секунду для плавности
-        
-        progress_thread = threading.Thread(target=update_progress_during_analysis)
-        progress_thread.daemon = True
-        progress_thread.start()
+        # Прогресс по реальным событиям Crew: шаги агентов, вызовы инструментов, завершение задач.
+        # Репортёр же проверяет отмену и прерывает Crew между шагами
+        progress_reporter = CrewProgressReporter(
+            lambda progress, message, eta: update_progress_safely(task_id, progress, message, eta_seconds=eta),
+            task_id=task_id,
+            is_cancelled=is_cancelled
+        )
+        progress_reporter.check_cancelled()
         
         # Запускаем анализ
         update_progress_safely(task_id, 15, 'Запуск анализа...')
@@ -1942,47 +1984,59 @@ def run_analysis(task_id, company_url, initial_balance=None):
         })
         # #endregion
         
-        result = _crew.kickoff(inputs=inputs)
+        # Собственный экземпляр Crew на время анализа — параллельные анализы не делят агентов и задачи
+        from Agents_crew import configure_crew_output, configure_crew_progress
+        with _pool.lease() as _crew:
+            configure_crew_output(_crew, artifacts_dir)
+            # Колбэки и контекст инструментов снимаются при возврате экземпляра в пул (CrewPool.release)
+            configure_crew_progress(_crew, progress_reporter, page_store=task_pages)
+            result = _crew.kickoff(inputs=inputs)
         result_str = str(result)
+        logger.info(f"[{task_id}] Статистика Crew: {progress_reporter.stats()}")
+        logger.info(
+            f"[{task_id}] Страниц задачи: {len(task_pages)}, повторных использований: {task_pages.hits}, "
+            f"почти дубликатов не отдано агентам: {task_pages.duplicates.skipped}; "
+            f"очередь запросов к сайтам: {fetch_scheduler.stats()}"
+        )
+        progress_reporter.check_cancelled()
 
         # Реальные пути с сайта (HTML-обход) — whitelist для ссылок и снятие выдуманных [текст](url)
-        verified_urls = set()
+        verified_keys = set()
         try:
-            if task_id in analysis_status:
-                update_progress_safely(task_id, analysis_status[task_id].get('progress', 88), 'Проверка структуры ссылок сайта...')
+            # Прогресс не меняется (MAX), обновляется только сообщение
+            update_progress_safely(task_id, 0, 'Проверка структуры ссылок сайта...')
         except Exception:
             pass
         try:
-            allowed_keys, verified_from_crawl = _discover_internal_site_urls(company_url)
+            try:
+                allowed_keys = crawl_future.result(timeout=SITE_CRAWL_JOIN_TIMEOUT)
+            except FuturesTimeoutError:
+                logger.warning(f"[{task_id}] Обход сайта не завершился за {SITE_CRAWL_JOIN_TIMEOUT} с после работы Crew")
+                # Пути, известные из прошлых анализов этого домена
+                allowed_keys = known_site_urls(company_url)
             if allowed_keys:
                 result_str = _sanitize_markdown_links(result_str, allowed_keys)
-                verified_urls = verified_from_crawl
+                verified_keys = allowed_keys
                 logger.info(
                     f"[{task_id}] Обход сайта: {len(allowed_keys)} уникальных URL; "
-                    f"в отчёте оставлены только ссылки из реальной структуры"
+                    f"в отчёте оставлены только ссылки из реальной структуры; кэш URL: {url_cache_stats()}"
                 )
             else:
                 logger.warning(f"[{task_id}] Обход сайта не дал ссылок — whitelist только из Задачи 1 (слабее)")
-                task1_path = Path(__file__).parent / 'tasks' / 'task_1_scraped_data.md'
                 if task1_path.exists():
                     task1_text = task1_path.read_text(encoding='utf-8', errors='replace')
-                    verified_urls = _extract_urls_from_markdown(task1_text)
-                    t1_keys = {_canonical_url_key(u) for u in verified_urls}
-                    result_str = _sanitize_markdown_links(result_str, t1_keys)
-                    logger.info(f"[{task_id}] Извлечено {len(verified_urls)} URL из Task 1 для фильтрации")
+                    verified_keys = _extract_url_keys_from_markdown(task1_text)
+                    result_str = _sanitize_markdown_links(result_str, verified_keys)
+                    logger.info(f"[{task_id}] Извлечено {len(verified_keys)} URL из Task 1 для фильтрации")
         except Exception as e:
             logger.warning(f"[{task_id}] Ошибка обхода/фильтра ссылок: {e}")
             try:
-                task1_path = Path(__file__).parent / 'tasks' / 'task_1_scraped_data.md'
                 if task1_path.exists():
                     task1_text = task1_path.read_text(encoding='utf-8', errors='replace')
-                    verified_urls = _extract_urls_from_markdown(task1_text)
+                    verified_keys = _extract_url_keys_from_markdown(task1_text)
             except Exception:
                 pass
         
-        # Останавливаем поток обновления прогресса
-        progress_thread_running.clear()
-        
         # #region agent log
         write_debug_log({
             "sessionId": "debug-session",
@@ -2011,44 +2065,382 @@ def run_analysis(task_id, company_url, initial_balance=None):
         cost = None
         if COST_TRACKING_AVAILABLE and initial_balance is not None:
             cost = calculate_analysis_cost(task_id, initial_balance)
-            analysis_costs[task_id] = cost
             logger.info(f"[{task_id}] Стоимость анализа: {cost} руб.")
         
         time.sleep(0.3)  # Небольшая пауза для плавности
         
         # Сохраняем результат
         update_progress_safely(task_id, 96, 'Сохранение результатов...')
-        analysis_results[task_id] = {
+        result_data = {
             'result': result_str,
             'url': company_url,
             'company_name': company_name,
             'timestamp': datetime.now().isoformat(),
             'cost': cost,
             'task_id': task_id,
-            'verified_urls': list(verified_urls) if verified_urls else None
+            'artifacts_dir': artifacts_dir.name,
+            'verified_url_keys': sorted(verified_keys) if verified_keys else None
         }
-        save_analysis_result(task_id, analysis_results[task_id])
+        save_analysis_result(task_id, result_data)
         
-        # Устанавливаем статус "завершено"
-        analysis_status[task_id] = {
+        # Устанавливаем статус "завершено" — только если задача всё ещё выполняется:
+        # отмена (DELETE), пришедшая после последней проверки, завершает её как 'cancelled'
+        if progress_reporter is not None:
+            progress_reporter.stop()
+        final_status = task_store.finish_processing(task_id, {
             'status': 'completed',
             'progress': 100,
             'message': 'Анализ завершен',
             'cost': cost,
             'initial_balance': initial_balance
-        }
+        }, cancelled=_cancelled_status(cost, initial_balance))
         
-        logger.info(f"[{task_id}] Анализ успешно завершен. Готов к новой итерации.")
+        if final_status == 'completed':
+            logger.info(f"[{task_id}] Анализ успешно завершен. Готов к новой итерации.")
+        else:
+            logger.info(f"[{task_id}] Анализ завершен, но задача уже в статусе {final_status or 'не выполняется'}")
         
+    except AnalysisCancelled:
+        if progress_reporter is not None:
+            progress_reporter.stop()
+        logger.info(f"[{task_id}] Анализ отменён пользователем")
+        cost = None
+        if COST_TRACKING_AVAILABLE and initial_balance is not None:
+            cost = calculate_analysis_cost(task_id, initial_balance)
+        task_store.finish_processing(task_id, _cancelled_status(cost, initial_balance))
     except Exception as e:
+        if progress_reporter is not None:
+            progress_reporter.stop()
         error_message = str(e)
         logger.error(f"[{task_id}] Ошибка при анализе: {error_message}", exc_info=True)
-        analysis_status[task_id] = {
+        task_store.finish_processing(task_id, {
             'status': 'error',
             'progress': 0,
             'message': f'Ошибка: {error_message}',
             'cost': None
-        }
+        }, cancelled=_cancelled_status())
+    finally:
+        _unregister_cancel_event(task_id)
+        if crawl_future is not None:
+            # Обход ещё не начался (ошибка или отмена до kickoff) — не занимаем им поток;
+            # идущий обход (анализ отменён или обход не уложился в SITE_CRAWL_JOIN_TIMEOUT)
+            # останавливается флагом и сразу освобождает поток _executor_site_crawl
+            crawl_future.cancel()
+        cancel_event.set()
+
+analysis_queue = AnalysisJobQueue(run_analysis, workers=ANALYSIS_WORKERS, max_size=ANALYSIS_QUEUE_MAX,
+                                  on_pending_change=task_store.set_queue_positions)
+
+
+@app.route('/api/analyze/<task_id>', methods=['DELETE'])
+def cancel_analysis(task_id):
+    """
+    Отмена анализа. Задача из очереди снимается сразу; у выполняющейся Crew
+    останавливается на ближайшем шаге агента, браузер Playwright закрывается.
+    Анализ, к которому присоединились другие запросы того же сайта, отменяется
+    только последним из них — остальные продолжают получать его результат.
+    """
+    state = task_store.request_cancel(task_id)
+    if state is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    
+    if state in ACTIVE_STATUSES:
+        logger.info(f"[{task_id}] Отмена от одного из запросов: анализ продолжается для остальных")
+        return jsonify({
+            'task_id': task_id,
+            'status': state,
+            'detached': True,
+            'message': 'Анализ нужен и другим запросам этого сайта — он продолжится без вашего участия'
+        })
+    
+    if state == 'cancelled':
+        # Задача ещё ждала в очереди (этого или другого процесса) — рабочий поток её не возьмёт
+        analysis_queue.remove(task_id)
+        logger.info(f"[{task_id}] Задача снята с очереди")
+        return jsonify({'task_id': task_id, 'status': 'cancelled', 'message': 'Анализ отменён'})
+    
+    if state == 'cancelling':
+        with _cancel_events_lock:
+            event = _cancel_events.get(task_id)
+        if event is not None:
+            event.set()
+        logger.info(f"[{task_id}] Запрошена отмена выполняющегося анализа")
+        return jsonify({'task_id': task_id, 'status': 'cancelling', 'message': 'Отмена анализа...'}), 202
+    
+    return jsonify({'error': 'Анализ уже завершён', 'status': state}), 409
+
+
+def _load_task_status(task_id):
+    """Текущий статус задачи (копия) с позицией в очереди или None, если задача неизвестна."""
+    status = task_store.get_status(task_id)
+    if status is None:
+        # Завершённый анализ без записи статуса (например, перенесённый из старого analysis_*.json)
+        loaded = load_analysis_result(task_id)
+        if loaded:
+            status = {
+                'status': 'completed',
+                'progress': 100,
+                'message': 'Анализ завершен',
+                'cost': loaded.get('cost'),
+                'initial_balance': None
+            }
+            task_store.set_status(task_id, status, url=loaded.get('url'))
+    
+    if status is None:
+        return None
+    
+    status = dict(status)
+    
+    # Задача ждёт свободного рабочего потока — сообщаем текущую позицию.
+    # Если задача стоит в очереди другого рабочего процесса, позиция берётся из хранилища
+    if status['status'] == 'queued':
+        position = analysis_queue.position(task_id) or status.get('queue_position')
+        if position is not None:
+            status['queue_position'] = position
+            status['message'] = f'В очереди: позиция {position}'
+    return status
+
+
+def _attach_task_result(task_id, status):
+    """Добавляет к статусу завершённой задачи результат анализа и согласует стоимость."""
+    loaded = load_analysis_result(task_id)
+    result_data = dict(loaded) if loaded else None
+    if result_data:
+        status['result'] = result_data
+        # Добавляем информацию о стоимости в статус и результат
+        if 'cost' in result_data:
+            cost_value = result_data['cost']
+            status['cost'] = cost_value
+            # Убеждаемся, что стоимость есть в результате
+            if 'cost' not in result_data or result_data['cost'] is None:
+                result_data['cost'] = cost_value
+        else:
+            # Если стоимости нет в результате, но есть в статусе
+            if 'cost' in status and status['cost'] is not None:
+                result_data['cost'] = status['cost']
+        
+        logger.info(f"[{task_id}] Возврат статуса: cost={status.get('cost')}, result.cost={result_data.get('cost')}")
+    return status
+
+
+# Статусы задач, которые ещё занимают слот пакета
+_BATCH_ACTIVE_STATUSES = ('queued', 'processing', 'cancelling')
+
+
+def _run_batch(batch_id):
+    """
+    Фоновый поток пакета: ставит URL в общую очередь анализа, держа в работе не более
+    concurrency задач пакета; при заполненной очереди ждёт и повторяет попытку.
+    """
+    batch = task_store.get_batch(batch_id)
+    if not batch:
+        return
+    items = batch['items']
+    concurrency = batch['concurrency']
+    force = batch.get('force', False)
+    crawl_options = batch.get('crawl') or {}
+    pending = [i for i, item in enumerate(items) if not item.get('task_id') and not item.get('error')]
+    try:
+        while True:
+            active = 0
+            for item in items:
+                if item.get('task_id'):
+                    state = (task_store.get_status(item['task_id']) or {}).get('status')
+                    if state in _BATCH_ACTIVE_STATUSES:
+                        active += 1
+            
+            changed = False
+            while pending and active < concurrency:
+                item = items[pending[0]]
+                payload, status_code, headers = _start_analysis(item['url'], force=force,
+                                                                crawl_options=crawl_options)
+                if status_code == 503 and 'Retry-After' in headers:
+                    break  # Общая очередь заполнена — попробуем на следующем круге
+                pending.pop(0)
+                changed = True
+                if status_code != 200:
+                    item['error'] = payload.get('error', f'Ошибка {status_code}')
+                    continue
+                item['task_id'] = payload['task_id']
+                if payload.get('status') in _BATCH_ACTIVE_STATUSES:
+                    active += 1
+            if changed:
+                task_store.save_batch(batch_id, batch)
+            else:
+                task_store.touch_batch(batch_id)
+            
+            if not pending and active == 0:
+                break
+            time.sleep(BATCH_POLL_INTERVAL_SECONDS)
+    except Exception as e:
+        logger.error(f"[batch {batch_id}] Ошибка планировщика пакета: {e}", exc_info=True)
+        for index in pending:
+            items[index].setdefault('error', f'Ошибка планировщика пакета: {e}')
+    finally:
+        batch['finished'] = True
+        task_store.save_batch(batch_id, batch)
+        logger.info(f"[batch {batch_id}] Пакет обработан: {len(items)} URL")
+
+
+def _spawn_batch_scheduler(batch_id):
+    threading.Thread(target=_run_batch, args=(batch_id,), name=f'batch-{batch_id}', daemon=True).start()
+
+
+def resume_stale_batches():
+    """
+    Подхватывает пакеты, планировщик которых остановился вместе с процессом: уже поставленные
+    задачи пакета _run_batch пропускает, оставшиеся URL ставит в очередь как обычно.
+    """
+    for batch_id in task_store.claim_stale_batches(BATCH_STALE_AFTER_SECONDS):
+        logger.info(f"[batch {batch_id}] Планировщик пакета возобновлён после перезапуска")
+        _spawn_batch_scheduler(batch_id)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Пакетный анализ списка сайтов. Задачи идут через общую очередь, кэш результатов
+    и присоединение к идущим анализам — как у одиночного /api/analyze.
+    """
+    if not request.json:
+        return jsonify({'error': 'Требуется JSON в теле запроса'}), 400
+    
+    data = request.json
+    raw_urls = data.get('urls')
+    if not isinstance(raw_urls, list) or not raw_urls:
+        return jsonify({'error': 'Передайте непустой список urls'}), 400
+    if len(raw_urls) > ANALYSIS_BATCH_MAX_URLS:
+        return jsonify({'error': f'Слишком много URL в пакете (максимум {ANALYSIS_BATCH_MAX_URLS})'}), 400
+    
+    try:
+        concurrency = int(data.get('concurrency') or ANALYSIS_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency должно быть целым числом'}), 400
+    concurrency = max(1, min(concurrency, ANALYSIS_QUEUE_MAX))
+    force = _parse_bool_flag(data.get('force', request.args.get('force', '')))
+    crawl_options, error = parse_crawl_options(data.get('crawl'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Повторы одного сайта (с www/без, со слэшем в конце) анализируются один раз
+    items, seen_keys = [], set()
+    for raw_url in raw_urls:
+        company_url, error = _normalize_company_url(raw_url if isinstance(raw_url, str) else '')
+        if error:
+            items.append({'url': raw_url, 'task_id': None, 'error': error})
+            continue
+        key = _result_cache_key(company_url)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        items.append({'url': company_url, 'task_id': None})
+    
+    batch_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    task_store.save_batch(batch_id, {
+        'batch_id': batch_id,
+        'created_at': datetime.now().isoformat(),
+        'concurrency': concurrency,
+        'force': force,
+        'crawl': crawl_options,
+        'items': items,
+        'finished': False
+    })
+    _spawn_batch_scheduler(batch_id)
+    
+    logger.info(f"[batch {batch_id}] Пакетный анализ: {len(items)} URL, параллельно {concurrency}")
+    return jsonify({
+        'batch_id': batch_id,
+        'total': len(items),
+        'concurrency': concurrency,
+        'message': 'Пакетный анализ запущен'
+    }), 202
+
+
+@app.route('/api/analyze/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """Сводный статус пакета и статус каждого URL (без текста отчётов)."""
+    batch = task_store.get_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Пакет не найден'}), 404
+    
+    counts = {'pending': 0, 'queued': 0, 'processing': 0, 'completed': 0, 'error': 0, 'cancelled': 0}
+    items, progress_total = [], 0
+    for item in batch['items']:
+        entry = {'url': item['url'], 'task_id': item.get('task_id')}
+        if item.get('error'):
+            entry.update({'status': 'error', 'progress': 0, 'message': item['error']})
+        elif not item.get('task_id'):
+            entry.update({'status': 'pending', 'progress': 0, 'message': 'Ожидает постановки в очередь'})
+        else:
+            status = _load_task_status(item['task_id']) or {
+                'status': 'error', 'progress': 0, 'message': 'Задача не найдена'
+            }
+            entry.update({
+                'status': status['status'],
+                'progress': status.get('progress', 0),
+                'message': status.get('message'),
+                'cost': status.get('cost')
+            })
+        state = 'processing' if entry['status'] == 'cancelling' else entry['status']
+        counts[state] = counts.get(state, 0) + 1
+        progress_total += 100 if state in ('completed', 'error', 'cancelled') else (entry['progress'] or 0)
+        items.append(entry)
+    
+    total = len(items)
+    done = counts['completed'] + counts['error'] + counts['cancelled']
+    costs = [entry['cost'] for entry in items if entry.get('cost') is not None]
+    return jsonify({
+        'batch_id': batch_id,
+        'status': 'completed' if batch.get('finished') and done == total else 'processing',
+        'created_at': batch.get('created_at'),
+        'concurrency': batch.get('concurrency'),
+        'total': total,
+        'counts': counts,
+        'progress': int(progress_total / total) if total else 100,
+        'cost': round(sum(costs), 4) if costs else None,
+        'items': items
+    })
+
+
+@app.route('/api/analyze/batch/<batch_id>/export', methods=['GET'])
+def export_batch_to_zip(batch_id):
+    """ZIP-архив с DOCX-отчётами всех завершённых анализов пакета."""
+    batch = task_store.get_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Пакет не найден'}), 404
+    
+    if not DOCX_AVAILABLE:
+        return jsonify({'error': 'Модуль python-docx не установлен'}), 500
+    
+    archive = io.BytesIO()
+    added = 0
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for index, item in enumerate(batch['items'], start=1):
+            task_id = item.get('task_id')
+            result_data = load_analysis_result(task_id) if task_id else None
+            if not result_data:
+                continue
+            try:
+                docx_bytes, filename = _build_analysis_docx(result_data)
+            except Exception as e:
+                logger.error(f"[batch {batch_id}] Ошибка при создании DOCX для задачи {task_id}: {e}", exc_info=True)
+                continue
+            # Номер в пакете: имена отчётов разных компаний с одинаковым доменом первого уровня не совпадут
+            zf.writestr(f'{index:02d}_{filename}', docx_bytes)
+            added += 1
+    
+    if not added:
+        return jsonify({'error': 'В пакете пока нет завершённых анализов'}), 404
+    
+    archive.seek(0)
+    logger.info(f"[batch {batch_id}] Экспорт {added} отчётов в ZIP")
+    return send_file(
+        archive,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f'batch_{batch_id}.zip'
+    )
+
 
 @app.route('/api/status/<task_id>', methods=['GET'])
 def get_status(task_id):
@@ -2061,116 +2453,152 @@ def get_status(task_id):
         "message": "Запрос статуса задачи",
         "data": {
             "task_id": task_id,
-            "exists": task_id in analysis_status,
-            "all_tasks": list(analysis_status.keys())[-5:],
+            "exists": task_store.get_status(task_id) is not None,
+            "all_tasks": task_store.recent_task_ids(5),
             "timestamp": datetime.now().isoformat()
         }
     })
     # #endregion
     
-    if task_id not in analysis_status:
-        logger.warning(f"Запрос статуса для несуществующей задачи: {task_id}. Доступные задачи: {list(analysis_status.keys())[-5:]}")
+    status = _load_task_status(task_id)
+    if status is None:
+        logger.warning(f"Запрос статуса для несуществующей задачи: {task_id}. Последние задачи: {task_store.recent_task_ids(5)}")
         return jsonify({'error': 'Задача не найдена'}), 404
     
-    status = analysis_status[task_id].copy()
-    
     # Если анализ завершен, добавляем результат
     if status['status'] == 'completed':
-        result_data = None
-        if task_id in analysis_results:
-            result_data = analysis_results[task_id].copy()
-        else:
-            loaded = load_analysis_result(task_id)
-            if loaded:
-                analysis_results[task_id] = loaded
-                result_data = loaded.copy()
-        if result_data:
-            status['result'] = result_data
-            # Добавляем информацию о стоимости в статус и результат
-            if 'cost' in result_data:
-                cost_value = result_data['cost']
-                status['cost'] = cost_value
-                # Убеждаемся, что стоимость есть в результате
-                if 'cost' not in result_data or result_data['cost'] is None:
-                    result_data['cost'] = cost_value
-            else:
-                # Если стоимости нет в результате, но есть в статусе
-                if 'cost' in status and status['cost'] is not None:
-                    result_data['cost'] = status['cost']
-            
-            logger.info(f"[{task_id}] Возврат статуса: cost={status.get('cost')}, result.cost={result_data.get('cost')}")
+        _attach_task_result(task_id, status)
     
     return jsonify(status)
 
+
+def _sse_event(event, data):
+    """Кадр Server-Sent Events с JSON-данными."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/status/<task_id>/stream', methods=['GET'])
+def stream_status(task_id):
+    """
+    Статус задачи в виде Server-Sent Events: событие progress отправляется только при
+    изменении статуса, прогресса или сообщения, затем одно финальное событие
+    completed (с результатом) или failed (ошибка или отмена), после чего поток закрывается.
+    """
+    status = _load_task_status(task_id)
+    if status is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    
+    def generate():
+        # Клиент (EventSource) переподключается сам — ограничиваем время жизни одного соединения
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        last_sent = None
+        last_write = time.monotonic()
+        current = status
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            if current is None:
+                yield _sse_event('failed', {'status': 'error', 'message': 'Задача не найдена'})
+                return
+            state = current['status']
+            if state == 'completed':
+                yield _sse_event('completed', _attach_task_result(task_id, current))
+                return
+            if state not in ('queued', 'processing', 'cancelling'):
+                yield _sse_event('failed', current)
+                return
+            snapshot = (state, current.get('progress'), current.get('message'), current.get('queue_position'))
+            if snapshot != last_sent:
+                last_sent = snapshot
+                last_write = time.monotonic()
+                yield _sse_event('progress', current)
+            elif time.monotonic() - last_write >= SSE_HEARTBEAT_SECONDS:
+                # Комментарий-пульс: не даёт прокси закрыть простаивающее соединение
+                last_write = time.monotonic()
+                yield ": ping\n\n"
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(SSE_POLL_INTERVAL_SECONDS)
+            current = _load_task_status(task_id)
+    
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx: не буферизовать поток
+    return resp
+
+
+def _build_analysis_docx(result_data):
+    """
+    Собирает DOCX-отчёт по результату анализа.
+    
+    Returns:
+        tuple: (байты документа, имя файла в ASCII для HTTP-заголовков)
+    """
+    # Создаем документ
+    doc = Document()
+    
+    # Настройка стилей
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = 'Calibri'
+    font.size = Pt(11)
+    
+    # Заголовок
+    title = doc.add_heading('КОМПЛЕКСНЫЙ КОРПОРАТИВНЫЙ ОТЧЕТ', 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # Информация о компании
+    company_name = result_data.get('company_name', 'Неизвестная компания')
+    company_url = result_data.get('url', 'N/A')
+    timestamp = result_data.get('timestamp', datetime.now().isoformat())
+    cost = result_data.get('cost')
+    
+    doc.add_paragraph(f'Компания: {company_name}')
+    doc.add_paragraph(f'URL: {company_url}')
+    doc.add_paragraph(f'Дата анализа: {timestamp}')
+    if cost is not None:
+        doc.add_paragraph(f'Стоимость анализа: {cost:.4f} руб.')
+    
+    # Пустая строка без дополнительных отступов
+    p_blank_header = doc.add_paragraph()
+    pf_header = p_blank_header.paragraph_format
+    pf_header.space_before = Pt(0)
+    pf_header.space_after = Pt(0)
+    
+    # Основной контент — полный разбор Markdown; только проверенные ссылки — кликабельные
+    content = result_data.get('result', '')
+    verified_keys = _verified_keys_from_result(result_data)
+    company_url = result_data.get('url', '')
+    if content:
+        _md_to_docx_content(doc, content, spacing=None, options={'line_spacing': 1.15, 'main_font_size': 11},
+                            verified_keys=verified_keys, company_url=company_url)
+    
+    # Сохраняем в память
+    file_stream = io.BytesIO()
+    doc.save(file_stream)
+    
+    # Формируем имя файла (ASCII для HTTP-заголовков)
+    filename = f'analysis_{company_name}_{datetime.now().strftime("%Y%m%d")}.docx'
+    safe_filename = "".join(c if ord(c) < 128 else '_' for c in filename).rstrip('_') or 'analysis.docx'
+    return file_stream.getvalue(), safe_filename
+
+
 @app.route('/api/export/<task_id>', methods=['GET'])
 def export_to_docx(task_id):
     """Экспорт результатов анализа в DOCX формат"""
-    if task_id not in analysis_results:
-        loaded = load_analysis_result(task_id)
-        if loaded:
-            analysis_results[task_id] = loaded
-    if task_id not in analysis_results:
+    result_data = load_analysis_result(task_id)
+    if not result_data:
         return jsonify({'error': 'Результаты анализа не найдены'}), 404
     
     if not DOCX_AVAILABLE:
         return jsonify({'error': 'Модуль python-docx не установлен'}), 500
     
     try:
-        result_data = analysis_results[task_id]
-        
-        # Создаем документ
-        doc = Document()
-        
-        # Настройка стилей
-        style = doc.styles['Normal']
-        font = style.font
-        font.name = 'Calibri'
-        font.size = Pt(11)
-        
-        # Заголовок
-        title = doc.add_heading('КОМПЛЕКСНЫЙ КОРПОРАТИВНЫЙ ОТЧЕТ', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # Информация о компании
-        company_name = result_data.get('company_name', 'Неизвестная компания')
-        company_url = result_data.get('url', 'N/A')
-        timestamp = result_data.get('timestamp', datetime.now().isoformat())
-        cost = result_data.get('cost')
-        
-        doc.add_paragraph(f'Компания: {company_name}')
-        doc.add_paragraph(f'URL: {company_url}')
-        doc.add_paragraph(f'Дата анализа: {timestamp}')
-        if cost is not None:
-            doc.add_paragraph(f'Стоимость анализа: {cost:.4f} руб.')
-        
-        # Пустая строка без дополнительных отступов
-        p_blank_header = doc.add_paragraph()
-        pf_header = p_blank_header.paragraph_format
-        pf_header.space_before = Pt(0)
-        pf_header.space_after = Pt(0)
-        
-        # Основной контент — полный разбор Markdown; только проверенные ссылки — кликабельные
-        content = result_data.get('result', '')
-        v_urls = result_data.get('verified_urls')
-        verified_urls = set(v_urls) if v_urls else None
-        company_url = result_data.get('url', '')
-        if content:
-            _md_to_docx_content(doc, content, spacing=None, options={'line_spacing': 1.15, 'main_font_size': 11},
-                                verified_urls=verified_urls, company_url=company_url)
-        
-        # Сохраняем в память
-        file_stream = io.BytesIO()
-        doc.save(file_stream)
-        file_stream.seek(0)
-        
-        # Формируем имя файла (ASCII для HTTP-заголовков)
-        filename = f'analysis_{company_name}_{datetime.now().strftime("%Y%m%d")}.docx'
-        safe_filename = "".join(c if ord(c) < 128 else '_' for c in filename).rstrip('_') or 'analysis.docx'
+        docx_bytes, safe_filename = _build_analysis_docx(result_data)
         
         logger.info(f"Экспорт результатов {task_id} в DOCX: {safe_filename}")
         
         return send_file(
-            file_stream,
+            io.BytesIO(docx_bytes),
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
             download_name=safe_filename
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Поиск почти одинаковых страниц по SimHash видимого текста
+
+Корпоративные сайты отдают много почти одинаковых страниц: версии для печати, копии
+с метками в адресе, страницы-заглушки разделов. Отпечаток SimHash (64 бита) строится
+по шинглам из трёх слов; страницы, отпечатки которых отличаются не больше чем
+в NEAR_DUP_MAX_DISTANCE битах, считаются дубликатами первой встреченной страницы.
+Поиск по индексу — через совпадение одной из полос отпечатка (pigeonhole), без перебора.
+"""
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Сколько бит из 64 могут различаться у дубликатов (0 — поиск дубликатов отключён)
+NEAR_DUP_MAX_DISTANCE = min(_env_int('NEAR_DUP_MAX_DISTANCE', 3), 15)
+# Страницы короче (в словах) не сравниваются: у коротких текстов отпечатки ненадёжны
+NEAR_DUP_MIN_WORDS = 30
+
+FINGERPRINT_BITS = 64
+_SHINGLE_SIZE = 3
+_RE_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _shingle_hash(shingle: str) -> str:
+    digest = hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+    return format(int.from_bytes(digest, 'big'), '064b')
+
+
+def simhash(text: str) -> Optional[int]:
+    """64-битный отпечаток SimHash текста или None, если в тексте меньше NEAR_DUP_MIN_WORDS слов."""
+    words = _RE_WORD.findall((text or '').lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+    shingles = {' '.join(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)}
+    bits = [_shingle_hash(s) for s in shingles]
+    # Разряд отпечатка — 1, если у большинства шинглов в этом разряде 1 (подсчёт по столбцам строк)
+    half = len(bits) / 2
+    return int(''.join('1' if column.count('1') > half else '0' for column in zip(*bits)), 2)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """
+    Отпечатки просмотренных страниц одной задачи или одного обхода (потокобезопасно).
+
+    Отпечаток делится на max_distance + 1 полос: у отпечатков, различающихся не больше
+    чем в max_distance битах, хотя бы одна полоса совпадает, поэтому кандидаты ищутся
+    по словарю полос, а расстояние считается только для них.
+    """
+
+    def __init__(self, max_distance: Optional[int] = None):
+        self.max_distance = NEAR_DUP_MAX_DISTANCE if max_distance is None else max_distance
+        bands = self.max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        self._bands = [(i * width, FINGERPRINT_BITS if i == bands - 1 else (i + 1) * width) for i in range(bands)]
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_distance > 0
+
+    def _band_keys(self, fingerprint: int):
+        for i, (start, end) in enumerate(self._bands):
+            yield i, (fingerprint >> start) & ((1 << (end - start)) - 1)
+
+    def check(self, url: str, text: str) -> Optional[str]:
+        """
+        URL ранее просмотренной страницы, почти совпадающей по тексту, или None.
+        Новая (не дубликат) страница запоминается как представитель; дубликаты считаются в skipped.
+        """
+        if not self.enabled:
+            return None
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        keys = list(self._band_keys(fingerprint))
+        with self._lock:
+            for key in keys:
+                for other, other_url in self._buckets.get(key, ()):
+                    if other_url != url and hamming_distance(fingerprint, other) <= self.max_distance:
+                        self.skipped += 1
+                        return other_url
+            for key in keys:
+                self._buckets.setdefault(key, []).append((fingerprint, url))
+        return None
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Хранилище страниц задачи анализа: уже загруженные страницы сайта без повторной загрузки
+
+Ответ проверки доступности (главная страница) сохраняется здесь и служит затравкой
+для обхода ссылок и первого вызова инструмента скрапинга. Хранилище живёт одну задачу;
+инструменты агентов получают его через ToolRunContext (configure_crew_progress).
+Тексты страниц, которые инструменты отдают агентам, сверяются по SimHash (near_duplicates):
+почти повторяющаяся страница не расходует токены LLM второй раз.
+"""
+import hashlib
+import threading
+from typing import Optional
+
+from near_duplicates import NearDuplicateIndex
+from url_utils import canonical_url_key
+
+# Страницы больше этого размера не сохраняются (байты)
+PAGE_STORE_MAX_BYTES = 5 * 1024 * 1024
+
+
+class PageSnapshot:
+    """
+    Загруженная страница: итоговый URL после редиректов, код ответа, заголовки (имена в нижнем регистре),
+    текст и SHA-1 тела ответа.
+    """
+
+    __slots__ = ('url', 'final_url', 'status', 'headers', 'text', 'content_hash')
+
+    def __init__(self, url: str, final_url: str, status: int, headers: dict, text: str,
+                 content_hash: Optional[str] = None):
+        self.url = url
+        self.final_url = final_url or url
+        self.status = status
+        self.headers = headers
+        self.text = text
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_response(cls, url: str, response) -> Optional['PageSnapshot']:
+        """Снимок ответа requests или None, если тело слишком большое или не читается."""
+        try:
+            content = response.content
+            if content is None or len(content) > PAGE_STORE_MAX_BYTES:
+                return None
+            # Как ScrapeWebsiteTool: кодировку определяем по содержимому — заголовок часто врёт
+            # или отсутствует, и тогда requests декодирует кириллицу как ISO-8859-1
+            encoding = response.apparent_encoding or response.encoding or 'utf-8'
+            text = content.decode(encoding, errors='replace')
+        except Exception:
+            return None
+        headers = {name.lower(): value for name, value in response.headers.items()}
+        return cls(url, response.url, response.status_code, headers, text, hashlib.sha1(content).hexdigest())
+
+    @property
+    def content_type(self) -> str:
+        return (self.headers.get('content-type') or '').lower()
+
+    @property
+    def is_html(self) -> bool:
+        """Успешный ответ с HTML/текстом — из него можно брать текст и ссылки."""
+        ct = self.content_type
+        if self.status >= 400:
+            return False
+        return not ct or 'html' in ct or ct.startswith('text/') or 'application/xhtml' in ct
+
+
+class TaskPageStore:
+    """Страницы одной задачи, по ключу canonical_url_key (и запрошенного, и итогового URL)."""
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        # Отпечатки текстов, уже отданных агентам
+        self.duplicates = NearDuplicateIndex()
+
+    def put(self, snapshot: Optional[PageSnapshot]):
+        if snapshot is None:
+            return
+        with self._lock:
+            self._pages[canonical_url_key(snapshot.url)] = snapshot
+            self._pages[canonical_url_key(snapshot.final_url)] = snapshot
+
+    def get(self, url: str) -> Optional[PageSnapshot]:
+        if not url:
+            return None
+        with self._lock:
+            snapshot = self._pages.get(canonical_url_key(url))
+            if snapshot is not None:
+                self.hits += 1
+            return snapshot
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len({id(s) for s in self._pages.values()})
+
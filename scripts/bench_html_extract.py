@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк извлечения ссылок и текста: html_extract (lxml) против BeautifulSoup html.parser
+
+Запуск:
+    python scripts/bench_html_extract.py                   # синтетическая «корпоративная» главная
+    python scripts/bench_html_extract.py page1.html ...    # сохранённые страницы
+    python scripts/bench_html_extract.py https://example.com/ ...   # загрузить страницы по URL
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+# Модули проекта лежат на уровень выше scripts/
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import html_extract  # noqa: E402
+
+
+def synthetic_homepage(sections=60, links_per_section=40):
+    """Большая главная страница: меню, мегаменю, новости, футер, скрипты и стили (~1 МБ)."""
+    parts = ['<!DOCTYPE html><html><head><title>Компания</title>']
+    parts.append('<style>' + '.c{color:red}' * 2000 + '</style>')
+    parts.append('<script>' + 'var x = {"a": [1, 2, 3]};' * 2000 + '</script></head><body>')
+    parts.append('<header><nav><ul>')
+    parts.extend(f'<li><a href="/section-{i}/">Раздел {i}</a></li>' for i in range(sections))
+    parts.append('</ul></nav></header><main>')
+    for i in range(sections):
+        parts.append(f'<section><h2>Раздел {i}</h2><div class="menu">')
+        for j in range(links_per_section):
+            parts.append(
+                f'<div class="card"><a href="/section-{i}/item-{j}?utm=1"><span>Продукт</span> <b>{j}</b></a>'
+                f'<p>Описание продукта {j} раздела {i}: надёжные решения для промышленности и бизнеса.</p></div>'
+            )
+        parts.append('</div></section>')
+    parts.append('</main><footer>')
+    parts.extend(f'<a href="https://example.com/footer-{i}">Ссылка {i}</a>' for i in range(200))
+    parts.append('</footer></body></html>')
+    return ''.join(parts)
+
+
+def bs4_baseline(html, base_url):
+    """Прежний путь: BeautifulSoup(html.parser) + find_all('a') и get_text отдельно."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for a in soup.find_all('a', href=True):
+        href = (a.get('href') or '').strip()
+        if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:', 'data:')):
+            continue
+        abs_url = urljoin(base_url, href)
+        if urlparse(abs_url).scheme in ('http', 'https'):
+            links.append((abs_url, (a.get_text() or '').strip()))
+    text = soup.get_text(' ')
+    text = re.sub('[ \t]+', ' ', text)
+    text = re.sub('\\s+\n\\s+', '\n', text)
+    return links, text
+
+
+def load_pages(sources):
+    if not sources:
+        return [('synthetic', 'https://example.com/', synthetic_homepage())]
+    pages = []
+    for source in sources:
+        if source.startswith(('http://', 'https://')):
+            import http_client
+            r = http_client.get(source, timeout=20)
+            r.encoding = r.apparent_encoding or 'utf-8'
+            pages.append((source, r.url, r.text))
+        else:
+            pages.append((source, 'https://example.com/', Path(source).read_text(encoding='utf-8', errors='replace')))
+    return pages
+
+
+def bench(func, html, base_url, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(html, base_url)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение html_extract и BeautifulSoup html.parser')
+    parser.add_argument('sources', nargs='*', help='HTML-файлы или URL (по умолчанию — синтетическая страница)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='повторов на страницу (берётся лучший)')
+    args = parser.parse_args()
+
+    backend = 'lxml' if html_extract.LXML_AVAILABLE else 'BeautifulSoup (lxml не установлен)'
+    print(f"html_extract: {backend}")
+    for name, base_url, html in load_pages(args.sources):
+        size_kb = len(html.encode('utf-8')) // 1024
+        old_time, (old_links, _) = bench(bs4_baseline, html, base_url, args.repeat)
+        new_time, page = bench(html_extract.extract_page, html, base_url, args.repeat)
+        speedup = old_time / new_time if new_time else float('inf')
+        print(f"{name} ({size_kb} КБ): BeautifulSoup {old_time * 1000:.1f} мс, {len(old_links)} ссылок; "
+              f"html_extract {new_time * 1000:.1f} мс, {len(page.links)} ссылок; ускорение ×{speedup:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Параллельный обход ссылок сайта: реальные пути из HTML и карт сайта для whitelist ссылок отчёта
+
+Очередь обхода — с приоритетом: сначала ссылки меню (nav, header, footer) и неглубокие
+разделы, в конце — пагинация, фильтры и архивы. Так ограниченный бюджет страниц уходит
+на структурно важные разделы («О компании», «Продукция», «Инвесторам»).
+"""
+import hashlib
+import heapq
+import itertools
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlunparse
+
+import requests
+
+import http_cache
+import site_graph
+from html_extract import HTML_PARSER_AVAILABLE, extract_page
+from http_client import BINARY_EXTENSIONS, is_html_content_type
+from logger import logger
+from near_duplicates import NearDuplicateIndex
+from sitemap_discovery import discover_sitemap_urls
+from url_utils import canonical_url_key, hostname_base, normalize_url, parse_url, url_host, url_key
+
+
+def _env_int(name, default, minimum=1):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Потоков обхода на один сайт, одновременных запросов к одному хосту и общий лимит времени обхода (секунды)
+CRAWL_WORKERS = _env_int('SITE_CRAWL_WORKERS', 8)
+CRAWL_PER_HOST_LIMIT = _env_int('SITE_CRAWL_PER_HOST', 4)
+CRAWL_TIME_BUDGET = _env_int('SITE_CRAWL_TIME_BUDGET', 30)
+# Бюджет обхода по умолчанию: потолок страниц, объём загруженного HTML (МБ) и сколько страниц подряд
+# без новых путей считать исчерпанием сайта
+CRAWL_MAX_PAGES = _env_int('SITE_CRAWL_MAX_PAGES', 60)
+CRAWL_MAX_MB = _env_int('SITE_CRAWL_MAX_MB', 20)
+CRAWL_STALL_PAGES = _env_int('SITE_CRAWL_STALL_PAGES', 8)
+# Как часто обход проверяет флаг остановки (stop_event), пока ждёт ответов (секунды)
+CRAWL_STOP_POLL_SECONDS = 0.5
+
+# Параметры обхода, которые можно передать в запросе анализа: имя -> (минимум, максимум)
+CRAWL_PARAM_LIMITS = {
+    'max_pages': (1, 500),
+    'time_budget': (5, 300),
+    'max_mb': (1, 200),
+    'stall_pages': (1, 100),
+}
+# Во сколько раз меньше HTML-страниц обходить, если карта сайта уже дала не меньше max_pages URL
+SITEMAP_PAGE_DIVISOR = 4
+
+# Веса приоритета ссылки (балл = глубина пути + переходы от главной ± поправки; меньше — раньше)
+MENU_BONUS = 3
+QUERY_PENALTY = 4
+PAGINATION_PENALTY = 6
+ARCHIVE_PENALTY = 4
+FILE_PENALTY = 10
+# Ссылки из карты сайта без сведений о меню считаются найденными в двух переходах от главной
+SITEMAP_HOPS = 2
+
+_PAGINATION_PARAMS = frozenset({'page', 'p', 'pg', 'paged', 'start', 'offset', 'from'})
+_FILTER_PARAMS = frozenset({'sort', 'order', 'orderby', 'filter', 'set_filter', 'tag', 'q', 'search', 'view', 'limit'})
+# Метки рекламы и аналитики: ссылка с ними — та же страница, в очередь она идёт без них
+_TRACKING_PARAMS = frozenset({'gclid', 'yclid', 'ysclid', 'fbclid', '_openstat', 'mc_cid', 'mc_eid', '_ga'})
+_RE_PAGE_PATH = re.compile(r'/(?:page|p)[/-]?\d+/?$', re.I)
+_RE_ARCHIVE_PATH = re.compile(
+    r'/(?:tags?|archives?|categor(?:y|ies)|authors?|search|filter|rss|feed|print|calendar)(?:/|$)|/(?:19|20)\d{2}(?:/|$)',
+    re.I,
+)
+
+
+def link_priority(url, in_menu=False, hops=1):
+    """
+    Балл ссылки для очереди обхода: меньше — раньше.
+
+    Args:
+        in_menu: ссылка найдена в nav/header/footer
+        hops: сколько переходов от главной страницы до страницы, где найдена ссылка
+    """
+    p = parse_url(url)
+    path = p.path or '/'
+    score = len([part for part in path.split('/') if part]) + hops
+    if in_menu:
+        score -= MENU_BONUS
+    if p.query:
+        score += QUERY_PENALTY
+        params = {name.lower() for name, _ in parse_qsl(p.query, keep_blank_values=True)}
+        # PAGEN_1 — пагинация 1С-Битрикс
+        if params & _PAGINATION_PARAMS or any(name.startswith('pagen_') for name in params):
+            score += PAGINATION_PENALTY
+        elif params & _FILTER_PARAMS or any(name.startswith('utm_') for name in params):
+            score += ARCHIVE_PENALTY
+    if _RE_PAGE_PATH.search(path):
+        score += PAGINATION_PENALTY
+    if _RE_ARCHIVE_PATH.search(path):
+        score += ARCHIVE_PENALTY
+    if path.lower().endswith(BINARY_EXTENSIONS):
+        score += FILE_PENALTY
+    return score
+
+
+class CrawlFrontier:
+    """
+    Очередь обхода с приоритетом (heapq) и дедупликацией по canonical_url_key.
+
+    Повторно найденная ссылка с лучшим баллом (например, в меню другой страницы) поднимается
+    в очереди; устаревшие записи кучи пропускаются при извлечении.
+    """
+
+    def __init__(self, max_size):
+        self._heap = []
+        self._best = {}  # ключ -> лучший балл среди постановок
+        self._taken = set()
+        self._pending = 0  # поставленные и ещё не взятые ключи
+        self._seq = itertools.count()
+        self._max_size = max_size
+
+    def push(self, url, score, hops):
+        key = canonical_url_key(url)
+        if key in self._taken:
+            return False
+        best = self._best.get(key)
+        if best is not None and best <= score:
+            return False
+        if best is None:
+            if len(self._best) >= self._max_size:
+                return False
+            self._pending += 1
+        self._best[key] = score
+        heapq.heappush(self._heap, (score, next(self._seq), url, key, hops))
+        return True
+
+    def mark_taken(self, url):
+        """Отмечает URL как уже загруженный (в очередь он больше не попадёт)."""
+        key = canonical_url_key(url)
+        if key in self._taken:
+            return
+        self._taken.add(key)
+        if key in self._best:
+            self._pending -= 1
+
+    def pop(self, accept=None):
+        """
+        URL с лучшим баллом, для которого accept(url) истинно (например, хост не упёрся в лимит).
+
+        Returns:
+            tuple: (url, hops) или (None, None), если подходящего URL нет
+        """
+        deferred = []
+        found = (None, None)
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            score, _, url, key, hops = entry
+            if key in self._taken or self._best.get(key) != score:
+                continue  # уже загружен или поставлен заново с лучшим баллом
+            if accept is not None and not accept(url):
+                deferred.append(entry)
+                continue
+            self._taken.add(key)
+            self._pending -= 1
+            found = (url, hops)
+            break
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return found
+
+    def __len__(self):
+        return self._pending
+
+
+def parse_crawl_options(raw):
+    """
+    Проверяет параметры обхода из запроса ({"max_pages": 80, "time_budget": 60, "max_mb": 10, "stall_pages": 6}).
+
+    Returns:
+        tuple: (аргументы для discover_site_urls, ошибка); пустой словарь — значения по умолчанию
+    """
+    if raw is None:
+        return {}, None
+    if not isinstance(raw, dict):
+        return None, 'crawl должен быть объектом'
+    unknown = sorted(set(raw) - set(CRAWL_PARAM_LIMITS))
+    if unknown:
+        return None, f"Неизвестные параметры crawl: {', '.join(unknown)}"
+    options = {}
+    for name, (low, high) in CRAWL_PARAM_LIMITS.items():
+        if raw.get(name) is None:
+            continue
+        value = raw[name]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or int(value) != value:
+            return None, f'crawl.{name} должно быть целым числом'
+        if not low <= value <= high:
+            return None, f'crawl.{name} должно быть от {low} до {high}'
+        options[name] = int(value)
+    if 'max_mb' in options:
+        options['max_bytes'] = options.pop('max_mb') * 1024 * 1024
+    return options, None
+
+
+class _FetchedPage(NamedTuple):
+    """Результат загрузки страницы обходом."""
+    final: str  # URL после редиректов
+    links: Optional[List[Tuple[str, bool]]]  # (ссылка, из меню); None — страница с ошибкой
+    size: int  # загружено байт
+    title: str = ''
+    content_hash: Optional[str] = None
+    unchanged: bool = False  # хэш совпал с графом — ссылки не разбирались, берутся из графа
+    duplicate_of: Optional[str] = None  # текст почти совпадает с этой уже обойдённой страницей
+
+
+def _strip_tracking(query):
+    """query без меток utm_* и _TRACKING_PARAMS (без меток строка не пересобирается)."""
+    params = parse_qsl(query, keep_blank_values=True)
+    kept = [(name, value) for name, value in params
+            if not name.lower().startswith('utm_') and name.lower() not in _TRACKING_PARAMS]
+    return query if len(kept) == len(params) else urlencode(kept)
+
+
+def _extract_page_links(final, text, base_host, duplicates=None):
+    """
+    Ссылки того же сайта из HTML страницы.
+    duplicates — NearDuplicateIndex обхода: видимый текст страницы сверяется с уже обойдёнными.
+
+    Returns:
+        tuple: (список (URL без фрагмента и меток, ссылка из меню), заголовок страницы,
+                URL страницы, почти совпадающей по тексту, или None)
+    """
+    page = extract_page(text, final, with_text=duplicates is not None and duplicates.enabled)
+    links = []
+    for abs_u, _ in page.links:
+        p = parse_url(abs_u)
+        if hostname_base(p.hostname or '') != base_host:
+            continue
+        query = _strip_tracking(p.query) if p.query else ''
+        clean = urlunparse((p.scheme, p.netloc, p.path, '', query, ''))
+        links.append((normalize_url(clean), abs_u in page.menu_links))
+    duplicate_of = duplicates.check(final, page.text) if page.text else None
+    return links, page.title, duplicate_of
+
+
+def _page_text(r):
+    """
+    Текст HTML-ответа. Без charset в Content-Type requests декодирует как ISO-8859-1,
+    и кириллица текста страницы (нужного для поиска дубликатов) превращается в мусор,
+    поэтому сначала пробуется UTF-8, затем кодировка по содержимому.
+    """
+    if 'charset' in (r.headers.get('Content-Type') or '').lower():
+        return r.text
+    try:
+        return r.content.decode('utf-8')
+    except UnicodeDecodeError:
+        r.encoding = r.apparent_encoding or 'utf-8'
+        return r.text
+
+
+def _fetch_page_links(url, base_host, timeout, known_hash=None, duplicates=None):
+    """
+    Загружает страницу и извлекает ссылки того же сайта (выполняется в потоке пула).
+    known_hash — хэш страницы из графа сайта: при совпадении HTML не разбирается.
+    duplicates — NearDuplicateIndex обхода (см. _extract_page_links).
+
+    Returns:
+        _FetchedPage или None, если страница недоступна
+    """
+    try:
+        # Потоком и с пределом размера: PDF, видео и прочие файлы по ссылкам не скачиваются
+        r = http_cache.get(url, timeout=timeout, page=True)
+    except requests.RequestException:
+        return None
+    content = r.content or b''
+    if r.status_code >= 400:
+        return _FetchedPage(r.url, None, len(content))
+    final = r.url
+
+    if getattr(r, 'skipped', False) or not is_html_content_type(r.headers.get('Content-Type')):
+        return _FetchedPage(final, [], len(content))
+    content_hash = hashlib.sha1(content).hexdigest()
+    if known_hash and content_hash == known_hash:
+        return _FetchedPage(final, [], len(content), content_hash=content_hash, unchanged=True)
+    links, title, duplicate_of = _extract_page_links(final, _page_text(r), base_host, duplicates)
+    return _FetchedPage(final, links, len(content), title, content_hash, duplicate_of=duplicate_of)
+
+
+def discover_site_urls(company_url, max_pages=None, timeout=12, workers=None, per_host_limit=None,
+                       time_budget=None, seed_page=None, use_sitemaps=True, max_bytes=None, stall_pages=None,
+                       use_graph=True, stop_event=None):
+    """
+    Обход ссылок того же домена по приоритету (link_priority), несколькими потоками.
+
+    Очередь — CrawlFrontier; к одному хосту одновременно не больше per_host_limit запросов.
+    Бюджет адаптивный: новые страницы не запрашиваются, когда загружено max_pages страниц
+    или max_bytes байт либо stall_pages загрузок подряд не дали ни одной ссылки, которую
+    этот обход видит впервые (маленький сайт исчерпан — мёртвые ссылки не тратят таймауты).
+    Пути, заранее известные из графа и карт сайта, обход ещё не видел: ссылка на них
+    считается новой и не останавливает обход раньше времени. По истечении
+    time_budget секунд обход завершается с тем, что уже найдено.
+    stop_event (threading.Event) — остановка извне (анализ отменён или уже не ждёт обход):
+    новые запросы не отправляются, обход сразу возвращает найденное, не дожидаясь ответов.
+    seed_page (page_store.PageSnapshot) — уже загруженная главная страница: её ссылки
+    берутся без повторного запроса.
+    Параллельно читаются robots.txt и карты сайта (use_sitemaps): их URL сразу идут
+    в whitelist и в очередь обхода, а если карта покрывает не меньше max_pages страниц,
+    HTML-страниц загружается в SITEMAP_PAGE_DIVISOR раз меньше.
+    Граф сайта (site_graph, use_graph) сохраняется между анализами: известные пути домена
+    сразу попадают в whitelist, страницы, загруженные за SITE_GRAPH_REFRESH_HOURS, отдают
+    ссылки из графа без запроса, а у остальных при неизменном хэше не разбирается HTML.
+    Страницы, текст которых почти совпадает с уже обойдённой (near_duplicates: версии для печати,
+    копии с метками), и их ссылки остаются в whitelist, но в очередь не добавляются; метки
+    рекламы и аналитики (utm_* и т.п.) снимаются со ссылок до очереди.
+
+    Returns:
+        set: ключи url_key найденных путей (whitelist ссылок отчёта)
+    """
+    if not HTML_PARSER_AVAILABLE:
+        return set()
+
+    max_pages = max_pages or CRAWL_MAX_PAGES
+    workers = workers or CRAWL_WORKERS
+    per_host_limit = per_host_limit or CRAWL_PER_HOST_LIMIT
+    time_budget = time_budget or CRAWL_TIME_BUDGET
+    max_bytes = max_bytes or CRAWL_MAX_MB * 1024 * 1024
+    stall_pages = stall_pages or CRAWL_STALL_PAGES
+
+    seed = normalize_url(company_url)
+    base_host = url_host(seed)
+    if not base_host:
+        return set()
+
+    allowed_keys = set()
+
+    def register_url(u):
+        allowed_keys.add(url_key(u))
+
+    graph_store = site_graph.get_graph() if use_graph else None
+    graph = None
+    if graph_store is not None:
+        try:
+            graph = graph_store.load(base_host, site_graph.SITE_GRAPH_MAX_AGE_DAYS * 24 * 60 * 60)
+        except Exception as e:
+            logger.warning(f"Обход {base_host}: граф сайта не загружен: {e}")
+            graph_store = None
+    refresh_age = site_graph.SITE_GRAPH_REFRESH_HOURS * 60 * 60
+    graph_pages = 0
+    if graph is not None:
+        # Whitelist из прошлых анализов доступен сразу, ещё до первого запроса к сайту
+        allowed_keys.update(graph.nodes)
+
+    def remember(action, *args):
+        """Запись в граф сайта; ошибка базы не прерывает обход."""
+        nonlocal graph_store
+        if graph_store is None:
+            return
+        try:
+            getattr(graph_store, action)(base_host, *args)
+        except Exception as e:
+            logger.warning(f"Обход {base_host}: граф сайта не обновлён: {e}")
+            graph_store = None
+
+    frontier = CrawlFrontier(max_size=max_pages * 20)
+    pages_fetched = 0
+    bytes_fetched = 0
+    stalled = 0  # загрузок подряд без новых ссылок
+    # canonical_url_key ссылок, найденных на страницах этого обхода (без путей из графа и карт сайта)
+    crawl_seen = set()
+    stop_reason = None
+    duplicates = NearDuplicateIndex()
+
+    def enqueue(u, in_menu=False, hops=1):
+        frontier.push(u, link_priority(u, in_menu=in_menu, hops=hops), hops)
+
+    if seed_page is not None and seed_page.is_html:
+        frontier.mark_taken(seed)
+        frontier.mark_taken(seed_page.final_url)
+        pages_fetched = 1
+        crawl_seen.update((canonical_url_key(seed), canonical_url_key(seed_page.final_url)))
+        register_url(seed_page.final_url)
+        seed_links, seed_title, _ = _extract_page_links(seed_page.final_url, seed_page.text, base_host, duplicates)
+        for clean, in_menu in seed_links:
+            register_url(clean)
+            crawl_seen.add(canonical_url_key(clean))
+            enqueue(clean, in_menu=in_menu, hops=1)
+        remember('record_page', seed_page.final_url, seed_title, seed_page.content_hash, seed_links)
+    else:
+        crawl_seen.add(canonical_url_key(seed))
+        frontier.push(seed, link_priority(seed, hops=0), 0)
+
+    in_flight = {}  # future -> (хост (netloc), переходов от главной)
+    host_load = {}
+    deadline = time.monotonic() + time_budget
+
+    def host_available(url):
+        return host_load.get((parse_url(url).netloc or '').lower(), 0) < per_host_limit
+
+    page_limit = max_pages
+    # Ещё один поток — под чтение robots.txt и карт сайта, параллельно с обходом HTML
+    pool = ThreadPoolExecutor(max_workers=workers + 1, thread_name_prefix='crawl')
+    sitemap_future = pool.submit(discover_sitemap_urls, seed, timeout, deadline) if use_sitemaps else None
+    try:
+        while frontier or in_flight or sitemap_future is not None:
+            if stop_event is not None and stop_event.is_set():
+                stop_reason = 'остановлен анализом'
+                break
+            while (stop_reason is None and frontier and len(in_flight) < workers
+                   and pages_fetched + len(in_flight) < page_limit):
+                url, hops = frontier.pop(host_available)
+                if url is None:
+                    break
+                stored_links = graph.fresh_links(url, refresh_age) if graph is not None else None
+                if stored_links is not None:
+                    # Страница недавно загружалась — её ссылки известны из графа, запрос не нужен
+                    graph_pages += 1
+                    for clean, in_menu in stored_links:
+                        register_url(clean)
+                        crawl_seen.add(canonical_url_key(clean))
+                        enqueue(clean, in_menu=in_menu, hops=hops + 1)
+                    continue
+                known = graph.nodes.get(site_graph.node_key(url)) if graph is not None else None
+                host = (parse_url(url).netloc or '').lower()
+                host_load[host] = host_load.get(host, 0) + 1
+                future = pool.submit(_fetch_page_links, url, base_host, timeout, known and known.content_hash,
+                                     duplicates)
+                in_flight[future] = (host, hops, url)
+
+            waiting = set(in_flight)
+            if sitemap_future is not None:
+                waiting.add(sitemap_future)
+            if not waiting:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.info(f"Обход {base_host}: исчерпан лимит времени {time_budget} с")
+                break
+            if stop_event is not None:
+                remaining = min(remaining, CRAWL_STOP_POLL_SECONDS)
+            done, _ = wait(waiting, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future is sitemap_future:
+                    sitemap_future = None
+                    try:
+                        sitemap_urls = future.result()
+                    except Exception as e:
+                        logger.info(f"Обход {base_host}: карты сайта не прочитаны: {e}")
+                        continue
+                    # Страницы из карты сайта сразу попадают в whitelist; HTML нужен лишь для ссылок
+                    # меню, которых в карте может не быть, поэтому при полной карте страниц обходим меньше
+                    for url in sitemap_urls:
+                        register_url(url)
+                        enqueue(url, hops=SITEMAP_HOPS)
+                    remember('record_urls', sitemap_urls)
+                    if len(sitemap_urls) >= max_pages:
+                        page_limit = max(1, max_pages // SITEMAP_PAGE_DIVISOR)
+                    continue
+                host, hops, url = in_flight.pop(future)
+                host_load[host] -= 1
+                new_links = 0
+                page = future.result()
+                if page is not None:
+                    pages_fetched += 1
+                    bytes_fetched += page.size
+                    if page.links is not None:
+                        links, title = page.links, page.title
+                        if page.unchanged:
+                            # Содержимое не изменилось с прошлой загрузки — ссылки те же, что в графе
+                            key = site_graph.node_key(url)
+                            links, title = graph.links.get(key, []), graph.nodes[key].title
+                        register_url(page.final)
+                        frontier.mark_taken(page.final)
+                        crawl_seen.add(canonical_url_key(page.final))
+                        for clean, in_menu in links:
+                            register_url(clean)
+                            # У почти одинаковых страниц и ссылки те же — очередь пополняет только первая из них
+                            if page.duplicate_of is None:
+                                link_key = canonical_url_key(clean)
+                                if link_key not in crawl_seen:
+                                    crawl_seen.add(link_key)
+                                    new_links += 1
+                                enqueue(clean, in_menu=in_menu, hops=hops + 1)
+                        if page.content_hash:
+                            remember('record_page', page.final, title, page.content_hash, links)
+                # Прогресс — ссылки, впервые увиденные обходом; недоступная страница их не даёт
+                stalled = 0 if new_links else stalled + 1
+                if stop_reason is None:
+                    if bytes_fetched >= max_bytes:
+                        stop_reason = f'загружено {bytes_fetched // 1024} КБ'
+                    elif stalled >= stall_pages:
+                        stop_reason = f'{stalled} страниц подряд без новых ссылок'
+    finally:
+        # Зависшие запросы не держат анализ: не ждём их и снимаем ещё не начатые
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Обход {base_host}: загружено {pages_fetched} страниц ({bytes_fetched // 1024} КБ), "
+                f"из графа сайта {graph_pages}, почти дубликатов {duplicates.skipped}, в очереди осталось {len(frontier)}, "
+                f"найдено {len(allowed_keys)} путей"
+                + (f"; остановлен: {stop_reason}" if stop_reason else ''))
+
+    return allowed_keys
+
+
+def known_site_urls(company_url):
+    """
+    Whitelist домена только из графа сайта, без запросов (например, если обход не успел).
+
+    Returns:
+        set: ключи url_key путей домена
+    """
+    base_host = url_host(company_url)
+    graph_store = site_graph.get_graph()
+    if not base_host or graph_store is None:
+        return set()
+    try:
+        graph = graph_store.load(base_host, site_graph.SITE_GRAPH_MAX_AGE_DAYS * 24 * 60 * 60)
+    except Exception as e:
+        logger.warning(f"Граф сайта {base_host} не загружен: {e}")
+        return set()
+    # Ключи узлов графа — те же url_key
+    return set(graph.nodes)
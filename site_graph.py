@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Граф сайтов между анализами: страницы (узлы) и ссылки между ними (рёбра) по доменам, в SQLite
+
+Узел — путь сайта с ключом url_key, заголовком, хэшем содержимого и временем,
+когда путь последний раз встречался и когда страница загружалась. Следующий анализ того же
+домена сразу получает whitelist из графа, а обход загружает заново только страницы,
+которые давно не проверялись (свежие отдают сохранённые ссылки без запроса к сайту).
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from logger import logger
+from url_utils import normalize_url, url_key
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+SITE_GRAPH_DB_PATH = Path(os.getenv('SITE_GRAPH_DB_PATH') or (Path(__file__).parent / 'tasks' / 'site_graph.sqlite3'))
+# Сколько часов загруженная страница считается свежей: её ссылки берутся из графа без запроса (0 — граф отключён)
+SITE_GRAPH_REFRESH_HOURS = _env_int('SITE_GRAPH_REFRESH_HOURS', 24)
+# Пути, не встречавшиеся дольше этого срока (дни), не попадают в whitelist и удаляются очисткой
+SITE_GRAPH_MAX_AGE_DAYS = _env_int('SITE_GRAPH_MAX_AGE_DAYS', 30, minimum=1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    domain TEXT NOT NULL,
+    key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    content_hash TEXT,
+    last_seen REAL NOT NULL,
+    last_fetched REAL,
+    PRIMARY KEY (domain, key)
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_seen ON nodes(last_seen);
+CREATE TABLE IF NOT EXISTS edges (
+    domain TEXT NOT NULL,
+    src TEXT NOT NULL,
+    dst TEXT NOT NULL,
+    in_menu INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (domain, src, dst)
+);
+"""
+
+
+# Ключ узла — url_key: хост без www + путь + query
+node_key = url_key
+
+
+class GraphNode(NamedTuple):
+    url: str
+    title: Optional[str]
+    content_hash: Optional[str]
+    last_fetched: Optional[float]
+
+
+class SiteGraph(NamedTuple):
+    """Снимок графа одного домена: узлы по ключу и исходящие ссылки загруженных страниц."""
+    nodes: Dict[str, GraphNode]
+    links: Dict[str, List[Tuple[str, bool]]]  # ключ страницы -> [(URL ссылки, из меню)]
+
+    def fresh_links(self, url: str, max_age: float) -> Optional[List[Tuple[str, bool]]]:
+        """Ссылки страницы из графа, если она загружалась не раньше max_age секунд назад, иначе None."""
+        key = node_key(url)
+        node = self.nodes.get(key)
+        if node is None or not node.last_fetched or time.time() - node.last_fetched > max_age:
+            return None
+        return self.links.get(key, [])
+
+
+class SiteGraphStore:
+    """Узлы и рёбра графов сайтов (один файл SQLite на все домены)."""
+
+    def __init__(self, db_path):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток (sqlite3 не разделяет соединения между потоками)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self._db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, domain: str, max_age: float) -> SiteGraph:
+        """Граф домена: узлы, встречавшиеся за последние max_age секунд, и рёбра между ними."""
+        conn = self._conn()
+        border = time.time() - max_age
+        nodes = {
+            row['key']: GraphNode(row['url'], row['title'], row['content_hash'], row['last_fetched'])
+            for row in conn.execute(
+                "SELECT key, url, title, content_hash, last_fetched FROM nodes WHERE domain = ? AND last_seen >= ?",
+                (domain, border),
+            )
+        }
+        links: Dict[str, List[Tuple[str, bool]]] = {}
+        for row in conn.execute("SELECT src, dst, in_menu FROM edges WHERE domain = ?", (domain,)):
+            target = nodes.get(row['dst'])
+            if row['src'] in nodes and target is not None:
+                links.setdefault(row['src'], []).append((target.url, bool(row['in_menu'])))
+        return SiteGraph(nodes, links)
+
+    def _touch_nodes(self, conn, domain: str, urls: Iterable[str], now_ts: float):
+        conn.executemany(
+            """
+            INSERT INTO nodes (domain, key, url, last_seen) VALUES (?, ?, ?, ?)
+            ON CONFLICT(domain, key) DO UPDATE SET last_seen = excluded.last_seen
+            """,
+            [(domain, node_key(u), normalize_url(u), now_ts) for u in urls],
+        )
+
+    def record_urls(self, domain: str, urls: Iterable[str]):
+        """Пути, известные без загрузки страницы (например, из карты сайта)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._touch_nodes(conn, domain, urls, time.time())
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def record_page(self, domain: str, url: str, title: Optional[str], content_hash: Optional[str],
+                    links: Iterable[Tuple[str, bool]]):
+        """Загруженная страница: узел с заголовком и хэшем и её исходящие ссылки (прежние рёбра заменяются)."""
+        links = list(links)
+        src = node_key(url)
+        now_ts = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                INSERT INTO nodes (domain, key, url, title, content_hash, last_seen, last_fetched)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(domain, key) DO UPDATE SET url = excluded.url, title = excluded.title,
+                    content_hash = excluded.content_hash, last_seen = excluded.last_seen,
+                    last_fetched = excluded.last_fetched
+                """,
+                (domain, src, normalize_url(url), title, content_hash, now_ts, now_ts),
+            )
+            self._touch_nodes(conn, domain, (u for u, _ in links), now_ts)
+            conn.execute("DELETE FROM edges WHERE domain = ? AND src = ?", (domain, src))
+            edges = {}
+            for u, in_menu in links:
+                dst = node_key(u)
+                edges[dst] = edges.get(dst, False) or in_menu
+            conn.executemany(
+                "INSERT INTO edges (domain, src, dst, in_menu) VALUES (?, ?, ?, ?)",
+                [(domain, src, dst, int(in_menu)) for dst, in_menu in edges.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cleanup(self, older_than: float) -> int:
+        """Удаляет узлы, не встречавшиеся дольше older_than секунд, и их рёбра."""
+        border = time.time() - older_than
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM nodes WHERE last_seen < ?", (border,)).rowcount
+        if removed:
+            conn.execute(
+                """
+                DELETE FROM edges WHERE NOT EXISTS (
+                    SELECT 1 FROM nodes WHERE nodes.domain = edges.domain AND nodes.key = edges.src
+                ) OR NOT EXISTS (
+                    SELECT 1 FROM nodes WHERE nodes.domain = edges.domain AND nodes.key = edges.dst
+                )
+                """
+            )
+        return removed
+
+
+_graph: Optional[SiteGraphStore] = None
+_graph_failed = False
+_graph_lock = threading.Lock()
+
+
+def get_graph() -> Optional[SiteGraphStore]:
+    """Хранилище графов процесса или None, если граф отключён (SITE_GRAPH_REFRESH_HOURS=0) или недоступен."""
+    global _graph, _graph_failed
+    if SITE_GRAPH_REFRESH_HOURS <= 0 or _graph_failed:
+        return None
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None and not _graph_failed:
+                try:
+                    _graph = SiteGraphStore(SITE_GRAPH_DB_PATH)
+                except Exception as e:
+                    _graph_failed = True
+                    logger.warning(f"Граф сайтов недоступен ({SITE_GRAPH_DB_PATH}): {e}. Обход идёт без него")
+    return _graph
+
+
+def cleanup():
+    """Очистка графа от давно не встречавшихся путей (вызывается вместе с очисткой результатов)."""
+    graph = get_graph()
+    if graph is None:
+        return 0
+    return graph.cleanup(SITE_GRAPH_MAX_AGE_DAYS * 24 * 60 * 60)
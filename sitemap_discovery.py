@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Структура сайта из robots.txt и sitemap.xml: URL страниц без обхода HTML
+
+Адреса карт сайта берутся из строк Sitemap: в robots.txt (иначе — /sitemap.xml).
+Карты читаются потоково (XMLPullParser по кускам ответа), поддерживаются индексы
+карт (sitemapindex) и сжатые gzip файлы (.xml.gz); в памяти не держится весь документ.
+"""
+import os
+import time
+import zlib
+from collections import deque
+from urllib.parse import urljoin, urlparse
+from xml.etree import ElementTree
+
+import requests
+
+import http_cache
+import http_client
+from logger import logger
+from url_utils import hostname_base, normalize_url
+
+
+def _env_int(name, default, minimum=1):
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except (TypeError, ValueError):
+        return default
+
+
+# Сколько URL страниц взять из карт сайта и сколько файлов карт (с индексами) прочитать
+SITEMAP_MAX_URLS = _env_int('SITEMAP_MAX_URLS', 2000)
+SITEMAP_MAX_FILES = _env_int('SITEMAP_MAX_FILES', 10)
+# Предел распакованного размера одной карты (протокол sitemaps: не больше 50 МБ)
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _local_name(tag):
+    """Имя тега без пространства имён: {http://www.sitemaps.org/...}loc → loc."""
+    return tag.rsplit('}', 1)[-1].lower() if isinstance(tag, str) else ''
+
+
+def robots_sitemaps(site_url, timeout=12):
+    """Адреса карт сайта из строк Sitemap: в robots.txt (пустой список, если их нет)."""
+    robots_url = urljoin(site_url, '/robots.txt')
+    try:
+        r = http_cache.get(robots_url, timeout=timeout)
+    except requests.RequestException:
+        return []
+    if r.status_code >= 400:
+        return []
+    sitemaps = []
+    for line in r.text.splitlines():
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'sitemap' and value.strip():
+            sitemaps.append(urljoin(robots_url, value.strip()))
+    return sitemaps
+
+
+def _iter_chunks(response):
+    """Куски тела ответа; gzip-файл (.xml.gz) распаковывается на лету с пределом размера."""
+    gunzip = None
+    total = 0
+    for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+        if not chunk:
+            continue
+        if gunzip is None and total == 0 and chunk[:2] == b'\x1f\x8b':
+            gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if gunzip is None:
+            total += len(chunk)
+            yield chunk
+        else:
+            # Ограничиваем выход распаковки: сжатая «бомба» не раздувается в памяти
+            data = gunzip.decompress(chunk, _CHUNK_SIZE)
+            while True:
+                total += len(data)
+                yield data
+                if not gunzip.unconsumed_tail or total > SITEMAP_MAX_BYTES:
+                    break
+                data = gunzip.decompress(gunzip.unconsumed_tail, _CHUNK_SIZE)
+        if total > SITEMAP_MAX_BYTES:
+            logger.warning(f"Карта сайта {response.url} больше {SITEMAP_MAX_BYTES // (1024 * 1024)} МБ — читаем только начало")
+            return
+
+
+def _iter_sitemap_locs(sitemap_url, timeout, deadline):
+    """
+    Потоково читает одну карту сайта.
+
+    Yields:
+        tuple: ('sitemapindex' или 'urlset', значение <loc>)
+    """
+    # Слот очереди к домену занят до конца чтения карты, а не только до заголовков ответа
+    try:
+        with http_client.stream(sitemap_url, timeout=timeout) as r:
+            if r.status_code >= 400:
+                return
+            parser = ElementTree.XMLPullParser(events=('start', 'end'))
+            root = None
+            kind = ''
+            for chunk in _iter_chunks(r):
+                if time.monotonic() > deadline:
+                    return
+                try:
+                    parser.feed(chunk)
+                    for event, elem in parser.read_events():
+                        name = _local_name(elem.tag)
+                        if event == 'start':
+                            if root is None:
+                                root, kind = elem, name
+                            continue
+                        if name == 'loc' and elem.text and elem.text.strip():
+                            yield kind, elem.text.strip()
+                        elif name in ('url', 'sitemap') and root is not None:
+                            # Обработанные записи не копятся в дереве
+                            root.clear()
+                except ElementTree.ParseError as e:
+                    logger.info(f"Карта сайта {sitemap_url} не разобрана полностью: {e}")
+                    return
+    except requests.RequestException:
+        return
+
+
+def discover_sitemap_urls(site_url, timeout=12, deadline=None, max_urls=None, max_files=None):
+    """
+    URL страниц того же сайта из robots.txt и карт сайта.
+
+    Индексы карт раскрываются в ширину; читается не больше max_files файлов карт
+    и max_urls адресов страниц, чтение прекращается по наступлении deadline (time.monotonic()).
+
+    Returns:
+        list: нормализованные URL страниц в порядке карт сайта
+    """
+    max_urls = max_urls or SITEMAP_MAX_URLS
+    max_files = max_files or SITEMAP_MAX_FILES
+    deadline = deadline or (time.monotonic() + 30)
+
+    site_url = normalize_url(site_url)
+    base_host = hostname_base(urlparse(site_url).hostname or '')
+    if not base_host:
+        return []
+
+    pending = deque(robots_sitemaps(site_url, timeout=timeout) or [urljoin(site_url, '/sitemap.xml')])
+    seen_files = set()
+    urls = []
+    seen_urls = set()
+    while pending and len(seen_files) < max_files and len(urls) < max_urls:
+        if time.monotonic() > deadline:
+            break
+        sitemap_url = pending.popleft()
+        if sitemap_url in seen_files:
+            continue
+        seen_files.add(sitemap_url)
+        for kind, loc in _iter_sitemap_locs(sitemap_url, timeout, deadline):
+            parsed = urlparse(loc)
+            if parsed.scheme not in ('http', 'https') or hostname_base(parsed.hostname or '') != base_host:
+                continue
+            if kind == 'sitemapindex':
+                pending.append(loc)
+                continue
+            url = normalize_url(loc.split('#', 1)[0])
+            if url not in seen_urls:
+                seen_urls.add(url)
+                urls.append(url)
+                if len(urls) >= max_urls:
+                    break
+
+    if urls:
+        logger.info(f"Карты сайта {base_host}: {len(urls)} URL из {len(seen_files)} файлов")
+    return urls
@@ -15,6 +15,7 @@ const costValue = document.getElementById('costValue');
 const resultActions = document.getElementById('resultActions');
 const exportDocxBtn = document.getElementById('exportDocxBtn');
 const newAnalysisBtn = document.getElementById('newAnalysisBtn');
+const cancelAnalysisBtn = document.getElementById('cancelAnalysisBtn');
 const instrumentsBlock = document.getElementById('instrumentsBlock');
 const analysisSection = document.getElementById('analysisSection');
 const btnUsefulTools = document.getElementById('btnUsefulTools');
@@ -59,6 +60,7 @@ if (btnAnalysis) {
 let currentTaskId = null;
 let currentResult = null;
 let statusCheckInterval = null;
+let statusEventSource = null;
 let currentProgress = 0; // Текущее значение прогресса (только увеличивается)
 
 form.addEventListener('submit', async (e) => {
@@ -109,7 +111,15 @@ form.addEventListener('submit', async (e) => {
         }
         
         currentTaskId = data.task_id;
-        startStatusPolling();
+        cancelAnalysisBtn.disabled = false;
+        if (data.cached) {
+            statusMessage.textContent = 'Найден свежий результат анализа, загрузка...';
+        } else if (data.coalesced) {
+            statusMessage.textContent = data.message;
+        } else if (data.status === 'queued' && data.queue_position) {
+            statusMessage.textContent = `В очереди: позиция ${data.queue_position}`;
+        }
+        startStatusUpdates();
         
     } catch (error) {
         showError(error.message);
@@ -117,11 +127,109 @@ form.addEventListener('submit', async (e) => {
     }
 });
 
-function startStatusPolling() {
+function stopStatusUpdates() {
+    if (statusEventSource) {
+        statusEventSource.close();
+        statusEventSource = null;
+    }
     if (statusCheckInterval) {
         clearInterval(statusCheckInterval);
+        statusCheckInterval = null;
+    }
+}
+
+// Обрабатывает статус задачи; возвращает true, если задача завершена (успешно или с ошибкой)
+function handleStatusData(data) {
+    if (data.status === 'completed') {
+        stopStatusUpdates();
+        
+        // Убеждаемся, что результат есть
+        if (!data.result) {
+            showError('Результат анализа не найден');
+            resetForm();
+            return true;
+        }
+        
+        // Приоритетно используем стоимость из статуса, затем из результата
+        let finalCost = null;
+        if (data.cost !== null && data.cost !== undefined) {
+            finalCost = data.cost;
+        } else if (data.result.cost !== null && data.result.cost !== undefined) {
+            finalCost = data.result.cost;
+        }
+        
+        // Устанавливаем стоимость в результат
+        data.result.cost = finalCost;
+        
+        // Добавляем task_id в результат для экспорта
+        data.result.task_id = currentTaskId;
+        
+        console.log('Отображение результата:', {
+            cost: finalCost,
+            hasResult: !!data.result,
+            taskId: currentTaskId
+        });
+        
+        showResult(data.result);
+        resetForm();
+        // НЕ очищаем поле ввода - пользователь может использовать кнопку "Анализ другого сайта"
+        return true;
+    } else if (data.status === 'error') {
+        stopStatusUpdates();
+        showError(data.message);
+        resetForm();
+        return true;
+    } else if (data.status === 'cancelled') {
+        stopStatusUpdates();
+        statusContainer.style.display = 'none';
+        resetForm();
+        return true;
+    } else if (data.status === 'queued' || data.status === 'processing' || data.status === 'cancelling') {
+        updateProgress(data.progress, data.message);
+    }
+    return false;
+}
+
+// Статус через Server-Sent Events: сервер присылает только изменения и финальное событие.
+// Если браузер не поддерживает EventSource или поток недоступен — опрос /api/status
+function startStatusUpdates() {
+    stopStatusUpdates();
+    if (!currentTaskId) return;
+    
+    if (!window.EventSource) {
+        startStatusPolling();
+        return;
     }
     
+    const source = new EventSource(`/api/status/${currentTaskId}/stream`);
+    statusEventSource = source;
+    
+    const onStatusEvent = (event) => {
+        if (source !== statusEventSource) return;
+        try {
+            handleStatusData(JSON.parse(event.data));
+        } catch (e) {
+            console.error('Ошибка разбора события статуса:', e);
+        }
+    };
+    source.addEventListener('progress', onStatusEvent);
+    source.addEventListener('completed', onStatusEvent);
+    source.addEventListener('failed', onStatusEvent);
+    
+    source.onerror = () => {
+        if (source !== statusEventSource) return;
+        // CONNECTING — браузер переподключится сам; CLOSED — поток недоступен, переходим на опрос
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('Поток статуса недоступен, переход на периодический опрос');
+            statusEventSource = null;
+            startStatusPolling();
+        }
+    };
+}
+
+function startStatusPolling() {
+    stopStatusUpdates();
+    
     statusCheckInterval = setInterval(async () => {
         if (!currentTaskId) return;
         
@@ -148,49 +256,9 @@ function startStatusPolling() {
             }
             
             const data = await response.json();
-            
-            if (data.status === 'completed') {
-                clearInterval(statusCheckInterval);
-                
-                // Убеждаемся, что результат есть
-                if (!data.result) {
-                    showError('Результат анализа не найден');
-                    resetForm();
-                    return;
-                }
-                
-                // Приоритетно используем стоимость из статуса, затем из результата
-                let finalCost = null;
-                if (data.cost !== null && data.cost !== undefined) {
-                    finalCost = data.cost;
-                } else if (data.result.cost !== null && data.result.cost !== undefined) {
-                    finalCost = data.result.cost;
-                }
-                
-                // Устанавливаем стоимость в результат
-                data.result.cost = finalCost;
-                
-                // Добавляем task_id в результат для экспорта
-                data.result.task_id = currentTaskId;
-                
-                console.log('Отображение результата:', {
-                    cost: finalCost,
-                    hasResult: !!data.result,
-                    taskId: currentTaskId
-                });
-                
-                showResult(data.result);
-                resetForm();
-                // НЕ очищаем поле ввода - пользователь может использовать кнопку "Анализ другого сайта"
-            } else if (data.status === 'error') {
-                clearInterval(statusCheckInterval);
-                showError(data.message);
-                resetForm();
-            } else if (data.status === 'processing') {
-                updateProgress(data.progress, data.message);
-            }
+            handleStatusData(data);
         } catch (error) {
-            clearInterval(statusCheckInterval);
+            stopStatusUpdates();
             const errorMessage = error.message || 'Ошибка при проверке статуса';
             console.error('Ошибка при проверке статуса:', error);
             showError(errorMessage);
@@ -279,6 +347,27 @@ function resetForm() {
     currentTaskId = null;
 }
 
+// Отмена текущего анализа: сервер снимает задачу с очереди или останавливает Crew
+cancelAnalysisBtn.addEventListener('click', async () => {
+    if (!currentTaskId) return;
+    cancelAnalysisBtn.disabled = true;
+    statusMessage.textContent = 'Отмена анализа...';
+    try {
+        const response = await fetch(`/api/analyze/${currentTaskId}`, { method: 'DELETE' });
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok) {
+            throw new Error(data.error || `Ошибка ${response.status}`);
+        }
+        // Итоговый статус 'cancelled' придёт через поток статуса (или опрос)
+        if (data.status === 'cancelled') {
+            handleStatusData(data);
+        }
+    } catch (error) {
+        cancelAnalysisBtn.disabled = false;
+        showError(`Не удалось отменить анализ: ${error.message}`);
+    }
+});
+
 // Обработчик экспорта в DOCX
 exportDocxBtn.addEventListener('click', async () => {
     // Используем task_id из результата или сохраненный currentTaskId
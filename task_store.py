@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Хранилище задач и результатов анализа в SQLite (режим WAL)
+
+Один файл базы используют все рабочие процессы приложения, поэтому статус задачи,
+поставленной одним процессом, виден в любом другом (например, за Caddy).
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from logger import logger
+
+# Статусы, при которых задача ещё выполняется или ждёт в очереди
+ACTIVE_STATUSES = ('queued', 'processing')
+# Запрошена отмена выполняющейся задачи — рабочий поток остановит Crew на ближайшем шаге
+CANCELLING_STATUS = 'cancelling'
+# Промежуточные статусы: не кэшируются в памяти и не удаляются очисткой
+_TRANSIENT_STATUSES = ACTIVE_STATUSES + (CANCELLING_STATUS,)
+# Поля статуса, хранящиеся в отдельных колонках; остальные ключи — в JSON-колонке extra
+_STATUS_COLUMNS = ('status', 'progress', 'message', 'cost', 'initial_balance', 'queue_position')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    url TEXT,
+    url_key TEXT,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    cost REAL,
+    initial_balance REAL,
+    queue_position INTEGER,
+    extra TEXT,
+    subscribers INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_url_key ON tasks(url_key, status);
+CREATE TABLE IF NOT EXISTS results (
+    task_id TEXT PRIMARY KEY,
+    url_key TEXT,
+    data TEXT NOT NULL,
+    completed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_url_key ON results(url_key, completed_at);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class _LRUCache:
+    """Простой ограниченный LRU-кэш (потокобезопасный)."""
+
+    def __init__(self, capacity: int):
+        self._capacity = max(1, int(capacity))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._capacity:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class TaskStore:
+    """
+    Статусы задач (таблица tasks) и результаты анализов (таблица results).
+
+    Изменяемые статусы всегда читаются из базы (их может обновлять другой процесс),
+    в памяти кэшируются только неизменяемые данные: результаты и завершённые статусы.
+    """
+
+    def __init__(self, db_path, cache_size: int = 256):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._results_cache = _LRUCache(cache_size)
+        self._final_status_cache = _LRUCache(cache_size)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Добавляет колонки, которых нет в базе, созданной прежней версией."""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(tasks)")}
+        if 'subscribers' not in columns:
+            try:
+                conn.execute("ALTER TABLE tasks ADD COLUMN subscribers INTEGER NOT NULL DEFAULT 1")
+            except sqlite3.OperationalError:
+                pass  # колонку одновременно добавил другой процесс
+
+    @property
+    def db_path(self) -> Path:
+        return self._db_path
+
+    def _conn(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток (sqlite3 не разделяет соединения между потоками)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self._db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_status(row) -> dict:
+        status = {
+            'status': row['status'],
+            'progress': row['progress'],
+            'message': row['message'],
+            'cost': row['cost'],
+            'initial_balance': row['initial_balance'],
+        }
+        if row['queue_position'] is not None:
+            status['queue_position'] = row['queue_position']
+        if row['extra']:
+            try:
+                status.update(json.loads(row['extra']))
+            except (TypeError, ValueError):
+                pass
+        return status
+
+    @staticmethod
+    def _split_status(status: dict) -> Tuple[dict, Optional[str]]:
+        columns = {k: status.get(k) for k in _STATUS_COLUMNS}
+        extra = {k: v for k, v in status.items() if k not in _STATUS_COLUMNS}
+        return columns, (json.dumps(extra, ensure_ascii=False) if extra else None)
+
+    # ------------------------------------------------------------------
+    # Статусы задач
+    # ------------------------------------------------------------------
+
+    def get_status(self, task_id: str) -> Optional[dict]:
+        """Текущий статус задачи (копия) или None."""
+        cached = self._final_status_cache.get(task_id)
+        if cached is not None:
+            return dict(cached)
+        row = self._conn().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        status = self._row_to_status(row)
+        if status['status'] not in _TRANSIENT_STATUSES:
+            self._final_status_cache.put(task_id, status)
+        return dict(status)
+
+    def get_url(self, task_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT url FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row['url'] if row else None
+
+    def set_status(self, task_id: str, status: dict, url: Optional[str] = None, url_key: Optional[str] = None):
+        """Полностью заменяет статус задачи (создаёт запись при необходимости)."""
+        columns, extra = self._split_status(status)
+        now_ts = time.time()
+        self._conn().execute(
+            """
+            INSERT INTO tasks (task_id, url, url_key, status, progress, message, cost, initial_balance,
+                               queue_position, extra, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id) DO UPDATE SET
+                url = COALESCE(excluded.url, tasks.url),
+                url_key = COALESCE(excluded.url_key, tasks.url_key),
+                status = excluded.status,
+                progress = excluded.progress,
+                message = excluded.message,
+                cost = excluded.cost,
+                initial_balance = excluded.initial_balance,
+                queue_position = excluded.queue_position,
+                extra = excluded.extra,
+                updated_at = excluded.updated_at
+            """,
+            (task_id, url, url_key, columns['status'], int(columns['progress'] or 0), columns['message'],
+             columns['cost'], columns['initial_balance'], columns['queue_position'], extra, now_ts, now_ts),
+        )
+        self._final_status_cache.pop(task_id)
+
+    def update_status(self, task_id: str, **fields) -> bool:
+        """
+        Частично обновляет статус задачи одним UPDATE: остальные поля, которые параллельно
+        пишут другие потоки и процессы (прогресс, отмена, позиция в очереди), не затираются.
+        Поля вне колонок меняются внутри JSON-колонки extra. Возвращает False, если задачи нет.
+        """
+        assignments, params = [], []
+        extra_expr, extra_params = 'extra', []
+        for name, value in fields.items():
+            if name in _STATUS_COLUMNS:
+                assignments.append(f'{name} = ?')
+                params.append(int(value or 0) if name == 'progress' else value)
+            else:
+                extra_expr = f"json_set(COALESCE({extra_expr}, '{{}}'), ?, json(?))"
+                extra_params.extend([f'$."{name}"', json.dumps(value, ensure_ascii=False)])
+        if extra_params:
+            assignments.append(f'extra = {extra_expr}')
+            params.extend(extra_params)
+        assignments.append('updated_at = ?')
+        params.extend([time.time(), task_id])
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(f"UPDATE tasks SET {', '.join(assignments)} WHERE task_id = ?", params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._final_status_cache.pop(task_id)
+        return cur.rowcount > 0
+
+    def update_progress(self, task_id: str, progress: int, message: Optional[str] = None,
+                        eta_seconds: Optional[float] = None) -> bool:
+        """
+        Монотонно увеличивает прогресс (не уменьшает) только у выполняющейся задачи.
+        eta_seconds (если передан) сохраняется в статусе как оценка оставшегося времени.
+        """
+        progress = max(0, min(int(progress), 100))
+        eta = int(round(eta_seconds)) if eta_seconds is not None else None
+        cur = self._conn().execute(
+            """
+            UPDATE tasks SET progress = MAX(progress, ?), message = COALESCE(?, message), updated_at = ?,
+                             extra = CASE WHEN ? IS NULL THEN extra
+                                          ELSE json_set(COALESCE(extra, '{}'), '$.eta_seconds', ?) END
+            WHERE task_id = ? AND status = 'processing'
+            """,
+            (progress, message, time.time(), eta, eta, task_id),
+        )
+        return cur.rowcount > 0
+
+    def start_processing(self, task_id: str, message: str) -> int:
+        """
+        Атомарно переводит задачу из 'queued' в 'processing'.
+
+        Returns:
+            int: 1, если задача запущена; 0 — её нет или она уже не в очереди
+                 (отменена, выполняется другим потоком, помечена ошибкой)
+        """
+        cur = self._conn().execute(
+            """
+            UPDATE tasks SET status = 'processing', progress = 0, message = ?, cost = NULL,
+                             queue_position = NULL, updated_at = ?
+            WHERE task_id = ? AND status = 'queued'
+            """,
+            (message, time.time(), task_id),
+        )
+        self._final_status_cache.pop(task_id)
+        return cur.rowcount
+
+    def finish_processing(self, task_id: str, status: dict, cancelled: Optional[dict] = None) -> Optional[str]:
+        """
+        Атомарно завершает выполняющуюся задачу итоговым статусом status.
+
+        Если отмену запросили после последней проверки рабочего потока (статус 'cancelling'),
+        задача завершается статусом cancelled (по умолчанию — тем же status): DELETE,
+        на который клиент получил 202, не перезаписывается ни 'completed', ни 'error'.
+
+        Returns:
+            str: Записанный статус или None, если задача уже не выполняется
+                 (нет записи, помечена зависшей и т.п.) — тогда запись не меняется
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or row['status'] not in ('processing', 'cancelling'):
+                conn.execute("COMMIT")
+                return None
+            final = status if row['status'] == 'processing' or cancelled is None else cancelled
+            columns, extra = self._split_status(final)
+            conn.execute(
+                """
+                UPDATE tasks SET status = ?, progress = ?, message = ?, cost = ?, initial_balance = ?,
+                                 queue_position = NULL, extra = ?, updated_at = ?
+                WHERE task_id = ?
+                """,
+                (columns['status'], int(columns['progress'] or 0), columns['message'], columns['cost'],
+                 columns['initial_balance'], extra, time.time(), task_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._final_status_cache.pop(task_id)
+        return final['status']
+
+    def set_initial_balance(self, task_id: str, initial_balance) -> bool:
+        """Сохраняет баланс ProxyAPI на старте выполнения (статус задачи не меняется)."""
+        cur = self._conn().execute(
+            "UPDATE tasks SET initial_balance = ?, updated_at = ? WHERE task_id = ? AND status = 'processing'",
+            (initial_balance, time.time(), task_id),
+        )
+        return cur.rowcount > 0
+
+    def set_queue_positions(self, task_ids):
+        """
+        Записывает позиции ожидающих задач (task_ids — в порядке очереди).
+
+        updated_at обновляется: задача, которую держит живая очередь, не считается
+        зависшей (fail_stale_tasks), сколько бы она ни ждала рабочий поток.
+        """
+        if not task_ids:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            for position, task_id in enumerate(task_ids, start=1):
+                conn.execute(
+                    "UPDATE tasks SET queue_position = ?, updated_at = ? WHERE task_id = ? AND status = 'queued'",
+                    (position, now, task_id),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_task(self, task_id: str):
+        self._conn().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        self._final_status_cache.pop(task_id)
+
+    def create_task_if_idle(self, task_id: str, url: str, url_key: str, status: dict,
+                            stale_after: float) -> Tuple[str, bool]:
+        """
+        Атомарно (между процессами) создаёт задачу, если для url_key нет активной.
+        Присоединение к идущей задаче увеличивает число её подписчиков (см. request_cancel).
+
+        Returns:
+            tuple: (task_id, created) — id новой задачи и True, либо id уже идущей и False
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT task_id FROM tasks
+                WHERE url_key = ? AND status IN ('queued', 'processing') AND updated_at >= ?
+                ORDER BY created_at DESC LIMIT 1
+                """,
+                (url_key, time.time() - stale_after),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE tasks SET subscribers = subscribers + 1 WHERE task_id = ?", (row['task_id'],))
+                conn.execute("COMMIT")
+                return row['task_id'], False
+            columns, extra = self._split_status(status)
+            now_ts = time.time()
+            conn.execute(
+                """
+                INSERT INTO tasks (task_id, url, url_key, status, progress, message, cost, initial_balance,
+                                   queue_position, extra, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (task_id, url, url_key, columns['status'], int(columns['progress'] or 0), columns['message'],
+                 columns['cost'], columns['initial_balance'], columns['queue_position'], extra, now_ts, now_ts),
+            )
+            conn.execute("COMMIT")
+            return task_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail_stale_tasks(self, stale_after: float, message: str) -> int:
+        """Переводит в 'error' активные задачи без обновлений дольше stale_after секунд (процесс завершился)."""
+        cur = self._conn().execute(
+            """
+            UPDATE tasks SET status = 'error', progress = 0, message = ?, queue_position = NULL, updated_at = ?
+            WHERE status IN ('queued', 'processing', 'cancelling') AND updated_at < ?
+            """,
+            (message, time.time(), time.time() - stale_after),
+        )
+        return cur.rowcount
+
+    def request_cancel(self, task_id: str, message: str = 'Анализ отменён') -> Optional[str]:
+        """
+        Атомарно запрашивает отмену задачи.
+
+        Задача в очереди сразу получает статус 'cancelled', выполняющаяся — 'cancelling'
+        (её останавливает рабочий поток). Завершённые задачи не меняются.
+        К задаче могли присоединиться другие запросы того же сайта (create_task_if_idle):
+        пока у неё больше одного подписчика, отмена только уменьшает их число,
+        а анализ продолжается для остальных (статус 'queued'/'processing' не меняется).
+
+        Returns:
+            str: Статус задачи после запроса или None, если задача не найдена
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, subscribers FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            status = row['status']
+            if status in ACTIVE_STATUSES and row['subscribers'] > 1:
+                conn.execute("UPDATE tasks SET subscribers = subscribers - 1 WHERE task_id = ?", (task_id,))
+            elif status == 'queued':
+                status = 'cancelled'
+                conn.execute(
+                    """
+                    UPDATE tasks SET status = 'cancelled', message = ?, queue_position = NULL, updated_at = ?
+                    WHERE task_id = ?
+                    """,
+                    (message, time.time(), task_id),
+                )
+            elif status == 'processing':
+                status = CANCELLING_STATUS
+                conn.execute(
+                    "UPDATE tasks SET status = ?, message = ?, updated_at = ? WHERE task_id = ?",
+                    (CANCELLING_STATUS, 'Отмена анализа...', time.time(), task_id),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._final_status_cache.pop(task_id)
+        return status
+
+    def is_cancel_requested(self, task_id: str) -> bool:
+        """Запрошена ли отмена задачи (читает базу напрямую — запрос мог прийти из другого процесса)."""
+        row = self._conn().execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row is not None and row['status'] in (CANCELLING_STATUS, 'cancelled')
+
+    def count_tasks(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def recent_task_ids(self, limit: int = 5):
+        rows = self._conn().execute(
+            "SELECT task_id FROM tasks ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [r['task_id'] for r in rows]
+
+    # ------------------------------------------------------------------
+    # Результаты
+    # ------------------------------------------------------------------
+
+    def save_result(self, task_id: str, data: dict, url_key: Optional[str] = None,
+                    completed_at: Optional[float] = None):
+        self._conn().execute(
+            """
+            INSERT INTO results (task_id, url_key, data, completed_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(task_id) DO UPDATE SET url_key = excluded.url_key, data = excluded.data,
+                                               completed_at = excluded.completed_at
+            """,
+            (task_id, url_key, json.dumps(data, ensure_ascii=False), completed_at or time.time()),
+        )
+        self._results_cache.put(task_id, data)
+
+    def get_result(self, task_id: str) -> Optional[dict]:
+        """Результат анализа (копия верхнего уровня) или None."""
+        cached = self._results_cache.get(task_id)
+        if cached is not None:
+            return dict(cached)
+        row = self._conn().execute("SELECT data FROM results WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            data = json.loads(row['data'])
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(data, dict):
+            return None
+        self._results_cache.put(task_id, data)
+        return dict(data)
+
+    def find_fresh_result(self, url_key: str, max_age: float) -> Tuple[Optional[str], Optional[dict]]:
+        """Самый свежий результат для url_key не старше max_age секунд: (task_id, data) или (None, None)."""
+        row = self._conn().execute(
+            """
+            SELECT task_id FROM results WHERE url_key = ? AND completed_at >= ?
+            ORDER BY completed_at DESC LIMIT 1
+            """,
+            (url_key, time.time() - max_age),
+        ).fetchone()
+        if row is None:
+            return None, None
+        data = self.get_result(row['task_id'])
+        if data is None:
+            return None, None
+        return row['task_id'], data
+
+    def cleanup(self, older_than: float) -> int:
+        """Удаляет результаты, завершённые задачи и пакеты старше older_than секунд."""
+        border = time.time() - older_than
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM results WHERE completed_at < ?", (border,)).rowcount
+        conn.execute(
+            "DELETE FROM tasks WHERE updated_at < ? AND status NOT IN ('queued', 'processing', 'cancelling')",
+            (border,),
+        )
+        conn.execute("DELETE FROM batches WHERE updated_at < ?", (border,))
+        return removed
+
+    # ------------------------------------------------------------------
+    # Пакетные анализы
+    # ------------------------------------------------------------------
+
+    def save_batch(self, batch_id: str, data: dict):
+        """Создаёт или полностью заменяет описание пакета (список URL, task_id, параметры)."""
+        now_ts = time.time()
+        self._conn().execute(
+            """
+            INSERT INTO batches (batch_id, data, created_at, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(batch_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (batch_id, json.dumps(data, ensure_ascii=False), now_ts, now_ts),
+        )
+
+    def touch_batch(self, batch_id: str):
+        """Отметка планировщика пакета: пакет обрабатывается живым процессом."""
+        self._conn().execute("UPDATE batches SET updated_at = ? WHERE batch_id = ?", (time.time(), batch_id))
+
+    def claim_stale_batches(self, stale_after: float) -> list:
+        """
+        Атомарно (между процессами) забирает незавершённые пакеты, планировщик которых
+        не отмечался дольше stale_after секунд (процесс перезапущен или упал).
+
+        Returns:
+            list: batch_id забранных пакетов — их планировщик должен запустить вызывающий процесс
+        """
+        now_ts = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """
+                SELECT batch_id FROM batches
+                WHERE COALESCE(json_extract(data, '$.finished'), 0) = 0 AND updated_at < ?
+                """,
+                (now_ts - stale_after,),
+            ).fetchall()
+            batch_ids = [row['batch_id'] for row in rows]
+            for batch_id in batch_ids:
+                conn.execute("UPDATE batches SET updated_at = ? WHERE batch_id = ?", (now_ts, batch_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return batch_ids
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT data FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            data = json.loads(row['data'])
+        except (TypeError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
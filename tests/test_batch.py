@@ -0,0 +1,102 @@
+"""Планировщик пакетного анализа: лимит одновременных задач и возобновление после перезапуска."""
+import threading
+import time
+
+import pytest
+
+from task_store import TaskStore
+
+main = pytest.importorskip('main')
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TaskStore(tmp_path / 'tasks.sqlite3')
+    monkeypatch.setattr(main, 'task_store', store)
+    monkeypatch.setattr(main, 'BATCH_POLL_INTERVAL_SECONDS', 0.01)
+    monkeypatch.setattr(main, '_load_crew', lambda: (object(), None))
+    return store
+
+
+class _FakeQueue:
+    """Очередь анализа без Crew: задачи «выполняются» фоновым потоком по одной."""
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self.running = []
+        self.max_running = 0
+        self.submitted = []
+
+    def submit(self, task_id, company_url, crawl_options=None):
+        with self._lock:
+            self._store.start_processing(task_id, 'Анализ запущен...')
+            self.running.append(task_id)
+            self.submitted.append(task_id)
+            self.max_running = max(self.max_running, len(self.running))
+        return 1
+
+    def complete_one(self):
+        with self._lock:
+            if not self.running:
+                return
+            task_id = self.running.pop(0)
+        self._store.finish_processing(task_id, {'status': 'completed', 'progress': 100, 'message': 'Анализ завершен'})
+
+
+def _run_with_worker(queue, batch_id):
+    done = threading.Event()
+
+    def worker():
+        while not done.is_set():
+            time.sleep(0.02)
+            queue.complete_one()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        main._run_batch(batch_id)
+    finally:
+        done.set()
+        thread.join()
+
+
+def _save_batch(store, batch_id, urls, concurrency, **extra):
+    batch = {'batch_id': batch_id, 'concurrency': concurrency, 'force': True, 'crawl': {},
+             'items': [{'url': url, 'task_id': None} for url in urls], 'finished': False}
+    batch.update(extra)
+    store.save_batch(batch_id, batch)
+
+
+def test_batch_keeps_at_most_concurrency_tasks_in_flight(store, monkeypatch):
+    queue = _FakeQueue(store)
+    monkeypatch.setattr(main, 'analysis_queue', queue)
+    urls = [f'https://site-{i}.example.com' for i in range(6)]
+    _save_batch(store, 'b1', urls, concurrency=2)
+
+    _run_with_worker(queue, 'b1')
+
+    assert len(queue.submitted) == 6
+    assert queue.max_running <= 2
+    batch = store.get_batch('b1')
+    assert batch['finished'] is True
+    assert all(item['task_id'] for item in batch['items'])
+
+
+def test_stale_unfinished_batch_is_resumed_once(store, monkeypatch):
+    queue = _FakeQueue(store)
+    monkeypatch.setattr(main, 'analysis_queue', queue)
+    spawned = []
+    monkeypatch.setattr(main, '_spawn_batch_scheduler', spawned.append)
+    _save_batch(store, 'old', ['https://site.example.com'], concurrency=1)
+    _save_batch(store, 'done', ['https://other.example.com'], concurrency=1, finished=True)
+    # Планировщик пакетов остановился вместе с процессом
+    store._conn().execute("UPDATE batches SET updated_at = updated_at - 3600")
+
+    main.resume_stale_batches()
+    main.resume_stale_batches()
+    assert spawned == ['old']
+
+    _run_with_worker(queue, 'old')
+    batch = store.get_batch('old')
+    assert batch['finished'] is True and batch['items'][0]['task_id']
@@ -0,0 +1,72 @@
+"""Очередь обхода по приоритету: меню и неглубокие страницы раньше, пагинация и фильтры позже."""
+from site_crawler import CrawlFrontier, link_priority
+
+
+def test_menu_and_shallow_links_come_first():
+    about = link_priority('https://example.com/about', in_menu=True)
+    deep = link_priority('https://example.com/news/2024/item', hops=1)
+    assert about < link_priority('https://example.com/about') < deep
+
+
+def test_pagination_filters_archives_and_files_are_deferred():
+    plain = link_priority('https://example.com/catalog')
+    assert link_priority('https://example.com/catalog?page=2') > link_priority('https://example.com/catalog?sort=asc') > plain
+    assert link_priority('https://example.com/catalog?PAGEN_1=3') > plain
+    assert link_priority('https://example.com/catalog/page/2') > plain
+    assert link_priority('https://example.com/tags/steel') > link_priority('https://example.com/steel/info')
+    assert link_priority('https://example.com/catalog.pdf') > plain
+
+
+def test_frontier_pops_best_score_and_deduplicates():
+    frontier = CrawlFrontier(max_size=10)
+    assert frontier.push('https://example.com/news?page=2', 9, 1)
+    assert frontier.push('https://example.com/about', 2, 1)
+    assert frontier.push('https://example.com/contacts', 3, 1)
+    # Та же страница (канонический ключ) с худшим баллом не ставится повторно
+    assert not frontier.push('https://www.example.com/about/', 5, 2)
+    assert len(frontier) == 3
+
+    assert frontier.pop() == ('https://example.com/about', 1)
+    assert frontier.pop() == ('https://example.com/contacts', 1)
+    assert frontier.pop() == ('https://example.com/news?page=2', 1)
+    assert frontier.pop() == (None, None)
+    assert len(frontier) == 0
+
+
+def test_better_score_raises_queued_link():
+    frontier = CrawlFrontier(max_size=10)
+    frontier.push('https://example.com/products', 6, 2)
+    frontier.push('https://example.com/about', 4, 1)
+    # Ссылка нашлась в меню другой страницы — поднимается в очереди, дубль в куче пропускается
+    assert frontier.push('https://example.com/products', 1, 1)
+    assert len(frontier) == 2
+    assert frontier.pop() == ('https://example.com/products', 1)
+    assert frontier.pop() == ('https://example.com/about', 1)
+    assert frontier.pop() == (None, None)
+
+
+def test_taken_urls_are_not_queued_again():
+    frontier = CrawlFrontier(max_size=10)
+    frontier.push('https://example.com/about', 2, 1)
+    frontier.mark_taken('https://example.com/about')
+    assert len(frontier) == 0
+    assert not frontier.push('https://example.com/about', 1, 1)
+    assert frontier.pop() == (None, None)
+
+
+def test_pop_skips_links_the_caller_cannot_take_now():
+    frontier = CrawlFrontier(max_size=10)
+    frontier.push('https://busy.example.com/a', 1, 1)
+    frontier.push('https://example.com/b', 2, 1)
+
+    assert frontier.pop(lambda url: 'busy' not in url) == ('https://example.com/b', 1)
+    # Отложенная ссылка остаётся в очереди
+    assert frontier.pop() == ('https://busy.example.com/a', 1)
+
+
+def test_frontier_size_is_bounded():
+    frontier = CrawlFrontier(max_size=2)
+    assert frontier.push('https://example.com/a', 1, 1)
+    assert frontier.push('https://example.com/b', 1, 1)
+    assert not frontier.push('https://example.com/c', 1, 1)
+    assert len(frontier) == 2
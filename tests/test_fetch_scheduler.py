@@ -0,0 +1,93 @@
+"""Планировщик запросов к сайтам: слоты на домен и процесс, паузы после 429/503."""
+import threading
+import time
+
+import pytest
+
+from fetch_scheduler import FetchScheduler, FetchSlotTimeout, retry_after_seconds
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert retry_after_seconds('30') == 30
+    assert retry_after_seconds(' -5 ') == 0
+    assert retry_after_seconds('Wed, 01 Jan 2020 00:00:00 GMT') == 0  # дата в прошлом
+    assert retry_after_seconds('soon') is None
+    assert retry_after_seconds(None) is None
+
+
+def test_domain_limit_blocks_extra_request_to_same_domain():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=1, interval=0, max_wait=5)
+    with scheduler.slot('https://example.com/a'):
+        # Другой домен не ждёт, тот же — ждёт и сдаётся по таймауту
+        with scheduler.slot('https://example.org/'):
+            assert scheduler.stats()['active'] == 2
+        with pytest.raises(FetchSlotTimeout):
+            with scheduler.slot('https://www.example.com/b', max_wait=0.1):
+                pass
+    assert scheduler.stats()['active'] == 0
+    assert scheduler.stats()['timeouts'] == 1
+
+
+def test_global_limit_is_shared_by_all_domains():
+    scheduler = FetchScheduler(global_limit=1, domain_limit=4, interval=0)
+    with scheduler.slot('https://example.com/'):
+        with pytest.raises(FetchSlotTimeout):
+            with scheduler.slot('https://example.org/', max_wait=0.1):
+                pass
+
+
+def test_waiting_request_gets_slot_when_it_is_released():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=1, interval=0, max_wait=5)
+    acquired = threading.Event()
+
+    def second_request():
+        with scheduler.slot('https://example.com/b'):
+            acquired.set()
+
+    with scheduler.slot('https://example.com/a'):
+        thread = threading.Thread(target=second_request)
+        thread.start()
+        assert not acquired.wait(0.1)
+    assert acquired.wait(5)
+    thread.join()
+    assert scheduler.stats()['waited'] == 1
+
+
+def test_interval_spaces_request_starts_per_domain():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=4, interval=0.2)
+    started = time.monotonic()
+    for _ in range(2):
+        with scheduler.slot('https://example.com/'):
+            pass
+    assert time.monotonic() - started >= 0.19
+
+
+def test_429_pauses_domain_for_retry_after():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=4, interval=0, max_backoff=60)
+    scheduler.report('https://example.com/a', 429, {'retry-after': '30'})
+
+    with pytest.raises(FetchSlotTimeout):
+        with scheduler.slot('https://example.com/b', max_wait=0.1):
+            pass
+    # Пауза касается только этого домена
+    with scheduler.slot('https://example.org/', max_wait=0.1):
+        pass
+    assert scheduler.stats()['backoffs'] == 1
+
+
+def test_backoff_without_header_grows_and_success_resets_it():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=4, interval=0, max_backoff=60)
+    scheduler.report('https://example.com/', 503)
+    first = scheduler._domains['example.com'].paused_until - time.monotonic()
+    scheduler.report('https://example.com/', 503)
+    second = scheduler._domains['example.com'].paused_until - time.monotonic()
+    assert 1 < first <= 2 and 3 < second <= 4
+
+    scheduler.report('https://example.com/', 200)
+    assert scheduler._domains['example.com'].failures == 0
+
+
+def test_backoff_is_capped_by_max_backoff():
+    scheduler = FetchScheduler(global_limit=10, domain_limit=4, interval=0, max_backoff=5)
+    scheduler.report('https://example.com/', 429, {'retry-after': '3600'})
+    assert scheduler._domains['example.com'].paused_until - time.monotonic() <= 5
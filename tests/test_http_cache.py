@@ -0,0 +1,121 @@
+"""Дисковый HTTP-кэш: свежие записи, перепроверка 304 по ETag/Last-Modified и вытеснение LRU."""
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import http_cache
+import http_client
+
+
+def _response(url, status=200, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers or {})
+    response._content = body
+    response.url = url
+    return response
+
+
+class _Server:
+    """Ответы «сайта» по очереди; запросы запоминаются вместе с заголовками."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append((url, dict(headers or {})))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, 'HTTP_CACHE_TTL_SECONDS', 3600)
+    monkeypatch.setattr(http_cache, 'HTTP_CACHE_DOMAIN_TTLS', {})
+    return http_cache.HttpCache(tmp_path / 'http_cache', max_bytes=1024 * 1024)
+
+
+def _age(cache, url, seconds):
+    cache._conn().execute('UPDATE entries SET fetched_at = fetched_at - ? WHERE url = ?', (seconds, url))
+
+
+def test_fresh_entry_is_served_without_network(cache, monkeypatch):
+    url = 'https://example.com/about'
+    server = _Server(_response(url, body=b'<p>About</p>', headers={'Content-Type': 'text/html; charset=utf-8'}))
+    monkeypatch.setattr(http_client, 'get', server.get)
+
+    assert cache.get(url).from_cache is False
+    cached = cache.get(url + '#team')
+    assert cached.from_cache is True and cached.text == '<p>About</p>'
+    assert len(server.requests) == 1
+    assert cache.stats() == {'hits': 1, 'revalidated': 0, 'misses': 1}
+
+
+def test_stale_entry_is_revalidated_with_etag_and_last_modified(cache, monkeypatch):
+    url = 'https://example.com/news'
+    validators = {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+    server = _Server(_response(url, body=b'news v1', headers=validators),
+                     _response(url, status=304, headers={'ETag': '"v1"'}),
+                     _response(url, body=b'news v2', headers={'ETag': '"v2"'}))
+    monkeypatch.setattr(http_client, 'get', server.get)
+    cache.get(url)
+
+    _age(cache, url, 7200)
+    revalidated = cache.get(url)
+    assert revalidated.from_cache is True and revalidated.content == b'news v1'
+    assert server.requests[1][1] == {'If-None-Match': '"v1"', 'If-Modified-Since': validators['Last-Modified']}
+    # 304 продлил запись: следующий запрос снова из кэша без сети
+    assert cache.get(url).from_cache is True
+    assert len(server.requests) == 2
+
+    _age(cache, url, 7200)
+    changed = cache.get(url)
+    assert changed.from_cache is False and changed.content == b'news v2'
+    assert cache.stats() == {'hits': 1, 'revalidated': 1, 'misses': 2}
+
+
+def test_stale_entry_without_validators_is_fetched_again(cache, monkeypatch):
+    url = 'https://example.com/plain'
+    server = _Server(_response(url, body=b'one'), _response(url, body=b'two'))
+    monkeypatch.setattr(http_client, 'get', server.get)
+    cache.get(url)
+
+    _age(cache, url, 7200)
+    assert cache.get(url).content == b'two'
+    assert server.requests[1][1] == {}
+
+
+def test_domain_ttl_overrides_default(monkeypatch):
+    monkeypatch.setattr(http_cache, 'HTTP_CACHE_DOMAIN_TTLS', http_cache._parse_domain_ttls('example.com=60, bad'))
+    monkeypatch.setattr(http_cache, 'HTTP_CACHE_TTL_SECONDS', 3600)
+    assert http_cache.ttl_for_url('https://www.news.example.com/a') == 60
+    assert http_cache.ttl_for_url('https://example.org/') == 3600
+
+
+def test_errors_and_no_store_are_not_cached(cache, monkeypatch):
+    url = 'https://example.com/private'
+    server = _Server(_response(url, status=500, body=b'oops'),
+                     _response(url, body=b'secret', headers={'Cache-Control': 'no-store'}),
+                     _response(url, body=b'secret'))
+    monkeypatch.setattr(http_client, 'get', server.get)
+    for _ in range(3):
+        assert cache.get(url).from_cache is False
+    assert len(server.requests) == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(tmp_path / 'http_cache', max_bytes=250)
+    urls = [f'https://example.com/page-{i}' for i in range(3)]
+    server = _Server(*[_response(url, body=bytes([65 + i]) * 100) for i, url in enumerate(urls)])
+    monkeypatch.setattr(http_client, 'get', server.get)
+
+    cache.get(urls[0])
+    cache.get(urls[1])
+    # page-0 использовалась позже page-1 — вытесняется page-1
+    cache._conn().execute('UPDATE entries SET last_access = last_access + 10 WHERE url = ?', (urls[0],))
+    cache.get(urls[2])
+
+    stored = {row['url'] for row in cache._conn().execute('SELECT url FROM entries')}
+    assert stored == {urls[0], urls[2]}
+    bodies = [path for path in (tmp_path / 'http_cache' / 'bodies').rglob('*') if path.is_file()]
+    assert len(bodies) == 2
@@ -0,0 +1,81 @@
+"""Ограниченная очередь анализа: размер, позиции, снятие задач и уведомления о порядке."""
+import threading
+
+import pytest
+
+from job_queue import AnalysisJobQueue, QueueFullError
+
+
+class _BlockingHandler:
+    """Обработчик, который держит рабочий поток, пока тест не отпустит задачу."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.done = []
+        self.finished = threading.Event()
+
+    def __call__(self, task_id, *args, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        self.done.append((task_id, args, kwargs))
+        self.finished.set()
+
+
+def _queue_with_running_task(handler, changes=None, max_size=2):
+    queue = AnalysisJobQueue(handler, workers=1, max_size=max_size, name='test',
+                             on_pending_change=changes.append if changes is not None else None)
+    queue.submit('running')
+    assert handler.started.wait(5)
+    return queue
+
+
+def test_queue_rejects_jobs_beyond_max_size():
+    handler = _BlockingHandler()
+    try:
+        queue = _queue_with_running_task(handler)
+        assert queue.submit('t1') == 1
+        assert queue.submit('t2') == 2
+        with pytest.raises(QueueFullError):
+            queue.submit('t3')
+        assert queue.stats() == {'queued': 2, 'running': 1, 'workers': 1, 'max_queue': 2}
+    finally:
+        handler.release.set()
+
+
+def test_positions_and_remove():
+    handler = _BlockingHandler()
+    try:
+        queue = _queue_with_running_task(handler, max_size=3)
+        queue.submit('t1')
+        queue.submit('t2')
+        assert queue.position('t2') == 2
+        # Выполняющаяся задача уже не в очереди: снять её нельзя
+        assert queue.position('running') is None
+        assert queue.remove('running') is False
+
+        assert queue.remove('t1') is True
+        assert queue.position('t2') == 1
+        assert queue.pending() == ['t2']
+    finally:
+        handler.release.set()
+
+
+def test_pending_change_reports_order_and_handler_gets_arguments():
+    handler = _BlockingHandler()
+    changes = []
+    queue = _queue_with_running_task(handler, changes)
+    queue.submit('t1', 'https://example.com', crawl_options={'max_pages': 5})
+    queue.remove('t1')
+    queue.submit('t2', 'https://example.org')
+    handler.finished.clear()
+    handler.release.set()
+    for _ in range(2):
+        assert handler.finished.wait(5)
+        handler.finished.clear()
+        if len(handler.done) == 2:
+            break
+
+    # Постановка 'running' -> [running], взятие в работу -> [], затем t1, снятие t1, t2, взятие t2
+    assert changes == [['running'], [], ['t1'], [], ['t2'], []]
+    assert handler.done == [('running', (), {}), ('t2', ('https://example.org',), {})]
@@ -0,0 +1,49 @@
+"""SimHash-отпечатки страниц и индекс почти одинаковых страниц."""
+from near_duplicates import NEAR_DUP_MIN_WORDS, NearDuplicateIndex, hamming_distance, simhash
+
+_WORDS = ('компания производит трубы насосы арматуру для нефтегазовой отрасли поставляет оборудование '
+          'в регионы россии и снг ведёт сервисное обслуживание имеет собственные лаборатории и склады').split()
+
+
+def _text(seed, words=400):
+    # Детерминированный «текст страницы»: слова словаря в псевдослучайном порядке
+    state = seed + 1
+    result = []
+    for _ in range(words):
+        state = (state * 1103515245 + 12345) % 2 ** 31
+        result.append(_WORDS[state % len(_WORDS)])
+    return ' '.join(result)
+
+
+def test_short_texts_have_no_fingerprint():
+    assert simhash(' '.join(_WORDS[:NEAR_DUP_MIN_WORDS - 1])) is None
+    assert simhash('') is None
+
+
+def test_small_edit_keeps_fingerprint_close():
+    page = _text(0)
+    print_version = page + ' версия для печати'
+    other = _text(3)
+    assert hamming_distance(simhash(page), simhash(print_version)) <= 3
+    assert hamming_distance(simhash(page), simhash(other)) > 3
+    # Регистр не влияет на отпечаток
+    assert simhash(page.upper()) == simhash(page)
+
+
+def test_index_reports_first_page_for_near_duplicates():
+    index = NearDuplicateIndex(max_distance=3)
+    page = _text(0)
+    assert index.check('https://example.com/about', page) is None
+    assert index.check('https://example.com/about?print=1', page + ' версия для печати') == 'https://example.com/about'
+    assert index.check('https://example.com/other', _text(3)) is None
+    # Повторная проверка той же страницы не считается дубликатом самой себя
+    assert index.check('https://example.com/about', page) is None
+    assert index.skipped == 1
+
+
+def test_disabled_index_never_reports_duplicates():
+    index = NearDuplicateIndex(max_distance=0)
+    assert not index.enabled
+    index.check('https://example.com/a', _text(0))
+    assert index.check('https://example.com/b', _text(0)) is None
+    assert index.skipped == 0
@@ -0,0 +1,21 @@
+"""Ссылки отчёта: whitelist проверенных путей и битые URL из ответа LLM."""
+import pytest
+
+main = pytest.importorskip('main')
+
+
+def test_malformed_url_is_not_verified():
+    assert main._url_is_verified('https://[bad', {'x'}) is False
+
+
+def test_malformed_url_does_not_drop_markdown_whitelist():
+    text = '[О компании](https://example.com/about) [Битая](https://[bad) https://example.com/contacts'
+    keys = main._extract_url_keys_from_markdown(text)
+    assert main._url_key('https://example.com/about') in keys
+    assert main._url_key('https://example.com/contacts') in keys
+
+
+def test_malformed_link_is_reduced_to_label():
+    allowed = {main._url_key('https://example.com/about')}
+    text = '[О компании](https://example.com/about), [Битая](https://[bad)'
+    assert main._sanitize_markdown_links(text, allowed) == '[О компании](https://example.com/about), Битая'
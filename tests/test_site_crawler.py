@@ -0,0 +1,91 @@
+"""Бюджет обхода сайта: параметры из запроса, остановка по исчерпанию (stall_pages) и по флагу извне (stop_event)."""
+import threading
+import time
+
+import site_crawler
+from page_store import PageSnapshot
+
+
+def _seed_page(links):
+    html = ''.join(f'<a href="{link}">Раздел</a>' for link in links)
+    return PageSnapshot('https://example.com/', 'https://example.com/', 200,
+                        {'content-type': 'text/html'}, f'<nav>{html}</nav>')
+
+
+def _crawl(monkeypatch, fetch, links=(), sitemap_urls=None, stall_pages=3, stop_event=None):
+    fetched = []
+
+    def fake_fetch(url, base_host, timeout, known_hash=None, duplicates=None):
+        fetched.append(url)
+        return fetch(url)
+
+    monkeypatch.setattr(site_crawler, '_fetch_page_links', fake_fetch)
+    if sitemap_urls is not None:
+        monkeypatch.setattr(site_crawler, 'discover_sitemap_urls', lambda *args, **kwargs: list(sitemap_urls))
+    site_crawler.discover_site_urls('https://example.com/', max_pages=50, workers=1, stall_pages=stall_pages,
+                                    seed_page=_seed_page(links), use_sitemaps=sitemap_urls is not None,
+                                    use_graph=False, stop_event=stop_event)
+    return fetched
+
+
+def test_pages_linking_only_to_known_urls_stop_crawl(monkeypatch):
+    links = [f'https://example.com/section-{i}' for i in range(10)]
+    # Каждая страница ссылается только на уже найденные разделы — новых ссылок нет
+    fetched = _crawl(monkeypatch, lambda url: site_crawler._FetchedPage(url, [(link, True) for link in links], 100),
+                     links)
+    assert len(fetched) == 3
+
+
+def test_sitemap_urls_do_not_stop_crawl_early(monkeypatch):
+    # Все разделы заранее известны из карты сайта, но ссылку на следующий раздел
+    # обход видит впервые на странице предыдущего — это прогресс
+    sections = [f'https://example.com/section-{i}' for i in range(10)]
+
+    def fetch(url):
+        i = sections.index(url)
+        links = [(sections[i + 1], False)] if i + 1 < len(sections) else []
+        return site_crawler._FetchedPage(url, links, 100)
+
+    fetched = _crawl(monkeypatch, fetch, sitemap_urls=sections)
+    assert sorted(fetched) == sorted(sections)
+
+
+def test_dead_links_stop_crawl(monkeypatch):
+    links = [f'https://example.com/missing-{i}' for i in range(10)]
+    fetched = _crawl(monkeypatch, lambda url: None, links)
+    assert len(fetched) == 3
+
+
+def test_stop_event_ends_crawl_without_waiting_for_fetches(monkeypatch):
+    stop_event = threading.Event()
+    release = threading.Event()
+
+    def fetch(url):
+        # Анализ отменён, пока запрос к сайту ещё идёт
+        stop_event.set()
+        release.wait(5)
+        return site_crawler._FetchedPage(url, [], 100)
+
+    links = [f'https://example.com/section-{i}' for i in range(10)]
+    started = time.monotonic()
+    try:
+        fetched = _crawl(monkeypatch, fetch, links, stop_event=stop_event)
+    finally:
+        release.set()
+    assert len(fetched) == 1
+    assert time.monotonic() - started < 3
+
+
+def test_parse_crawl_options_validates_budget():
+    assert site_crawler.parse_crawl_options(None) == ({}, None)
+    assert site_crawler.parse_crawl_options({'max_pages': 80, 'time_budget': 60.0, 'max_mb': 10, 'stall_pages': None}) == (
+        {'max_pages': 80, 'time_budget': 60, 'max_bytes': 10 * 1024 * 1024}, None)
+
+    for raw in ({'max_pages': 0}, {'max_pages': 501}, {'time_budget': 4}, {'max_mb': 201}, {'stall_pages': 101}):
+        options, error = site_crawler.parse_crawl_options(raw)
+        assert options is None and 'должно быть от' in error
+    for raw in ({'max_pages': '80'}, {'max_pages': 1.5}, {'stall_pages': True}):
+        options, error = site_crawler.parse_crawl_options(raw)
+        assert options is None and 'целым числом' in error
+    assert site_crawler.parse_crawl_options({'depth': 3}) == (None, 'Неизвестные параметры crawl: depth')
+    assert site_crawler.parse_crawl_options([80]) == (None, 'crawl должен быть объектом')
@@ -0,0 +1,51 @@
+"""Чтение карты сайта в очереди fetch_scheduler."""
+import time
+
+import fetch_scheduler
+import http_client
+import sitemap_discovery
+
+
+class _StreamedResponse:
+    status_code = 200
+    headers = {'content-type': 'application/xml'}
+    url = 'https://example.com/sitemap.xml'
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        yield from self._chunks
+
+    def close(self):
+        self.closed = True
+
+
+class _Session:
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, url, **kwargs):
+        assert kwargs.get('stream') is True
+        return self.response
+
+
+def test_sitemap_slot_is_held_until_body_is_read(monkeypatch):
+    scheduler = fetch_scheduler.FetchScheduler(interval=0)
+    monkeypatch.setattr(fetch_scheduler, '_scheduler', scheduler)
+    response = _StreamedResponse([
+        b'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+        b'<url><loc>https://example.com/about</loc></url>',
+        b'<url><loc>https://example.com/contacts</loc></url></urlset>',
+    ])
+    monkeypatch.setattr(http_client, 'get_session', lambda: _Session(response))
+
+    locs = sitemap_discovery._iter_sitemap_locs(response.url, timeout=5, deadline=time.monotonic() + 30)
+    assert next(locs) == ('urlset', 'https://example.com/about')
+    # Тело ещё читается: слот домена занят
+    assert scheduler.stats()['active'] == 1
+
+    assert list(locs) == [('urlset', 'https://example.com/contacts')]
+    assert scheduler.stats()['active'] == 0
+    assert response.closed
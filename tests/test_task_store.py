@@ -0,0 +1,125 @@
+"""Переходы статусов задачи в TaskStore."""
+import pytest
+
+from task_store import TaskStore
+
+
+QUEUED = {'status': 'queued', 'progress': 0, 'message': 'Задача поставлена в очередь...'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TaskStore(tmp_path / 'tasks.sqlite3')
+
+
+def test_start_processing_takes_queued_task_once(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+
+    assert store.start_processing('t1', 'Анализ запущен...') == 1
+    assert store.get_status('t1')['status'] == 'processing'
+    # Второй рабочий поток (или повторный запуск) ту же задачу не берёт
+    assert store.start_processing('t1', 'Анализ запущен...') == 0
+
+
+def test_start_processing_keeps_cancel_that_came_first(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+    assert store.request_cancel('t1') == 'cancelled'
+
+    assert store.start_processing('t1', 'Анализ запущен...') == 0
+    assert store.get_status('t1')['status'] == 'cancelled'
+
+
+def test_start_processing_unknown_task(store):
+    assert store.start_processing('missing', 'Анализ запущен...') == 0
+
+
+def test_queue_positions_keep_waiting_task_alive(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+    store.set_status('t2', dict(QUEUED), url='https://example.org')
+    # Обе задачи давно не обновлялись; t1 по-прежнему в живой очереди
+    store._conn().execute("UPDATE tasks SET updated_at = updated_at - 3600")
+
+    store.set_queue_positions(['t1'])
+
+    assert store.fail_stale_tasks(60, 'Ошибка: анализ прерван') == 1
+    assert store.get_status('t1')['status'] == 'queued'
+    assert store.get_status('t2')['status'] == 'error'
+
+
+COMPLETED = {'status': 'completed', 'progress': 100, 'message': 'Анализ завершен', 'cost': 1.5}
+CANCELLED = {'status': 'cancelled', 'progress': 0, 'message': 'Анализ отменён', 'cost': 1.5}
+
+
+def test_finish_processing_completes_running_task(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+    store.start_processing('t1', 'Анализ запущен...')
+
+    assert store.finish_processing('t1', dict(COMPLETED), cancelled=dict(CANCELLED)) == 'completed'
+    assert store.get_status('t1')['status'] == 'completed'
+
+
+def test_finish_processing_keeps_late_cancel(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+    store.start_processing('t1', 'Анализ запущен...')
+    # DELETE пришёл после последней проверки отмены рабочим потоком
+    assert store.request_cancel('t1') == 'cancelling'
+
+    assert store.finish_processing('t1', dict(COMPLETED), cancelled=dict(CANCELLED)) == 'cancelled'
+    status = store.get_status('t1')
+    assert status['status'] == 'cancelled' and status['cost'] == 1.5
+
+
+def test_finish_processing_ignores_task_that_is_not_running(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+
+    assert store.finish_processing('t1', dict(COMPLETED)) is None
+    assert store.get_status('t1')['status'] == 'queued'
+
+
+def test_cancel_of_shared_task_waits_for_last_subscriber(store):
+    status = dict(QUEUED)
+    assert store.create_task_if_idle('t1', 'https://example.com', 'example.com', status, stale_after=60) == ('t1', True)
+    # Второй запрос того же сайта присоединяется к идущей задаче
+    assert store.create_task_if_idle('t2', 'https://example.com', 'example.com', status, stale_after=60) == ('t1', False)
+    store.start_processing('t1', 'Анализ запущен...')
+
+    assert store.request_cancel('t1') == 'processing'
+    assert store.is_cancel_requested('t1') is False
+    assert store.request_cancel('t1') == 'cancelling'
+    assert store.is_cancel_requested('t1') is True
+
+
+def test_subscribers_column_is_added_to_old_database(tmp_path):
+    import sqlite3
+
+    db_path = tmp_path / 'tasks.sqlite3'
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("""
+        CREATE TABLE tasks (task_id TEXT PRIMARY KEY, url TEXT, url_key TEXT, status TEXT NOT NULL,
+                            progress INTEGER NOT NULL DEFAULT 0, message TEXT, cost REAL, initial_balance REAL,
+                            queue_position INTEGER, extra TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)
+    """)
+    conn.execute("INSERT INTO tasks (task_id, status, created_at, updated_at) VALUES ('old', 'queued', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    store = TaskStore(db_path)
+    assert store.request_cancel('old') == 'cancelled'
+
+
+def test_update_status_changes_only_given_fields(store):
+    store.set_status('t1', dict(QUEUED), url='https://example.com')
+    store.start_processing('t1', 'Анализ запущен...')
+    store.update_progress('t1', 40, 'Сбор данных...', eta_seconds=90)
+    # Отмену записал другой процесс — частичное обновление её не затирает
+    assert store.request_cancel('t1') == 'cancelling'
+
+    assert store.update_status('t1', cost=2.5, stage='report', details={'pages': 3}) is True
+    status = store.get_status('t1')
+    assert status['status'] == 'cancelling'
+    assert status['progress'] == 40 and status['eta_seconds'] == 90
+    assert status['cost'] == 2.5 and status['stage'] == 'report' and status['details'] == {'pages': 3}
+
+    assert store.update_status('t1', message='Отмена...') is True
+    assert store.get_status('t1')['stage'] == 'report'
+    assert store.update_status('missing', cost=1) is False
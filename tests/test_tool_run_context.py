@@ -0,0 +1,142 @@
+"""
+Контекст анализа у инструментов агентов: CrewAI выполняет агентов с max_execution_time
+в отдельном потоке, поэтому отмена и страницы задачи должны быть видны инструменту из любого потока.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from crew_progress import (
+    CrewProgressReporter, ToolRunContext, attach_run_context, is_tool_cancelled, lookup_tool_page,
+    tool_near_duplicate_of,
+)
+
+
+class _Tool:
+    pass
+
+
+# Текст длиннее NEAR_DUP_MIN_WORDS: у коротких страниц отпечатки не сравниваются
+_ABOUT_TEXT = ' '.join(
+    f"Компания производит оборудование для нефтегазовой отрасли, раздел {i}." for i in range(12)
+)
+
+
+def _call_in_other_thread(func, *args):
+    # Как Agent._execute_with_timeout в CrewAI: новый пул потоков на каждый запуск агента
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, *args).result()
+
+
+def test_cancel_is_visible_from_another_thread():
+    cancel_event = threading.Event()
+    tool = _Tool()
+    attach_run_context([tool], ToolRunContext(cancel_event.is_set))
+
+    assert _call_in_other_thread(is_tool_cancelled, tool) is False
+    cancel_event.set()
+    assert _call_in_other_thread(is_tool_cancelled, tool) is True
+
+    attach_run_context([tool], None)
+    assert _call_in_other_thread(is_tool_cancelled, tool) is False
+
+
+def test_tool_without_context_is_not_cancelled():
+    assert is_tool_cancelled(_Tool()) is False
+
+
+def test_cancelled_crew_tool_called_from_another_thread():
+    pytest.importorskip('crewai')
+    import Agents_crew
+
+    if Agents_crew.ExtractSiteLinksTool is None:
+        pytest.skip('ExtractSiteLinksTool недоступен')
+    tool = Agents_crew.ExtractSiteLinksTool()
+    crew = SimpleNamespace(agents=[SimpleNamespace(tools=[tool], step_callback=None)], tasks=[])
+    reporter = CrewProgressReporter(lambda *args: None, is_cancelled=lambda: True)
+
+    Agents_crew.configure_crew_progress(crew, reporter)
+    assert _call_in_other_thread(tool._run, 'https://example.com/') == Agents_crew.CANCELLED_TOOL_RESULT
+
+    Agents_crew.configure_crew_progress(crew, None)
+    assert is_tool_cancelled(tool) is False
+
+
+def test_task_pages_are_visible_from_another_thread():
+    from page_store import PageSnapshot, TaskPageStore
+
+    store = TaskPageStore()
+    store.put(PageSnapshot('https://example.com', 'https://www.example.com/', 200,
+                           {'content-type': 'text/html'}, '<a href="/about">О компании</a>'))
+    tool = _Tool()
+    attach_run_context([tool], ToolRunContext(page_store=store))
+
+    page = _call_in_other_thread(lookup_tool_page, tool, 'https://example.com/')
+    assert page is not None and page.final_url == 'https://www.example.com/'
+    assert store.hits == 1
+
+    attach_run_context([tool], None)
+    assert _call_in_other_thread(lookup_tool_page, tool, 'https://example.com/') is None
+
+
+def test_crew_tool_reads_seed_page_from_another_thread():
+    pytest.importorskip('crewai')
+    import Agents_crew
+    from page_store import PageSnapshot, TaskPageStore
+
+    if Agents_crew.ExtractSiteLinksTool is None:
+        pytest.skip('ExtractSiteLinksTool недоступен')
+    store = TaskPageStore()
+    # Домен .invalid не резолвится: ответ возможен только из хранилища задачи
+    store.put(PageSnapshot('https://example.invalid/', 'https://example.invalid/', 200,
+                           {'content-type': 'text/html'}, '<nav><a href="/about">О компании</a></nav>'))
+    tool = Agents_crew.ExtractSiteLinksTool()
+    crew = SimpleNamespace(agents=[SimpleNamespace(tools=[tool], step_callback=None)], tasks=[])
+    reporter = CrewProgressReporter(lambda *args: None, is_cancelled=lambda: False)
+
+    Agents_crew.configure_crew_progress(crew, reporter, page_store=store)
+    result = _call_in_other_thread(tool._run, 'https://example.invalid/')
+    assert 'https://example.invalid/about' in result
+    assert store.hits == 1
+
+
+def test_near_duplicates_are_checked_from_another_thread():
+    from page_store import TaskPageStore
+
+    store = TaskPageStore()
+    tool = _Tool()
+    attach_run_context([tool], ToolRunContext(page_store=store))
+
+    assert _call_in_other_thread(tool_near_duplicate_of, tool, 'https://example.com/about', _ABOUT_TEXT) is None
+    assert _call_in_other_thread(
+        tool_near_duplicate_of, tool, 'https://example.com/about?print=1', _ABOUT_TEXT,
+    ) == 'https://example.com/about'
+    assert store.duplicates.skipped == 1
+
+    attach_run_context([tool], None)
+    assert tool_near_duplicate_of(tool, 'https://example.com/about?print=1', _ABOUT_TEXT) is None
+
+
+def test_crew_scrape_tool_collapses_near_duplicate_from_another_thread():
+    pytest.importorskip('crewai')
+    import Agents_crew
+    from page_store import PageSnapshot, TaskPageStore
+
+    if Agents_crew.SeededScrapeWebsiteTool is None:
+        pytest.skip('SeededScrapeWebsiteTool недоступен')
+    store = TaskPageStore()
+    # Домен .invalid не резолвится: обе страницы отдаются из хранилища задачи
+    for url in ('https://example.invalid/about', 'https://example.invalid/about?print=1'):
+        store.put(PageSnapshot(url, url, 200, {'content-type': 'text/html'}, f'<main><p>{_ABOUT_TEXT}</p></main>'))
+    tool = Agents_crew.SeededScrapeWebsiteTool()
+    crew = SimpleNamespace(agents=[SimpleNamespace(tools=[tool], step_callback=None)], tasks=[])
+    reporter = CrewProgressReporter(lambda *args: None, is_cancelled=lambda: False)
+
+    Agents_crew.configure_crew_progress(crew, reporter, page_store=store)
+    first = _call_in_other_thread(lambda: tool._run(website_url='https://example.invalid/about'))
+    second = _call_in_other_thread(lambda: tool._run(website_url='https://example.invalid/about?print=1'))
+    assert 'нефтегазовой' in first
+    assert 'почти полностью совпадает' in second and 'https://example.invalid/about ' in second
+    assert store.duplicates.skipped == 1
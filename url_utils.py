@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Нормализация URL и ключи для whitelist ссылок отчёта
+
+Разбор и ключи URL мемоизированы (lru_cache с пределом URL_CACHE_SIZE на функцию):
+одни и те же адреса проверяются при обходе сайта, фильтрации ссылок отчёта и экспорте
+в DOCX. Кэш общий для потоков процесса; счётчики попаданий — url_cache_stats().
+"""
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# Сколько последних URL помнит каждая мемоизированная функция
+URL_CACHE_SIZE = 16384
+
+
+def normalize_url(url):
+    """Добавляет https:// для URL без схемы (www.example.com → https://www.example.com)."""
+    if not url or not url.strip():
+        return url
+    u = url.strip()
+    if not u.startswith(('http://', 'https://', 'mailto:', '#')):
+        if u.startswith('www.'):
+            return 'https://' + u
+        if u.startswith(('/')):
+            return u  # относительный путь — не нормализуем
+    return u
+
+
+def hostname_base(host):
+    if not host:
+        return ''
+    h = host.lower()
+    if h.startswith('www.'):
+        return h[4:]
+    return h
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def parse_url(url):
+    """urlparse с мемоизацией (результат — неизменяемый ParseResult)."""
+    return urlparse(url)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def url_host(url):
+    """Хост URL без www в нижнем регистре ('' для относительных и некорректных адресов)."""
+    try:
+        return hostname_base(parse_url(normalize_url((url or '').strip())).hostname or '')
+    except ValueError:
+        return ''
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def canonical_url_key(url):
+    """Ключ URL для whitelist: хост без www, путь без лишнего слэша, query."""
+    u = normalize_url((url or '').strip())
+    p = parse_url(u)
+    host = hostname_base(p.hostname or '')
+    path = (p.path or '/').rstrip('/') or '/'
+    q = p.query or ''
+    return (host, path, q)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def url_key(url):
+    """
+    Строковый ключ canonical_url_key: хост без www + путь + query (example.com/about?x=1).
+    Один ключ покрывает варианты с www и без, со слэшем и без, http и https — им проверяются
+    ссылки отчёта (verified_url_keys) и адресуются узлы графа сайта.
+    """
+    host, path, query = canonical_url_key(url)
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+_CACHED = (parse_url, url_host, canonical_url_key, url_key)
+
+
+def url_cache_stats():
+    """Попадания и промахи мемоизированных функций URL с начала работы процесса."""
+    infos = [f.cache_info() for f in _CACHED]
+    hits = sum(i.hits for i in infos)
+    misses = sum(i.misses for i in infos)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        'size': sum(i.currsize for i in infos),
+    }